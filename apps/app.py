@@ -1,6 +1,8 @@
 import dash
 import dash_bootstrap_components as dbc
 
+from result_store import init_result_store
+
 
 app = dash.Dash(
     __name__,
@@ -10,3 +12,5 @@ app = dash.Dash(
 
 server = app.server
 app.config.suppress_callback_exceptions = True
+# results of the simulations stay on the server, keyed by a per-browser session cookie (see result_store.py)
+init_result_store(server)
@@ -0,0 +1,290 @@
+import os
+import pathlib
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from dash import dcc
+from dash import html
+from dash.dependencies import Input, Output, State
+
+from result_store import get_session_id
+
+# job states stored in the broker
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# finished jobs (and their result files) older than this are removed when a new job is submitted
+JOB_MAX_AGE = 24 * 3600
+# job ids are uuid4 hex strings, a job id coming from the browser is checked against this before any use
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# (db_path, job_id, step index, number of steps) of the job running in this worker process, see report_progress
+_current_job = None
+
+
+def is_valid_job_id(job_id):
+    return isinstance(job_id, str) and JOB_ID_PATTERN.match(job_id) is not None
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _update_job(db_path, job_id, **fields):
+    fields["updated"] = time.time()
+    columns = ", ".join("{} = ?".format(name) for name in fields)
+    with _connect(db_path) as conn:
+        conn.execute("UPDATE jobs SET {} WHERE id = ?".format(columns), list(fields.values()) + [job_id])
+    conn.close()
+
+
+def _is_cancel_requested(db_path, job_id):
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id, )).fetchone()
+    conn.close()
+    return row is not None and bool(row["cancel_requested"])
+
+
+def report_progress(progress, message=""):
+    """
+    called from a job (in its worker process) to publish its progress (0 to 1), raises JobCancelled when the job was
+    cancelled in the meantime; does nothing outside a job
+    """
+    if _current_job is None:
+        return
+    db_path, job_id, _, _ = _current_job
+    if _is_cancel_requested(db_path, job_id):
+        raise JobCancelled()
+    _update_job(db_path, job_id, progress=float(progress), message=message)
+
+
+def report_step_progress(fraction, message=""):
+    """
+    progress (0 to 1) within the current step of a job, passed as the progress argument of the simulation functions
+    run as steps; raises JobCancelled when the job was cancelled, does nothing outside a job
+    """
+    if _current_job is None:
+        return
+    _, _, step_index, num_steps = _current_job
+    report_progress((step_index + float(fraction)) / num_steps, message)
+
+
+def _run_job(db_path, job_id, result_file, step_list):
+    """
+    run the steps of a job one after the other in a worker process, the list of their results is pickled to
+    result_file; progress is reported after every step and cancellation checked before every step
+    """
+    global _current_job
+    _current_job = (db_path, job_id, 0, len(step_list))
+    try:
+        if _is_cancel_requested(db_path, job_id):
+            raise JobCancelled()
+        _update_job(db_path, job_id, status=RUNNING)
+        results = []
+        for idx, (message, func, args, kwargs) in enumerate(step_list):
+            _current_job = (db_path, job_id, idx, len(step_list))
+            report_progress(idx / len(step_list), message)
+            results.append(func(*args, **kwargs))
+
+        temp_file = result_file.with_suffix(".pkl.tmp")
+        with open(str(temp_file), "wb") as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(temp_file), str(result_file))
+        _update_job(db_path, job_id, status=DONE, progress=1.0, message="done")
+    except JobCancelled:
+        _update_job(db_path, job_id, status=CANCELLED, message="cancelled")
+    except Exception:
+        _update_job(db_path, job_id, status=FAILED, message="failed", error=traceback.format_exc())
+    finally:
+        _current_job = None
+
+
+class JobQueue:
+    """
+    runs long simulations in a process pool instead of the request thread; jobs and their progress live in a local
+    SQLite file, results are pickled next to it, so any server thread (or process) can poll a job by its id
+    """
+    def __init__(self, job_dir="Input/cache/jobs", max_workers=None):
+        base_path = pathlib.Path(__file__).resolve().parents[1]
+        self.job_dir = base_path.joinpath(job_dir)
+        self.max_workers = max_workers
+        self.executor = None
+        self.futures = dict()
+        self.lock = threading.Lock()
+
+    @property
+    def db_path(self):
+        return self.job_dir.joinpath("jobs.sqlite3")
+
+    def configure(self, job_dir=None, max_workers=None):
+        with self.lock:
+            if job_dir is not None:
+                base_path = pathlib.Path(__file__).resolve().parents[1]
+                self.job_dir = base_path.joinpath(job_dir)
+            if max_workers is not None:
+                self.max_workers = max_workers
+
+    def _get_executor(self):
+        # created on the first job, so the worker processes are forked after all the data of the pages are loaded
+        with self.lock:
+            if self.executor is None:
+                self.job_dir.mkdir(parents=True, exist_ok=True)
+                with _connect(self.db_path) as conn:
+                    conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, session TEXT, name TEXT, "
+                                 "status TEXT, progress REAL, message TEXT, error TEXT, cancel_requested INTEGER, "
+                                 "created REAL, updated REAL)")
+                conn.close()
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def _get_result_file(self, job_id):
+        return self.job_dir.joinpath(job_id + ".pkl")
+
+    def submit(self, name, step_list, session_id=None):
+        """
+        queue a job made of step_list, [(message, func, args, kwargs), ...] with module-level (picklable) functions,
+        and return its id; the result of the job is the list of the results of its steps
+        a step is only stopped by a cancellation when it reports its progress, pass report_step_progress as the
+        progress argument of the functions that take one
+        """
+        executor = self._get_executor()
+        self.remove_old_jobs()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, session_id, name, QUEUED, 0.0, "queued", None, 0, now, now))
+        conn.close()
+        future = executor.submit(_run_job, self.db_path, job_id, self._get_result_file(job_id), step_list)
+        with self.lock:
+            self.futures[job_id] = future
+        future.add_done_callback(lambda f: self._forget_future(job_id))
+        return job_id
+
+    def _forget_future(self, job_id):
+        with self.lock:
+            self.futures.pop(job_id, None)
+
+    def get_status(self, job_id, session_id=None):
+        """
+        dict with status, progress, message and error of the job, None for an unknown job, a malformed id or a job
+        submitted by another session than session_id (if given)
+        """
+        if not is_valid_job_id(job_id) or not self.db_path.exists():
+            return None
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT session, status, progress, message, error FROM jobs WHERE id = ?",
+                               (job_id, )).fetchone()
+        conn.close()
+        if row is None or (session_id is not None and row["session"] != session_id):
+            return None
+        status = dict(row)
+        del status["session"]
+        return status
+
+    def get_result(self, job_id, session_id=None):
+        """
+        the result of a finished job, raises KeyError for a malformed id or a job of another session
+        """
+        if self.get_status(job_id, session_id) is None:
+            raise KeyError("unknown job {!r}".format(job_id))
+        with open(str(self._get_result_file(job_id)), "rb") as f:
+            return pickle.load(f)
+
+    def cancel(self, job_id, session_id=None):
+        """
+        a queued job never starts, a running job stops at its next progress report
+        """
+        if self.get_status(job_id, session_id) is None:
+            return
+        with self.lock:
+            future = self.futures.get(job_id)
+        with _connect(self.db_path) as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id, ))
+        conn.close()
+        if future is not None and future.cancel():
+            _update_job(self.db_path, job_id, status=CANCELLED, message="cancelled")
+
+    def remove_old_jobs(self, max_age=JOB_MAX_AGE):
+        placeholders = ", ".join("?" * len(FINISHED_STATES))
+        with _connect(self.db_path) as conn:
+            rows = conn.execute("SELECT id FROM jobs WHERE updated < ? AND status IN ({})".format(placeholders),
+                                (time.time() - max_age, ) + FINISHED_STATES).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"], ) for row in rows])
+        conn.close()
+        for row in rows:
+            result_file = self._get_result_file(row["id"])
+            if result_file.exists():
+                result_file.unlink()
+
+
+job_queue = JobQueue()
+
+
+def configure_job_queue(param_dict):
+    """
+    optional parameters: job_workers (number of worker processes, default: number of CPUs) and job_dir
+    """
+    max_workers = int(param_dict['job_workers']) if 'job_workers' in param_dict else None
+    job_queue.configure(param_dict.get('job_dir'), max_workers)
+
+
+def format_job_status(status):
+    if status is None:
+        return ""
+    if status["status"] == FAILED:
+        return "Simulation failed: {}".format((status["error"] or "").strip().split("\n")[-1])
+    if status["status"] == RUNNING:
+        return "Running: {} ({:.0f}%)".format(status["message"], 100 * status["progress"])
+    return "{}".format(status["message"]).capitalize()
+
+
+def job_components(prefix, interval=1000):
+    """
+    the components a page needs to follow a job: <prefix>-job-id (Store), <prefix>-job-interval (polling),
+    <prefix>-job-status (progress text), <prefix>-job-cancel-btn and <prefix>-job-cancel (Store written on cancel)
+    the submitting callback only writes <prefix>-job-id, the polling callback takes it as an input and is the only
+    one to set <prefix>-job-interval.disabled (a Dash output has a single callback)
+    """
+    return html.Div(
+        [
+            dcc.Store(id=prefix + "-job-id"),
+            dcc.Store(id=prefix + "-job-cancel"),
+            dcc.Interval(id=prefix + "-job-interval", interval=interval, disabled=True),
+            html.Span(id=prefix + "-job-status", style={"margin-right": 10}),
+            html.Button("Cancel", id=prefix + "-job-cancel-btn", n_clicks=0),
+        ],
+        style={"margin-top": 5, "margin-bottom": 5},
+    )
+
+
+def register_cancel_callback(app, prefix):
+    """
+    cancel the job of <prefix>-job-id when <prefix>-job-cancel-btn is clicked, the polling callback then shows it
+    """
+    @app.callback(
+        Output(prefix + "-job-cancel", "data"),
+        Input(prefix + "-job-cancel-btn", "n_clicks"),
+        State(prefix + "-job-id", "data"),
+    )
+    def cancel_job(n_clicks, job_id):
+        if n_clicks:
+            job_queue.cancel(job_id, get_session_id())
+        return n_clicks
@@ -24,13 +24,16 @@ from dash import callback_context
 # import dash_uploader as du
 
 from simulate_1D.read_parameters import read_param
-from simulate_1D.read_1d_spectra import read_1d_data
+from simulate_1D.hmdb_names import load_hmdb_name_index
+from simulate_1D.random_streams import get_seed_sequence, get_child_rng
+from simulate_1D.read_1d_spectra import read_1d_data, read_1d_data_with_cache
 from simulate_1D.match_names import input_match_db, input_corr_match_db, format_input_mixture, db_match_cons, \
     input_cons_match_db, db_names_match_hmdb, db_names_match_hmdb_names
-from simulate_1D.construct_hmdb_avg_cons import get_hmdb_normal_avg_cons, get_hmdb_abnormal_avg_cons
-from simulate_1D.sample_concentrations import simulate_concentrations, simulate_continuous_concentrations
+from simulate_1D.construct_hmdb_avg_cons import load_hmdb_cons_table_with_cache
+from simulate_1D.sample_concentrations import simulate_concentrations, simulate_continuous_concentrations, \
+    pos_normal_no_correlated
 from simulate_1D.preprocess_1d_spectra import remove_water_calibration, baseline_correction, smooth_spectra, norm_spectra
-from simulate_1D.peak_detection_1d import get_peak_cluster_acid_base_list
+from simulate_1D.peak_detection_1d import get_peak_cluster_acid_base_list, get_peak_cluster_cache_file
 from simulate_1D.calculate_1d_without_peak_shift import simulate_mixture_for_all_repli, \
     simulate_continuous_mixture_for_all_repli, sum_mixture_spectra_with_albumin_for_all_repli
 from simulate_1D.calculate_1d_with_peak_shift import simulate_mixture_with_peak_shift_for_all_repli, \
@@ -41,6 +44,9 @@ from simulate_1D.plot_1d_spectra import plot_all_metabolites, plot_mean_spectra,
 
 
 from app import app
+from result_store import use_result_store, configure_result_store, get_session_id
+from job_queue import job_queue, job_components, register_cancel_callback, configure_job_queue, \
+    format_job_status, report_step_progress, DONE, FINISHED_STATES
 
 # remove
 tracemalloc.start()
@@ -49,9 +55,13 @@ parser = argparse.ArgumentParser()
 parser.add_argument("-p", "--parameter", dest="parameter_file", required=True, help="Input Parameter Files")
 args = parser.parse_args()
 param_dict = read_param(args.parameter_file)
+configure_result_store(param_dict)
+configure_job_queue(param_dict)
 file_path_1d = param_dict['file_path_1D']
 sop_type = param_dict['sop_type']
 pulseProgram_type = param_dict['pulseProgrm_type']
+# optional seed of all random draws (concentrations, pH, pKa, delta_acid_base, noise), without it every run differs
+simulation_seed = int(param_dict['seed']) if 'seed' in param_dict else None
 
 # read data_dict, concentrations, protons, hmdb_dict
 base_path = pathlib.Path(__file__).resolve().parents[1]
@@ -64,26 +74,22 @@ pka_dict = np.load(str(base_path.joinpath("Input/pka_dict.npy")), allow_pickle=T
 # cons_df_2 = pd.read_csv(base_path.joinpath("Input/cons_df_2.csv"), index_col=0)
 protons_df = pd.read_csv(base_path.joinpath("Input/hmdb_protons.csv"), index_col=0)
 
-with open(base_path.joinpath("Input/hmdb_id_names.json")) as json_file:
-    hmdb_dict = json.load(json_file)
-with open(base_path.joinpath("Input/hmdb_normal_concentrations.json")) as json_file:
-    hmdb_norm_cons_dict = json.load(json_file)
-with open(base_path.joinpath("Input/hmdb_abnormal_concentrations.json")) as json_file:
-    hmdb_abnorm_cons_dict = json.load(json_file)
+# one HMDB ID <-> names index per process, shared by the 1D, JRes and COSY pages (see simulate_1D.hmdb_names)
+hmdb_dict = load_hmdb_name_index(base_path.joinpath("Input/hmdb_id_names.json"))
+# mean / std / unit of every HMDB ID, biospecimen and condition, parsed once (see construct_hmdb_avg_cons.py)
+hmdb_cons_table = load_hmdb_cons_table_with_cache(base_path.joinpath("Input/hmdb_normal_concentrations.json"),
+                                                  base_path.joinpath("Input/hmdb_abnormal_concentrations.json"))
 with open(base_path.joinpath("Input/hmdb_id_pka.json")) as json_file:
     hmdb_id_pka_dict = json.load(json_file)
 
 # raw spectra data without preprocessing
-data_dict, ppm_scale = read_1d_data(file_path_1d, sop_type, pulseProgram_type)  # read 1d data
-# print(np.max(data_dict.keys()))
-# print(data_dict.keys())
-# print(len(data_dict.keys()))
-match_data_dict = db_names_match_hmdb_names(data_dict, hmdb_dict)
+# read 1d data and keep the names matching HMDB, both are cached on disk between restarts
+match_data_dict, ppm_scale = read_1d_data_with_cache(file_path_1d, sop_type, pulseProgram_type, hmdb_dict)
 # print(match_data_dict.keys())
 # print(len(match_data_dict.keys()))
 
 # GenericNMRblood
-albumin_dict, ppm_scale_2 = read_1d_data("Input/Albumin/", "GenericNMRurine", "noesygppr1d")
+albumin_dict, ppm_scale_2 = read_1d_data_with_cache("Input/Albumin/", "GenericNMRurine", "noesygppr1d")
 albumin_remove_data_dict_1 = remove_water_calibration(albumin_dict, ppm_scale_2, [4.67, 4.78], [-0.1, 0.1])
 # albumin_correct_data_dict_1 = baseline_correction(albumin_remove_data_dict_1, 32, 0.1)
 # smooth_data_dict = smooth_spectra(corrected_data_dict, 0.05)
@@ -1378,12 +1384,16 @@ group_1_results_div = dbc.Card(
                 dbc.Row(
                     [
                         dbc.Col(
-                            # mean of replicates spectrum
-                            dcc.Loading(children=[
-                                dcc.Graph(id="group-1-spectra-fig"),
-                                dcc.Store(id='group-1-final-dict')],
-                                type="circle"
-                            ),
+                            [
+                                # the simulation runs as a background job, its progress is polled
+                                job_components("group-1"),
+                                # mean of replicates spectrum
+                                dcc.Loading(children=[
+                                    dcc.Graph(id="group-1-spectra-fig"),
+                                    dcc.Store(id='group-1-final-dict')],
+                                    type="circle"
+                                ),
+                            ],
                             width=11,
                         ),
                         dbc.Col(
@@ -1475,11 +1485,15 @@ group_2_results_div = dbc.Card(
                 dbc.Row(
                     [
                         dbc.Col(
-                            dcc.Loading(children=[
-                                dcc.Graph(id="group-2-spectra-fig"),
-                                dcc.Store(id='group-2-final-dict')],
-                                type="circle"
-                            ),
+                            [
+                                # the simulation runs as a background job, its progress is polled
+                                job_components("group-2"),
+                                dcc.Loading(children=[
+                                    dcc.Graph(id="group-2-spectra-fig"),
+                                    dcc.Store(id='group-2-final-dict')],
+                                    type="circle"
+                                ),
+                            ],
                             width=11,
                         ),
                         dbc.Col(
@@ -4175,11 +4189,7 @@ def update_hmdb_selections(n_clicks, mixture_list):
 def get_name_hmdb_id_dict(in_db_mixture_list):
     db_name_hmdb_id_dict = dict()
     for name in in_db_mixture_list:
-        idx_list = []
-        for idx, name_list in hmdb_dict.items():
-            if name in name_list:
-                idx_list.append({idx: hmdb_dict[idx][0]})
-        db_name_hmdb_id_dict[name] = idx_list
+        db_name_hmdb_id_dict[name] = [{idx: hmdb_dict[idx][0]} for idx in hmdb_dict.get_ids(name)]
     return db_name_hmdb_id_dict
 
 
@@ -4442,8 +4452,8 @@ def update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
         if select_hmdb_data_1 == "hmdb" and select_hmdb_data_2 == "hmdb":
             table_data = []
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_1, avg_std_1, unit_1 = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type_1)
-                avg_mean_2, avg_std_2, unit_2 = get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, bio_type_2)
+                avg_mean_1, avg_std_1, unit_1 = hmdb_cons_table.get_normal_avg_cons(hmdb_id, bio_type_1)
+                avg_mean_2, avg_std_2, unit_2 = hmdb_cons_table.get_abnormal_avg_cons(hmdb_id, bio_type_2)
                 temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id, "mean_1": avg_mean_1, "std_1": avg_std_1,
                              "mean_2": avg_mean_2, "std_2": avg_std_2}
                 table_data.append(temp_dict)
@@ -4455,7 +4465,7 @@ def update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
             temp_cons_df.columns = ["meta_name", "mean_2", "std_2"]
             temp_cons_dict = temp_cons_df.to_dict('records')
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_1, avg_std_1, unit_1 = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type_1)
+                avg_mean_1, avg_std_1, unit_1 = hmdb_cons_table.get_normal_avg_cons(hmdb_id, bio_type_1)
                 temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, temp_cons_dict))[0]
                 temp_dict["hmdb_id"] = hmdb_id
                 temp_dict["mean_1"] = avg_mean_1
@@ -4469,7 +4479,7 @@ def update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
             temp_cons_df.columns = ["meta_name", "mean_1", "std_1"]
             temp_cons_dict = temp_cons_df.to_dict('records')
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_2, avg_std_2, unit_2 = get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, bio_type_2)
+                avg_mean_2, avg_std_2, unit_2 = hmdb_cons_table.get_abnormal_avg_cons(hmdb_id, bio_type_2)
                 temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, temp_cons_dict))[0]
                 temp_dict["hmdb_id"] = hmdb_id
                 temp_dict["mean_2"] = avg_mean_2
@@ -4562,8 +4572,8 @@ def update_simulated_cons_table(n_clicks, table_rows, final_name_hmdb_id_dict,
     else:
         corr_df_1 = parse_corr_df(corr_filename_1, corr_contents_1)
         corr_df_2 = parse_corr_df(corr_filename_2, corr_contents_2)
-        simulated_cons_df_1 = simulate_concentrations(table_rows, num_repli_1, corr_flag_1, corr_df_1, "1")
-        simulated_cons_df_2 = simulate_concentrations(table_rows, num_repli_2, corr_flag_2, corr_df_2, "2")
+        simulated_cons_df_1 = simulate_concentrations(table_rows, num_repli_1, corr_flag_1, corr_df_1, "1", seed=simulation_seed)
+        simulated_cons_df_2 = simulate_concentrations(table_rows, num_repli_2, corr_flag_2, corr_df_2, "2", seed=simulation_seed)
         table_columns = [{"name": ["", "Name"], "id": "meta_name"}, {"name": ["", "HMDB ID"], "id": "hmdb_id"}] + \
                         [{"name": ["Group 1 (Normal)", "Replicate_{}".format(i+1)], "id": "1_replicate_{}".format(i+1),
                           "hideable": True} for i in range(num_repli_1)] + \
@@ -4737,6 +4747,7 @@ def update_simulation_results_div(group_n_clicks, conti_n_clicks, upload_group_n
         State("simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_group_results_all_fig(n_clicks, cal_range, water_range, bins, baseline_thres, smooth_thres, table_rows):
     if n_clicks == 0:
         return None, {"data": [], "layout": {}, "frames": []}
@@ -4773,8 +4784,7 @@ def update_group_1_no_and_with_peak_shift_albumin_container(n_clicks, bio_type_1
 
 @app.callback(
     [
-        Output("group-1-spectra-fig", "figure"),
-        Output("group-1-final-dict", "data"),
+        Output("group-1-job-id", "data"),
         Output("group_1_no_peak_shift_albumin_bar", "value"),
     ],
     [
@@ -4788,27 +4798,55 @@ def update_group_1_no_and_with_peak_shift_albumin_container(n_clicks, bio_type_1
         State("win-smooth-noise", "value"),
         State("group-1-num-repli", "value"),
         State("simulated-cons-table", "data"),
+        State("group-1-job-id", "data"),
     ]
 )
+@use_result_store()
 def update_group_1_mix_fig(n_clicks, norm_data_dict, albumin_level_1, bio_type_1,
-                          snr, wins, num_repli_1, table_rows, ):
+                          snr, wins, num_repli_1, table_rows, job_id):
     if n_clicks == 0 or norm_data_dict is None:
-        return {"data": [], "layout": {}, "frames": []}, None, \
-               albumin_level_1
+        return None, albumin_level_1
     else:
+        # a new simulation replaces the one still running
+        job_queue.cancel(job_id, get_session_id())
         mixture_dict = {item['meta_name']: item['hmdb_id'] for item in table_rows}
         # print("here:", mixture_dict)
-        if bio_type_1 == "Blood":
-            final_data_dict_1 = sum_mixture_spectra_with_albumin_for_all_repli(num_repli_1, mixture_dict, norm_data_dict,
-                                   table_rows, protons_df, albumin_norm_data_dict_1, albumin_level_1, snr, wins, "1")
-        else:
+        if bio_type_1 != "Blood":
             albumin_level_1 = 0
-            final_data_dict_1 = sum_mixture_spectra_with_albumin_for_all_repli(num_repli_1, mixture_dict, norm_data_dict,
-                                   table_rows, protons_df, albumin_norm_data_dict_1, albumin_level_1, snr, wins, "1")
+        step_list = [("simulating group 1", sum_mixture_spectra_with_albumin_for_all_repli,
+                      (num_repli_1, mixture_dict, norm_data_dict, table_rows, protons_df, albumin_norm_data_dict_1,
+                       albumin_level_1, snr, wins, "1"), {"progress": report_step_progress})]
+        job_id = job_queue.submit("group 1 mixture", step_list, get_session_id())
+
+        return job_id, albumin_level_1
 
+
+@app.callback(
+    [
+        Output("group-1-spectra-fig", "figure"),
+        Output("group-1-final-dict", "data"),
+        Output("group-1-job-status", "children"),
+        Output("group-1-job-interval", "disabled"),
+    ],
+    [
+        # a new job id starts the polling, the polling callback alone enables and disables the interval
+        Input("group-1-job-interval", "n_intervals"),
+        Input("group-1-job-id", "data"),
+    ],
+)
+@use_result_store(output_indices=(1,))
+def update_group_1_mix_fig_from_job(n_intervals, job_id):
+    status = job_queue.get_status(job_id, get_session_id()) if job_id is not None else None
+    if status is None or status["status"] != DONE:
+        finished = status is None or status["status"] in FINISHED_STATES
+        return dash.no_update, dash.no_update, format_job_status(status), finished
+    else:
+        final_data_dict_1, = job_queue.get_result(job_id, get_session_id())
         mix_fig_1 = plot_mean_spectra(final_data_dict_1, ppm_scale)
+        return mix_fig_1, final_data_dict_1, "", True
+
 
-        return mix_fig_1, final_data_dict_1, albumin_level_1
+register_cancel_callback(app, "group-1")
 
 
 @app.callback(
@@ -4833,8 +4871,7 @@ def update_group_2_no_peak_shift_albumin_container(n_clicks, bio_type_2):
 
 @app.callback(
     [
-        Output("group-2-spectra-fig", "figure"),
-        Output("group-2-final-dict", "data"),
+        Output("group-2-job-id", "data"),
         Output("group_2_no_peak_shift_albumin_bar", "value"),
     ],
     [
@@ -4848,29 +4885,54 @@ def update_group_2_no_peak_shift_albumin_container(n_clicks, bio_type_2):
         State("win-smooth-noise", "value"),
         State("group-2-num-repli", "value"),
         State("simulated-cons-table", "data"),
-        # State("processed-spectra-data-dict", "data"),
+        State("group-2-job-id", "data"),
     ]
 )
+@use_result_store()
 def update_group_2_mix_fig(n_clicks, norm_data_dict, albumin_level_2, bio_type_2,
-                          snr, wins, num_repli_2, table_rows, ):
+                          snr, wins, num_repli_2, table_rows, job_id):
     if n_clicks == 0 or norm_data_dict is None:
-        return {"data": [], "layout": {}, "frames": []}, None, \
-               albumin_level_2
+        return None, albumin_level_2
     else:
-
+        # a new simulation replaces the one still running
+        job_queue.cancel(job_id, get_session_id())
         mixture_dict = {item['meta_name']: item['hmdb_id'] for item in table_rows}
-
-        if bio_type_2 == "Blood":
-            final_data_dict_2 = sum_mixture_spectra_with_albumin_for_all_repli(num_repli_2, mixture_dict, norm_data_dict,
-                                   table_rows, protons_df, albumin_norm_data_dict_1, albumin_level_2, snr, wins, "2")
-        else:
+        if bio_type_2 != "Blood":
             albumin_level_2 = 0
-            final_data_dict_2 = sum_mixture_spectra_with_albumin_for_all_repli(num_repli_2, mixture_dict, norm_data_dict,
-                                       table_rows, protons_df, albumin_norm_data_dict_1, albumin_level_2, snr, wins, "2")
-        # print(final_data_dict_1)
-        # print(final_data_dict_2)
+        step_list = [("simulating group 2", sum_mixture_spectra_with_albumin_for_all_repli,
+                      (num_repli_2, mixture_dict, norm_data_dict, table_rows, protons_df, albumin_norm_data_dict_1,
+                       albumin_level_2, snr, wins, "2"), {"progress": report_step_progress})]
+        job_id = job_queue.submit("group 2 mixture", step_list, get_session_id())
+
+        return job_id, albumin_level_2
+
+
+@app.callback(
+    [
+        Output("group-2-spectra-fig", "figure"),
+        Output("group-2-final-dict", "data"),
+        Output("group-2-job-status", "children"),
+        Output("group-2-job-interval", "disabled"),
+    ],
+    [
+        # a new job id starts the polling, the polling callback alone enables and disables the interval
+        Input("group-2-job-interval", "n_intervals"),
+        Input("group-2-job-id", "data"),
+    ],
+)
+@use_result_store(output_indices=(1,))
+def update_group_2_mix_fig_from_job(n_intervals, job_id):
+    status = job_queue.get_status(job_id, get_session_id()) if job_id is not None else None
+    if status is None or status["status"] != DONE:
+        finished = status is None or status["status"] in FINISHED_STATES
+        return dash.no_update, dash.no_update, format_job_status(status), finished
+    else:
+        final_data_dict_2, = job_queue.get_result(job_id, get_session_id())
         mix_fig_2 = plot_mean_spectra(final_data_dict_2, ppm_scale)
-        return mix_fig_2, final_data_dict_2, albumin_level_2
+        return mix_fig_2, final_data_dict_2, "", True
+
+
+register_cancel_callback(app, "group-2")
 
 
 @app.callback(
@@ -4884,6 +4946,7 @@ def update_group_2_mix_fig(n_clicks, norm_data_dict, albumin_level_2, bio_type_2
         Input("group-1-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_group_1_stacked_fig(n_clicks, final_data_dict_1, log_v_space):
     if n_clicks == 0 or final_data_dict_1 is None:
         return {"data": [], "layout": {}, "frames": []}, "Vertical space is "
@@ -4905,6 +4968,7 @@ def update_group_1_stacked_fig(n_clicks, final_data_dict_1, log_v_space):
         Input("group-2-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_group_2_stacked_fig(n_clicks, final_data_dict_2, log_v_space):
     if n_clicks == 0 or final_data_dict_2 is None:
         return {"data": [], "layout": {}, "frames": []}, "Vertical space is "
@@ -4975,7 +5039,7 @@ def update_continuous_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict, sel
         if select_hmdb_data == "hmdb":
             table_data = []
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean, avg_std, unit = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, conti_bio_type)
+                avg_mean, avg_std, unit = hmdb_cons_table.get_normal_avg_cons(hmdb_id, conti_bio_type)
                 temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id, "mean": avg_mean, "std": avg_std, "a": 0, "std_error": 0}
                 table_data.append(temp_dict)
             return {"display": "block"}, table_data, table_columns, {"display": "block"}
@@ -5040,17 +5104,18 @@ def update_conti_simulated_cons_table(n_clicks, table_rows, y_num_repli, dist_ty
         table_columns = [{"name": "Name", "id": "meta_name"}, {"name": "HMDB ID", "id": "hmdb_id"}] + \
                         [{"name": "Replicate_{}".format(i+1), "id": "replicate_{}".format(i+1)}
                          for i in range(y_num_repli)]
+        y_rng = get_child_rng(simulation_seed, "y")
         if dist_type == "normal":
-            sample_y = np.round(np.random.normal(y_mean, y_std, y_num_repli), 2)
+            sample_y = np.round(y_rng.normal(y_mean, y_std, y_num_repli), 2)
         elif dist_type == "uniform":
-            sample_y = np.round(np.random.uniform(y_min, y_max, y_num_repli), 2)
+            sample_y = np.round(y_rng.uniform(y_min, y_max, y_num_repli), 2)
         else:
             sample_y = []
 
         y_temp_dict = dict({"meta_name": "Y", "hmdb_id": "/"},
                            **dict(zip(["replicate_{}".format(i + 1) for i in range(y_num_repli)], sample_y)))
         x_cons_dict_list, meta_with_y_list, meta_not_y_list = \
-            simulate_continuous_concentrations(table_rows, y_num_repli, sample_y)
+            simulate_continuous_concentrations(table_rows, y_num_repli, sample_y, seed=simulation_seed)
         table_data = [y_temp_dict] + x_cons_dict_list
         style_data_conditional = [{
             "if": {"row_index": 0},
@@ -5160,6 +5225,7 @@ def plot_conti_box_plot(table_data):
         State("conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_continuous_results_all_fig(n_clicks, cal_range, water_range, bins, baseline_thres, smooth_thres, table_rows):
     if n_clicks == 0:
         return None, {"data": [], "layout": {}, "frames": []}
@@ -5215,6 +5281,7 @@ def update_conti_no_and_with_peak_shift_albumin_container(n_clicks, bio_type):
         State("conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_continuous_final_replicate_dict(n_clicks, norm_data_dict, albumin_level, bio_type,
                                            snr, wins, y_num_repli, table_rows):
     if n_clicks == 0 or norm_data_dict is None:
@@ -5226,13 +5293,13 @@ def update_continuous_final_replicate_dict(n_clicks, norm_data_dict, albumin_lev
             final_data_dict = simulate_continuous_mixture_for_all_repli(y_num_repli, mixture_dict, norm_data_dict,
                                                                         table_rows, protons_df,
                                                                         albumin_norm_data_dict_1, albumin_level,
-                                                                        snr, wins)
+                                                                        snr, wins, seed=simulation_seed)
         else:
             albumin_level = 0
             final_data_dict = simulate_continuous_mixture_for_all_repli(y_num_repli, mixture_dict, norm_data_dict,
                                                                         table_rows, protons_df,
                                                                         albumin_norm_data_dict_1, albumin_level,
-                                                                        snr, wins)
+                                                                        snr, wins, seed=simulation_seed)
 
         options = [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         # [{"label": i, "value": i} for i in list(final_data_dict.keys())]
@@ -5256,6 +5323,7 @@ def update_continuous_final_replicate_dict(n_clicks, norm_data_dict, albumin_lev
         # State("conti-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def update_continuous_mix_meta_y_plots(select_replicate, final_data_dict, n_clicks, cons_table_rows):
     if n_clicks == 0:
         return {"data": [], "layout": {}, "frames": []}, {"data": [], "layout": {}, "frames": []}
@@ -5317,6 +5385,7 @@ def plot_conti_results_line_plot(table_data, select_replicate):
     State("conti-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     output_replicate_dict = {**{"ppm": ppm_scale}, **final_replicate_dict}
     return dcc.send_data_frame(pd.DataFrame(output_replicate_dict).to_csv, "continuous_simulated_spectra_without_peak_shift.csv")
@@ -5328,6 +5397,7 @@ def download_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     State("group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     output_replicate_dict = {**{"ppm": ppm_scale}, **final_replicate_dict}
     return dcc.send_data_frame(pd.DataFrame(output_replicate_dict).to_csv, "group_1_simulated_spectra_without_peak_shift.csv")
@@ -5339,6 +5409,7 @@ def download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     State("group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     output_replicate_dict = {**{"ppm": ppm_scale}, **final_replicate_dict}
     return dcc.send_data_frame(pd.DataFrame(output_replicate_dict).to_csv, "group_2_simulated_spectra_without_peak_shift.csv")
@@ -5407,8 +5478,8 @@ def update_group_cons_ph_table(n_clicks, cons_table_data, cons_table_columns, nu
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list_1 = sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1)
-        ph_list_2 = sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2)
+        ph_list_1 = sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(simulation_seed, "ph", "1"))
+        ph_list_2 = sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(simulation_seed, "ph", "2"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list_1, ph_list_2))
         name_list = ["meta_name", "hmdb_id"] + ["1_replicate_" + str(i + 1) for i in range(num_repli_1)] + \
                     ["2_replicate_" + str(i + 1) for i in range(num_repli_2)]
@@ -5418,22 +5489,24 @@ def update_group_cons_ph_table(n_clicks, cons_table_data, cons_table_columns, nu
         return {"display": "block"}, table_data, cons_table_columns, style_data_conditional, {"display": "block"}, {"display": "block"}
 
 
-def sample_ph_list(num_replicate, ph_same_flag, same_ph, ph_mean, ph_std):
+def sample_ph_list(num_replicate, ph_same_flag, same_ph, ph_mean, ph_std, rng=None):
     if ph_same_flag == "true":
         ph_list = np.round([same_ph] * num_replicate, 2)
     elif ph_same_flag == "false":
-        ph_list = np.round(get_positive_ph(ph_mean, ph_std, num_replicate), 2)
+        ph_list = np.round(get_positive_ph(ph_mean, ph_std, num_replicate, rng), 2)
     else:
         ph_list = [7.4] * num_replicate
     return ph_list
 
 
-def get_positive_ph(mean, std, num_replicates):
-    x = np.random.normal(mean,std, num_replicates)
-    if np.all(x > 0):
-        return x
-    else:
-        return get_positive_ph(mean, std, num_replicates)
+def get_peak_cluster_file(cal_range, water_range, bins, baseline_thres, smooth_thres):
+    # the peak clusters of the library spectra preprocessed with these parameters, stored next to the library
+    return get_peak_cluster_cache_file(match_data_dict, [cal_range, water_range, bins, baseline_thres, smooth_thres])
+
+
+def get_positive_ph(mean, std, num_replicates, rng=None):
+    # truncated normal, no more redrawing the whole list until every pH is positive
+    return pos_normal_no_correlated(mean, std, num_replicates, rng)
 
 
 @app.callback(
@@ -5454,6 +5527,7 @@ def get_positive_ph(mean, std, num_replicates):
         # State("group-peak-shift-win-smooth-noise", "value")
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_group_peak_shift_group_results_all_fig(n_clicks, cons_ph_table_data,
                                                   cal_range, water_range, bins, baseline_thres, smooth_thres):
     if n_clicks == 0:
@@ -5486,20 +5560,29 @@ def update_group_peak_shift_group_results_all_fig(n_clicks, cons_ph_table_data,
         State("db-names-hmdb-ids-dict", "data"),
         State("group-cons-ph-table", "data"),
         State("group-peak-shift-snr-noise", "value"),
-        State("group-peak-shift-win-smooth-noise", "value")
+        State("group-peak-shift-win-smooth-noise", "value"),
+        State("group-peak-shift-calibration-range", "value"),
+        State("group-peak-shift-water-range", "value"),
+        State("group-peak-shift-bins-num", "value"),
+        State("group-peak-shift-baseline-thres", "value"),
+        State("group-peak-shift-smooth-thres", "value"),
     ]
 )
+@use_result_store(output_indices=(1,))
 def update_group_peak_shift_group_1_mix_fig(n_clicks, norm_data_dict, albumin_level_1, bio_type_1,
                                             final_names_hmdb_id_dict,
-                                            cons_ph_table_data, snr, wins):
+                                            cons_ph_table_data, snr, wins, cal_range, water_range, bins,
+                                            baseline_thres, smooth_thres):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}, None, albumin_level_1
     else:
         mixture_dict = {item['meta_name']: item['hmdb_id'] for item in cons_ph_table_data}
         del mixture_dict["pH"]
         mixture_list = list(mixture_dict.keys())
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict)
-        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = get_peak_cluster_file(cal_range, water_range, bins, baseline_thres, smooth_thres)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file)
+        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         if bio_type_1 == "Blood":
             final_data_dict_1 = simulate_mixture_with_peak_shift_with_albumin_for_all_repli(mixture_dict, mixture_list,
                                                                                             ppm_scale, norm_data_dict,
@@ -5539,20 +5622,29 @@ def update_group_peak_shift_group_1_mix_fig(n_clicks, norm_data_dict, albumin_le
         State("db-names-hmdb-ids-dict", "data"),
         State("group-cons-ph-table", "data"),
         State("group-peak-shift-snr-noise", "value"),
-        State("group-peak-shift-win-smooth-noise", "value")
+        State("group-peak-shift-win-smooth-noise", "value"),
+        State("group-peak-shift-calibration-range", "value"),
+        State("group-peak-shift-water-range", "value"),
+        State("group-peak-shift-bins-num", "value"),
+        State("group-peak-shift-baseline-thres", "value"),
+        State("group-peak-shift-smooth-thres", "value"),
     ]
 )
+@use_result_store(output_indices=(1,))
 def update_group_peak_shift_group_2_mix_fig(n_clicks, norm_data_dict, albumin_level_2, bio_type_2,
                                             final_names_hmdb_id_dict,
-                                            cons_ph_table_data, snr, wins):
+                                            cons_ph_table_data, snr, wins, cal_range, water_range, bins,
+                                            baseline_thres, smooth_thres):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}, None, albumin_level_2
     else:
         mixture_dict = {item['meta_name']: item['hmdb_id'] for item in cons_ph_table_data}
         del mixture_dict["pH"]
         mixture_list = list(mixture_dict.keys())
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict)
-        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = get_peak_cluster_file(cal_range, water_range, bins, baseline_thres, smooth_thres)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file)
+        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         if bio_type_2 == "Blood":
             final_data_dict_2 = simulate_mixture_with_peak_shift_with_albumin_for_all_repli(mixture_dict, mixture_list,
                                                                                             ppm_scale, norm_data_dict,
@@ -5627,7 +5719,8 @@ def update_group_peak_shift_group_2_mix_fig(n_clicks, norm_data_dict, albumin_le
 #         return all_fig, mean_fig_1, final_data_dict_1, mean_fig_2, final_data_dict_2
 
 
-def get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
+def get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=None):
+    seed = get_seed_sequence(seed)
     mixture_pka_dict = dict()
     for meta_name in mixture_list:
         temp_pka_dict = hmdb_id_pka_dict[final_names_hmdb_id_dict[meta_name]]
@@ -5646,7 +5739,7 @@ def get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
         elif temp_pka_1 is not None and temp_pka_2 is None:
             temp_pka = temp_pka_1
         else:
-            temp_pka = np.random.normal(6.013, 2.972, 1)[0]
+            temp_pka = get_child_rng(seed, "pka", meta_name).normal(6.013, 2.972, 1)[0]
         mixture_pka_dict[meta_name] = temp_pka
 
     # print(mixture_pka_dict)
@@ -5664,6 +5757,7 @@ def get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
         Input("group-peak-shift-group-1-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_group_peak_shift_stacked_fig_1(n_clicks, final_data_dict_1, log_v_space):
     if n_clicks == 0 or final_data_dict_1 is None:
         return {"data": [], "layout": {}, "frames": []}, "Vertical space is "
@@ -5687,6 +5781,7 @@ def update_group_peak_shift_stacked_fig_1(n_clicks, final_data_dict_1, log_v_spa
         Input("group-peak-shift-group-2-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_group_peak_shift_stacked_fig_2(n_clicks, final_data_dict_2, log_v_space):
     if n_clicks == 0 or final_data_dict_2 is None:
         return {"data": [], "layout": {}, "frames": []}, "Vertical space is "
@@ -5705,6 +5800,7 @@ def update_group_peak_shift_stacked_fig_2(n_clicks, final_data_dict_2, log_v_spa
     State("group-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_group_1_simulated_spectra_with_peak_shift(n_clicks, final_replicate_dict):
     temp_replicate_dict = {key: value[1] for key, value in final_replicate_dict.items()}
     output_replicate_dict = {**{"ppm": ppm_scale}, **temp_replicate_dict}
@@ -5717,6 +5813,7 @@ def download_group_1_simulated_spectra_with_peak_shift(n_clicks, final_replicate
     State("group-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_group_2_simulated_spectra_with_peak_shift(n_clicks, final_replicate_dict):
     temp_replicate_dict = {key: value[1] for key, value in final_replicate_dict.items()}
     output_replicate_dict = {**{"ppm": ppm_scale}, **temp_replicate_dict}
@@ -5765,7 +5862,7 @@ def update_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table_column
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list = sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std)
+        ph_list = sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std, get_child_rng(simulation_seed, "ph"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list))
         name_list = ["meta_name", "hmdb_id"] + ["replicate_" + str(i + 1) for i in range(y_num_repli)]
         temp_dict = dict(zip(name_list, all_ph_list))
@@ -5791,6 +5888,7 @@ def update_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table_column
         # State("conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_continuous_peak_shift_results_all_fig(n_clicks, cons_ph_table_data,
                                                  cal_range, water_range, bins, baseline_thres, smooth_thres):
     if n_clicks == 0:
@@ -5825,11 +5923,18 @@ def update_continuous_peak_shift_results_all_fig(n_clicks, cons_ph_table_data,
         State("db-names-hmdb-ids-dict", "data"),
         State("conti-cons-ph-table", "data"),
         State("conti-peak-shift-snr-noise", "value"),
-        State("conti-peak-shift-win-smooth-noise", "value")
+        State("conti-peak-shift-win-smooth-noise", "value"),
+        State("conti-calibration-range", "value"),
+        State("conti-water-range", "value"),
+        State("conti-bins-num", "value"),
+        State("conti-baseline-thres", "value"),
+        State("conti-smooth-thres", "value"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_continuous_peak_shift_figure(n_clicks, norm_data_dict, albumin_level, bio_type,
-                                        final_names_hmdb_id_dict, cons_ph_table_data, snr, wins):
+                                        final_names_hmdb_id_dict, cons_ph_table_data, snr, wins, cal_range,
+                                        water_range, bins, baseline_thres, smooth_thres):
     if n_clicks == 0:
         return None, [], None, albumin_level
     else:
@@ -5837,8 +5942,10 @@ def update_continuous_peak_shift_figure(n_clicks, norm_data_dict, albumin_level,
         del mixture_dict["pH"]
         del mixture_dict["Y"]
         mixture_list = list(mixture_dict.keys())
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict)
-        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = get_peak_cluster_file(cal_range, water_range, bins, baseline_thres, smooth_thres)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file)
+        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
 
         if bio_type == "Blood":
             final_data_dict = simulate_mixture_continuous_with_peak_shift_for_all_repli_with_albumin(mixture_dict, mixture_list,
@@ -5846,7 +5953,7 @@ def update_continuous_peak_shift_figure(n_clicks, norm_data_dict, albumin_level,
                                                                       meta_subset_dict, mixture_pka_dict,
                                                                       cons_ph_table_data,
                                                                       protons_df, albumin_norm_data_dict_1, albumin_level,
-                                                                      snr, wins)
+                                                                      snr, wins, seed=simulation_seed)
         else:
             albumin_level = 0
             final_data_dict = simulate_mixture_continuous_with_peak_shift_for_all_repli_with_albumin(mixture_dict, mixture_list,
@@ -5857,7 +5964,7 @@ def update_continuous_peak_shift_figure(n_clicks, norm_data_dict, albumin_level,
                                                                                         protons_df,
                                                                                         albumin_norm_data_dict_1,
                                                                                         albumin_level,
-                                                                                        snr, wins)
+                                                                                        snr, wins, seed=simulation_seed)
 
         options = [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         value = list(final_data_dict.keys())[0]
@@ -5879,6 +5986,7 @@ def update_continuous_peak_shift_figure(n_clicks, norm_data_dict, albumin_level,
         # State("conti-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def update_continuous_peak_shift_mix_meta_y_plots(select_replicate, final_data_dict, n_clicks, cons_table_rows):
     if n_clicks == 0:
         return {"data": [], "layout": {}, "frames": []}, {"data": [], "layout": {}, "frames": []}
@@ -5899,6 +6007,7 @@ def update_continuous_peak_shift_mix_meta_y_plots(select_replicate, final_data_d
         Input("conti-peak-shift-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_continuous_peak_shift_stacked_fig(n_clicks, final_data_dict, log_v_space):
     if n_clicks == 0 or final_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -5915,6 +6024,7 @@ def update_continuous_peak_shift_stacked_fig(n_clicks, final_data_dict, log_v_sp
     State("conti-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_conti_simulated_spectra_with_peak_shift(n_clicks, final_replicate_dict):
     temp_replicate_dict = {key: value[1] for key, value in final_replicate_dict.items()}
     output_replicate_dict = {**{"ppm": ppm_scale}, **temp_replicate_dict}
@@ -5937,6 +6047,7 @@ def download_conti_simulated_spectra_with_peak_shift(n_clicks, final_replicate_d
         State("upload-discrete-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_upload_group_results_all_fig(n_clicks, cal_range, water_range, bins, baseline_thres, smooth_thres, table_rows):
     if n_clicks == 0:
         return None, {"data": [], "layout": {}, "frames": []}
@@ -5970,6 +6081,7 @@ def update_upload_group_results_all_fig(n_clicks, cal_range, water_range, bins,
         State("upload-discrete-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(1, 3))
 def update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, wins, table_rows):
     num_repli_1 = sum(1 for i in table_rows[0].keys() if i[0] == "1")
     num_repli_2 = sum(1 for i in table_rows[0].keys() if i[0] == "2")
@@ -5978,9 +6090,9 @@ def update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, wins, table_rows
     else:
         mixture_list = list(map(lambda d: d["meta_name"], table_rows))
         final_data_dict_1 = simulate_mixture_for_all_repli(num_repli_1, mixture_list, norm_data_dict,
-                                                           table_rows, protons_df, snr, wins, "1")
+                                                           table_rows, protons_df, snr, wins, "1", seed=simulation_seed)
         final_data_dict_2 = simulate_mixture_for_all_repli(num_repli_2, mixture_list, norm_data_dict,
-                                                           table_rows, protons_df, snr, wins, "2")
+                                                           table_rows, protons_df, snr, wins, "2", seed=simulation_seed)
         # print(final_data_dict_1)
         # print(final_data_dict_2)
         mix_fig_1 = plot_mean_spectra(final_data_dict_1, ppm_scale)
@@ -5999,6 +6111,7 @@ def update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, wins, table_rows
         Input("upload-group-no-peak-shift-group-1-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_upload_group_1_stacked_fig(n_clicks, final_data_dict_1, log_v_space):
     if n_clicks == 0 or final_data_dict_1 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6020,6 +6133,7 @@ def update_upload_group_1_stacked_fig(n_clicks, final_data_dict_1, log_v_space):
         Input("upload-group-no-peak-shift-group-2-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_upload_group_2_stacked_fig(n_clicks, final_data_dict_2, log_v_space):
     if n_clicks == 0 or final_data_dict_2 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6036,6 +6150,7 @@ def update_upload_group_2_stacked_fig(n_clicks, final_data_dict_2, log_v_space):
     State("upload-group-no-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_upload_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     output_replicate_dict = {**{"ppm": ppm_scale}, **final_replicate_dict}
     return dcc.send_data_frame(pd.DataFrame(output_replicate_dict).to_csv, "uploaded_group_1_simulated_spectra_without_peak_shift.csv")
@@ -6047,6 +6162,7 @@ def download_upload_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     State("upload-group-no-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_upload_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     output_replicate_dict = {**{"ppm": ppm_scale}, **final_replicate_dict}
     return dcc.send_data_frame(pd.DataFrame(output_replicate_dict).to_csv, "uploaded_group_2_simulated_spectra_without_peak_shift.csv")
@@ -6117,8 +6233,8 @@ def update_upload_group_cons_ph_table(n_clicks, cons_table_data, cons_table_colu
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list_1 = sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1)
-        ph_list_2 = sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2)
+        ph_list_1 = sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(simulation_seed, "ph", "1"))
+        ph_list_2 = sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(simulation_seed, "ph", "2"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list_1, ph_list_2))
         name_list = ["meta_name", "hmdb_id"] + ["1_replicate_" + str(i + 1) for i in range(num_repli_1)] + \
                     ["2_replicate_" + str(i + 1) for i in range(num_repli_2)]
@@ -6150,6 +6266,7 @@ def update_upload_group_cons_ph_table(n_clicks, cons_table_data, cons_table_colu
         State("upload-group-peak-shift-win-smooth-noise", "value")
     ]
 )
+@use_result_store(output_indices=(2, 4))
 def update_upload_group_peak_shift_figures(n_clicks, final_names_hmdb_id_dict, cons_ph_table_data, cal_range, water_range,
                                     bins, baseline_thres, smooth_thres, snr, wins):
     if n_clicks == 0:
@@ -6167,14 +6284,16 @@ def update_upload_group_peak_shift_figures(n_clicks, final_names_hmdb_id_dict, c
         all_fig = plot_all_metabolites(mixture_list, norm_data_dict, ppm_scale)
 
         # get peak shift
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict)
-        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = get_peak_cluster_file(cal_range, water_range, bins, baseline_thres, smooth_thres)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file)
+        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         final_data_dict_1 = simulate_mixture_with_peak_shift_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
                                                                       meta_subset_dict, mixture_pka_dict,
-                                                                      cons_ph_table_data, "1", protons_df, snr, wins)
+                                                                      cons_ph_table_data, "1", protons_df, snr, wins, seed=simulation_seed)
         final_data_dict_2 = simulate_mixture_with_peak_shift_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
                                                                       meta_subset_dict, mixture_pka_dict,
-                                                                      cons_ph_table_data, "2", protons_df, snr, wins)
+                                                                      cons_ph_table_data, "2", protons_df, snr, wins, seed=simulation_seed)
         mean_fig_1 = plot_mean_spectra(final_data_dict_1, ppm_scale)
         mean_fig_2 = plot_mean_spectra(final_data_dict_2, ppm_scale)
         return all_fig, mean_fig_1, final_data_dict_1, mean_fig_2, final_data_dict_2
@@ -6191,6 +6310,7 @@ def update_upload_group_peak_shift_figures(n_clicks, final_names_hmdb_id_dict, c
         Input("upload-group-peak-shift-group-1-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_upload_group_peak_shift_stacked_fig_1(n_clicks, final_data_dict_1, log_v_space):
     if n_clicks == 0 or final_data_dict_1 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6214,6 +6334,7 @@ def update_upload_group_peak_shift_stacked_fig_1(n_clicks, final_data_dict_1, lo
         Input("upload-group-peak-shift-group-2-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_upload_group_peak_shift_stacked_fig_2(n_clicks, final_data_dict_2, log_v_space):
     if n_clicks == 0 or final_data_dict_2 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6232,6 +6353,7 @@ def update_upload_group_peak_shift_stacked_fig_2(n_clicks, final_data_dict_2, lo
     State("upload-group-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_upload_group_1_simulated_spectra_with_peak_shift(n_clicks, final_replicate_dict):
     temp_replicate_dict = {key: value[1] for key, value in final_replicate_dict.items()}
     output_replicate_dict = {**{"ppm": ppm_scale}, **temp_replicate_dict}
@@ -6244,6 +6366,7 @@ def download_upload_group_1_simulated_spectra_with_peak_shift(n_clicks, final_re
     State("upload-group-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_upload_group_2_simulated_spectra_with_peak_shift(n_clicks, final_replicate_dict):
     temp_replicate_dict = {key: value[1] for key, value in final_replicate_dict.items()}
     output_replicate_dict = {**{"ppm": ppm_scale}, **temp_replicate_dict}
@@ -6266,6 +6389,7 @@ def download_upload_group_2_simulated_spectra_with_peak_shift(n_clicks, final_re
         State("upload-conti-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_upload_continuous_results_all_fig(n_clicks, cal_range, water_range, bins, baseline_thres, smooth_thres, table_rows):
     if n_clicks == 0:
         return None, {"data": [], "layout": {}, "frames": []}
@@ -6298,6 +6422,7 @@ def update_upload_continuous_results_all_fig(n_clicks, cal_range, water_range, b
         State("upload-conti-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr, wins, table_rows):
     y_num_repli = len(table_rows[0])-1
     if n_clicks == 0 or norm_data_dict is None:
@@ -6306,7 +6431,7 @@ def update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr,
         mixture_list = list(map(lambda d: d["meta_name"], table_rows))
         mixture_list.remove("Y")
         final_data_dict = simulate_continuous_mixture_for_all_repli(y_num_repli, mixture_list, norm_data_dict,
-                                                                    table_rows, protons_df, snr, wins)
+                                                                    table_rows, protons_df, snr, wins, seed=simulation_seed)
         options = [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         # [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         value = list(final_data_dict.keys())[0]
@@ -6327,6 +6452,7 @@ def update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr,
         State("upload-conti-no-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def update_upload_continuous_mix_meta_y_plots(select_replicate, n_clicks, cons_table_rows, final_data_dict):
     if n_clicks == 0:
         return {"data": [], "layout": {}, "frames": []}, {"data": [], "layout": {}, "frames": []}
@@ -6342,6 +6468,7 @@ def update_upload_continuous_mix_meta_y_plots(select_replicate, n_clicks, cons_t
     State("upload-conti-no-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_upload_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     output_replicate_dict = {**{"ppm": ppm_scale}, **final_replicate_dict}
     return dcc.send_data_frame(pd.DataFrame(output_replicate_dict).to_csv, "uploaded_continuous_simulated_spectra_without_peak_shift.csv")
@@ -6390,7 +6517,7 @@ def update_upload_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list = sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std)
+        ph_list = sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std, get_child_rng(simulation_seed, "ph"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list))
         name_list = ["meta_name", "hmdb_id"] + ["replicate_" + str(i + 1) for i in range(y_num_repli)]
         temp_dict = dict(zip(name_list, all_ph_list))
@@ -6420,6 +6547,7 @@ def update_upload_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table
         State("upload-conti-peak-shift-win-smooth-noise", "value")
     ]
 )
+@use_result_store(output_indices=(1,))
 def update_upload_continuous_peak_shift_figure(n_clicks, final_names_hmdb_id_dict, cons_ph_table_data, cal_range, water_range,
                                     bins, baseline_thres, smooth_thres, snr, wins):
     if n_clicks == 0:
@@ -6437,11 +6565,13 @@ def update_upload_continuous_peak_shift_figure(n_clicks, final_names_hmdb_id_dic
         all_fig = plot_all_metabolites(mixture_list, norm_data_dict, ppm_scale)
 
         # get peak shift
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict)
-        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = get_peak_cluster_file(cal_range, water_range, bins, baseline_thres, smooth_thres)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file)
+        mixture_pka_dict = get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         final_data_dict = simulate_mixture_continuous_with_peak_shift_for_all_repli(mixture_list, ppm_scale,
                                                 norm_data_dict, meta_subset_dict, mixture_pka_dict, cons_ph_table_data,
-                                                protons_df, snr, wins)
+                                                protons_df, snr, wins, seed=simulation_seed)
         options = [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         value = list(final_data_dict.keys())[0]
         return all_fig, final_data_dict, options, value
@@ -6459,6 +6589,7 @@ def update_upload_continuous_peak_shift_figure(n_clicks, final_names_hmdb_id_dic
         State("upload-conti-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def update_upload_continuous_peak_shift_mix_meta_y_plots(select_replicate, n_clicks, cons_table_rows, final_data_dict):
     if n_clicks == 0:
         return {"data": [], "layout": {}, "frames": []}, {"data": [], "layout": {}, "frames": []}
@@ -6479,6 +6610,7 @@ def update_upload_continuous_peak_shift_mix_meta_y_plots(select_replicate, n_cli
         Input("upload-conti-peak-shift-vs-slider", "value")
     ],
 )
+@use_result_store()
 def update_upload_continuous_peak_shift_stacked_fig(n_clicks, final_data_dict, log_v_space):
     if n_clicks == 0 or final_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6495,6 +6627,7 @@ def update_upload_continuous_peak_shift_stacked_fig(n_clicks, final_data_dict, l
     State("upload-conti-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def download_upload_conti_simulated_spectra_with_peak_shift(n_clicks, final_replicate_dict):
     temp_replicate_dict = {key: value[1] for key, value in final_replicate_dict.items()}
     output_replicate_dict = {**{"ppm": ppm_scale}, **temp_replicate_dict}
@@ -0,0 +1,286 @@
+import hashlib
+import os
+import pathlib
+import pickle
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+from scipy import sparse
+import flask
+import dash
+
+# a dcc.Store holding a stored result only carries {HANDLE_KEY: key}
+HANDLE_KEY = "result_store"
+SESSION_COOKIE = "metassimulo_session"
+# session ids and content hashes are 32 hex characters, nothing else coming from the browser is trusted
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+RESULT_KEY_PATTERN = re.compile(r"^([0-9a-f]{32})/([0-9a-f]{32})$")
+# results on disk not used for this long are removed, at most once every RESULT_CLEANUP_INTERVAL
+RESULT_MAX_AGE = 24 * 3600
+RESULT_CLEANUP_INTERVAL = 600
+
+# session of the results stored outside a request (scripts, tests), never shared with a browser session
+_local_session_id = uuid.uuid4().hex
+
+
+def _update_digest(digest, value):
+    if isinstance(value, np.ndarray):
+        digest.update("ndarray{}{}".format(value.dtype.str, value.shape).encode("utf-8"))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif sparse.issparse(value):
+        value = value.tocsr()
+        digest.update("csr{}".format(value.shape).encode("utf-8"))
+        for array in (value.data, value.indices, value.indptr):
+            _update_digest(digest, array)
+    elif isinstance(value, dict):
+        digest.update("dict{}".format(len(value)).encode("utf-8"))
+        for key, item in value.items():
+            _update_digest(digest, key)
+            _update_digest(digest, item)
+    elif isinstance(value, (list, tuple)):
+        digest.update("{}{}".format(type(value).__name__, len(value)).encode("utf-8"))
+        for item in value:
+            _update_digest(digest, item)
+    else:
+        digest.update("{}:{!r}".format(type(value).__name__, value).encode("utf-8"))
+
+
+def get_content_hash(value):
+    """
+    hash of a result made of dicts, lists, numpy arrays, scipy sparse matrices and scalars; arrays are hashed from
+    their raw bytes, nothing is serialized
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _update_digest(digest, value)
+    return digest.hexdigest()
+
+
+def get_nbytes(value):
+    """
+    rough memory size of a result, used for the LRU budget of the in-process store
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        value = value.tocsr()
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_nbytes(key) + get_nbytes(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def is_result_handle(value):
+    return isinstance(value, dict) and len(value) == 1 and HANDLE_KEY in value
+
+
+def is_valid_session_id(session_id):
+    return isinstance(session_id, str) and SESSION_ID_PATTERN.match(session_id) is not None
+
+
+def get_session_id():
+    """
+    id of the browser session of the current callback, read from the cookie set by init_result_store; a request
+    without a valid cookie gets a new id (sent back as its cookie), so such requests never share a session
+    """
+    if not flask.has_request_context():
+        return _local_session_id
+    if "result_store_session" not in flask.g:
+        session_id = flask.request.cookies.get(SESSION_COOKIE)
+        flask.g.result_store_session = session_id if is_valid_session_id(session_id) else uuid.uuid4().hex
+    return flask.g.result_store_session
+
+
+def parse_result_key(key):
+    """
+    (session id, content hash) of a result key, raises KeyError for anything else, e.g. a handle forged in the
+    browser
+    """
+    match = RESULT_KEY_PATTERN.match(key) if isinstance(key, str) else None
+    if match is None:
+        raise KeyError("invalid result handle")
+    return match.group(1), match.group(2)
+
+
+class ResultStore:
+    """
+    server-side store of callback results (simulated replicates, preprocessed libraries, ...) keyed by session and
+    content hash, so the browser only holds a small handle instead of the JSON of the arrays
+    results live in an in-process LRU cache holding at most max_bytes; with a cache_dir they are also written there,
+    so a result evicted from memory, or produced by another worker process, can still be read back; the files not
+    used for max_age seconds are removed
+    a result can only be read back from the session that stored it
+    """
+    def __init__(self, max_bytes=2 * 1024 ** 3, cache_dir=None, max_age=RESULT_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+        self.max_age = max_age
+        self.last_cleanup = 0.0
+        self.cache = OrderedDict()
+        self.cache_bytes = dict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def configure(self, max_bytes=None, cache_dir=None, max_age=None):
+        with self.lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if cache_dir is not None:
+                self.cache_dir = pathlib.Path(cache_dir)
+            if max_age is not None:
+                self.max_age = max_age
+
+    def _get_file(self, session_id, content_hash):
+        # both parts were checked by parse_result_key or made on the server
+        return self.cache_dir.joinpath(session_id, content_hash + ".pkl")
+
+    def _add_to_cache(self, key, value):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return
+            self.cache[key] = value
+            self.cache_bytes[key] = get_nbytes(value)
+            self.total_bytes += self.cache_bytes[key]
+            while self.total_bytes > self.max_bytes and len(self.cache) > 1:
+                evicted_key, _ = self.cache.popitem(last=False)
+                self.total_bytes -= self.cache_bytes.pop(evicted_key)
+
+    def put(self, value, session_id=None):
+        """
+        store value and return its handle; storing the same content twice in a session gives the same handle
+        """
+        session_id = get_session_id() if session_id is None else session_id
+        if not is_valid_session_id(session_id):
+            raise ValueError("invalid session id")
+        content_hash = get_content_hash(value)
+        key = "{}/{}".format(session_id, content_hash)
+        self._add_to_cache(key, value)
+
+        if self.cache_dir is not None:
+            self.remove_old_results()
+            result_file = self._get_file(session_id, content_hash)
+            if result_file.exists():
+                os.utime(str(result_file))
+            else:
+                result_file.parent.mkdir(parents=True, exist_ok=True)
+                temp_file = result_file.with_suffix(".pkl.tmp{}".format(uuid.uuid4().hex))
+                with open(str(temp_file), "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(str(temp_file), str(result_file))
+        return {HANDLE_KEY: key}
+
+    def get(self, handle):
+        """
+        the value stored under handle, anything that is not a handle is returned as it is
+        raises KeyError for a malformed handle, a handle of another session, or when the result was evicted and there
+        is no copy on disk
+        """
+        if not is_result_handle(handle):
+            return handle
+        session_id, content_hash = parse_result_key(handle[HANDLE_KEY])
+        if session_id != get_session_id():
+            raise KeyError("the result does not belong to this session")
+        key = "{}/{}".format(session_id, content_hash)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        if self.cache_dir is not None:
+            result_file = self._get_file(session_id, content_hash)
+            if result_file.exists():
+                with open(str(result_file), "rb") as f:
+                    value = pickle.load(f)
+                os.utime(str(result_file))
+                self._add_to_cache(key, value)
+                return value
+        raise KeyError("the result {} is no longer stored, please run the step again".format(key))
+
+    def remove_old_results(self, force=False):
+        """
+        remove the result files (and the emptied session folders) of cache_dir not used for max_age seconds; runs at
+        most once every RESULT_CLEANUP_INTERVAL seconds unless force
+        """
+        now = time.time()
+        with self.lock:
+            if self.cache_dir is None or (not force and now - self.last_cleanup < RESULT_CLEANUP_INTERVAL):
+                return
+            self.last_cleanup = now
+        if not self.cache_dir.exists():
+            return
+        for session_dir in self.cache_dir.iterdir():
+            if not session_dir.is_dir() or not is_valid_session_id(session_dir.name):
+                continue
+            for result_file in session_dir.iterdir():
+                try:
+                    if now - result_file.stat().st_mtime > self.max_age:
+                        result_file.unlink()
+                except FileNotFoundError:
+                    # removed by another process in the meantime
+                    pass
+            try:
+                session_dir.rmdir()
+            except OSError:
+                # not empty
+                pass
+
+
+result_store = ResultStore()
+
+
+def configure_result_store(param_dict):
+    """
+    optional parameters: result_store_max_mb (memory budget, default 2048), result_store_dir (on-disk copies) and
+    result_store_max_age_hours (on-disk copies not used for longer are removed, default 24)
+    """
+    max_bytes = int(float(param_dict['result_store_max_mb']) * 1024 ** 2) if 'result_store_max_mb' in param_dict \
+        else None
+    max_age = float(param_dict['result_store_max_age_hours']) * 3600 if 'result_store_max_age_hours' in param_dict \
+        else None
+    result_store.configure(max_bytes, param_dict.get('result_store_dir'), max_age)
+
+
+def init_result_store(server):
+    """
+    give every browser a session cookie, so the results of different users never share a key
+    """
+    @server.after_request
+    def set_session_cookie(response):
+        session_id = get_session_id()
+        if flask.request.cookies.get(SESSION_COOKIE) != session_id:
+            response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax")
+        return response
+
+
+def use_result_store(output_indices=(), single_output=False):
+    """
+    decorator of a Dash callback (below @app.callback) whose dcc.Store inputs/outputs go through result_store:
+    handle arguments are replaced by their stored values, and the outputs at output_indices (or the whole return
+    value with single_output=True) are stored and replaced by their handles; None and dash.no_update pass through
+    """
+    def store_value(value):
+        if value is None or value is dash.no_update:
+            return value
+        return result_store.put(value)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            result = func(*[result_store.get(arg) for arg in args])
+            if single_output:
+                return store_value(result)
+            if output_indices and isinstance(result, (list, tuple)):
+                result = list(result)
+                for idx in output_indices:
+                    result[idx] = store_value(result[idx])
+            return result
+        return wrapper
+    return decorator
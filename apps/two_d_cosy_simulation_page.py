@@ -23,29 +23,44 @@ from dash.dependencies import Input, Output, State, MATCH, ALL, ClientsideFuncti
 from dash import dash_table
 # import dash_uploader as du
 
-from simulate_2D.construct_hmdb_avg_cons import get_hmdb_normal_avg_cons, get_hmdb_abnormal_avg_cons
-from simulate_2D.sample_concentrations import simulate_concentrations, simulate_continuous_concentrations
+from simulate_2D.construct_hmdb_avg_cons import load_hmdb_cons_table_with_cache
+from simulate_2D.sample_concentrations import simulate_concentrations, simulate_continuous_concentrations, \
+    pos_normal_no_correlated
 
 from simulate_2D.read_parameters import read_param
-from simulate_2D.read_2d_spectra import read_2d_cosy
+from simulate_1D.hmdb_names import load_hmdb_name_index
+from simulate_2D.random_streams import get_seed_sequence, get_child_rng
+from simulate_2D.read_2d_spectra import read_2d_cosy, read_2d_data_with_cache
 from simulate_2D.match_names import db_match_cons, input_match_db, format_input_mixture, input_cons_match_db
 from simulate_2D.match_names import input_corr_match_db, db_names_match_hmdb_names
 from simulate_2D.preprocess_2d_spectra import remove_water_calibration, filter_noise, smooth_data, normalize_data
+from simulate_2D.sparse_spectra import to_dense, to_sparse_dict, to_sparse_replicate_dict
 from simulate_2D.plot_2d_spectra import plot_2d_cosy_spectra, plot_cosy_repli_spectra, plot_cosy_repli_spectra_with_ph
 from simulate_2D.calculate_2d_without_peak_shift import simulate_cosy_mixture_for_all_repli, \
     simulate_continuous_cosy_mixture_for_all_repli
 from simulate_2D.calculate_peak_shift_for_cosy import get_mixture_data_for_all_replicates, \
-    conti_get_mixture_data_for_all_replicates
+    conti_get_mixture_data_for_all_replicates, get_cosy_peak_cluster_cache_file
 
 
 from app import app
+from result_store import use_result_store, configure_result_store, get_session_id
+from job_queue import job_queue, job_components, register_cancel_callback, configure_job_queue, \
+    format_job_status, report_step_progress, DONE, FINISHED_STATES
 tracemalloc.start()
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-p", "--parameter", dest="parameter_file", required=True, help="Input Parameter Files")
 args = parser.parse_args()
 param_dict = read_param(args.parameter_file)
+configure_result_store(param_dict)
+configure_job_queue(param_dict)
 file_path_2d = param_dict['file_path_cosy']
+# optional number of parallel readers used when the 2d library is (re)built
+num_workers_2d = int(param_dict['num_workers']) if 'num_workers' in param_dict else None
+# optional seed of all random draws (concentrations, pH, pKa, delta_acid_base, noise), without it every run differs
+simulation_seed = int(param_dict['seed']) if 'seed' in param_dict else None
+# optional size limit (MB) of the spectra kept in memory when the 2d library is read lazily
+lazy_cache_bytes_2d = int(param_dict.get('lazy_cache_mb', 1024)) * 1024 ** 2
 
 base_path = pathlib.Path(__file__).resolve().parents[1]
 
@@ -53,20 +68,22 @@ base_path = pathlib.Path(__file__).resolve().parents[1]
 # cons_df_2 = pd.read_csv(base_path.joinpath("Input/cons_df_2.csv"), index_col=0)
 protons_df = pd.read_csv(base_path.joinpath("Input/hmdb_protons.csv"), index_col=0)
 
-data_dict, x_scale, y_scale = read_2d_cosy(file_path_2d)
 # print(np.max(data_dict["Citric Acid"]))
 
-with open(base_path.joinpath("Input/hmdb_id_names.json")) as json_file_1:
-    hmdb_dict = json.load(json_file_1)
+# one HMDB ID <-> names index per process, shared by the 1D, JRes and COSY pages (see simulate_1D.hmdb_names)
+hmdb_dict = load_hmdb_name_index(base_path.joinpath("Input/hmdb_id_names.json"))
 
 # match_data_dict = db_match_cons(data_dict, cons_df_1, hmdb_dict)
-match_data_dict = db_names_match_hmdb_names(data_dict, hmdb_dict)
+# read 2d data and keep the names matching HMDB, the memory-mapped library is used if it is up to date,
+# otherwise each metabolite is read on first use while the library is rebuilt in the background (num_workers readers)
+match_data_dict, x_scale, y_scale = read_2d_data_with_cache(file_path_2d, read_2d_cosy, hmdb_dict,
+                                                            num_workers=num_workers_2d, lazy=True,
+                                                            max_bytes=lazy_cache_bytes_2d)
 # print(np.max(match_data_dict["citric acid"]))
 
-with open(base_path.joinpath("Input/hmdb_normal_concentrations.json")) as json_file_2:
-    hmdb_norm_cons_dict = json.load(json_file_2)
-with open(base_path.joinpath("Input/hmdb_abnormal_concentrations.json")) as json_file_3:
-    hmdb_abnorm_cons_dict = json.load(json_file_3)
+# mean / std / unit of every HMDB ID, biospecimen and condition, parsed once (see construct_hmdb_avg_cons.py)
+hmdb_cons_table = load_hmdb_cons_table_with_cache(base_path.joinpath("Input/hmdb_normal_concentrations.json"),
+                                                  base_path.joinpath("Input/hmdb_abnormal_concentrations.json"))
 with open(base_path.joinpath("Input/hmdb_id_pka.json")) as json_file_4:
     hmdb_id_pka_dict = json.load(json_file_4)
 
@@ -1613,6 +1630,8 @@ page_3_group_peak_shift_group_1_results_div = dbc.Card(
             [
                 html.H6("Results of Normal Group (Group 1)", style={"font-weight": "bold", "color": "steelblue"}),
                 # html.Br(),
+                # the simulation of both groups runs as a background job, its progress is polled
+                job_components("page-3-group-peak-shift-groups"),
                 dcc.Loading(children=[
                     dcc.Dropdown(id='page-3-group-peak-shift-select-repli-1', multi=False,),
                     dcc.Graph(id="page-3-group-peak-shift-group-1-spectra-fig"),
@@ -3572,11 +3591,7 @@ def page_3_update_hmdb_selections(n_clicks, mixture_list):
 def page_3_get_name_hmdb_id_dict(in_db_mixture_list):
     db_name_hmdb_id_dict = dict()
     for name in in_db_mixture_list:
-        idx_list = []
-        for idx, name_list in hmdb_dict.items():
-            if name in name_list:
-                idx_list.append({idx: hmdb_dict[idx][0]})
-        db_name_hmdb_id_dict[name] = idx_list
+        db_name_hmdb_id_dict[name] = [{idx: hmdb_dict[idx][0]} for idx in hmdb_dict.get_ids(name)]
     return db_name_hmdb_id_dict
 
 
@@ -3838,8 +3853,8 @@ def page_3_update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
         if select_hmdb_data_1 == "hmdb" and select_hmdb_data_2 == "hmdb":
             table_data = []
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_1, avg_std_1, unit_1 = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type_1)
-                avg_mean_2, avg_std_2, unit_2 = get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, bio_type_2)
+                avg_mean_1, avg_std_1, unit_1 = hmdb_cons_table.get_normal_avg_cons(hmdb_id, bio_type_1)
+                avg_mean_2, avg_std_2, unit_2 = hmdb_cons_table.get_abnormal_avg_cons(hmdb_id, bio_type_2)
                 temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id, "mean_1": avg_mean_1, "std_1": avg_std_1,
                              "mean_2": avg_mean_2, "std_2": avg_std_2}
                 table_data.append(temp_dict)
@@ -3851,7 +3866,7 @@ def page_3_update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
             temp_cons_df.columns = ["meta_name", "mean_2", "std_2"]
             temp_cons_dict = temp_cons_df.to_dict('records')
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_1, avg_std_1, unit_1 = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type_1)
+                avg_mean_1, avg_std_1, unit_1 = hmdb_cons_table.get_normal_avg_cons(hmdb_id, bio_type_1)
                 temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, temp_cons_dict))[0]
                 temp_dict["hmdb_id"] = hmdb_id
                 temp_dict["mean_1"] = avg_mean_1
@@ -3865,7 +3880,7 @@ def page_3_update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
             temp_cons_df.columns = ["meta_name", "mean_1", "std_1"]
             temp_cons_dict = temp_cons_df.to_dict('records')
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_2, avg_std_2, unit_2 = get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, bio_type_2)
+                avg_mean_2, avg_std_2, unit_2 = hmdb_cons_table.get_abnormal_avg_cons(hmdb_id, bio_type_2)
                 temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, temp_cons_dict))[0]
                 temp_dict["hmdb_id"] = hmdb_id
                 temp_dict["mean_2"] = avg_mean_2
@@ -3959,8 +3974,8 @@ def page_3_update_simulated_cons_table(n_clicks, table_rows, final_name_hmdb_id_
         corr_df_1 = page_3_parse_corr_df(corr_filename_1, corr_contents_1)
         corr_df_2 = page_3_parse_corr_df(corr_filename_2, corr_contents_2)
         # print("table_rows: ", table_rows)
-        simulated_cons_df_1 = simulate_concentrations(table_rows, num_repli_1, corr_flag_1, corr_df_1, "1")
-        simulated_cons_df_2 = simulate_concentrations(table_rows, num_repli_2, corr_flag_2, corr_df_2, "2")
+        simulated_cons_df_1 = simulate_concentrations(table_rows, num_repli_1, corr_flag_1, corr_df_1, "1", seed=simulation_seed)
+        simulated_cons_df_2 = simulate_concentrations(table_rows, num_repli_2, corr_flag_2, corr_df_2, "2", seed=simulation_seed)
         table_columns = [{"name": ["", "Name"], "id": "meta_name"}, {"name": ["", "HMDB ID"], "id": "hmdb_id"}] + \
                         [{"name": ["Group 1 (Normal)", "Replicate_{}".format(i+1)], "id": "1_replicate_{}".format(i+1),
                           "hideable": True} for i in range(num_repli_1)] + \
@@ -4106,7 +4121,7 @@ def page_3_update_continuous_cons_mean_std_table(n_clicks, final_name_hmdb_id_di
         if select_hmdb_data == "hmdb":
             table_data = []
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean, avg_std, unit = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, conti_bio_type)
+                avg_mean, avg_std, unit = hmdb_cons_table.get_normal_avg_cons(hmdb_id, conti_bio_type)
                 temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id, "mean": avg_mean, "std": avg_std, "a": 0, "std_error": 0}
                 table_data.append(temp_dict)
             return {"display": "block"}, table_data, table_columns, {"display": "block"}
@@ -4169,16 +4184,17 @@ def page_3_update_conti_simulated_cons_table(n_clicks, table_rows, y_num_repli,
         table_columns = [{"name": "Name", "id": "meta_name"}, {"name": "HMDB ID", "id": "hmdb_id"}] + \
                         [{"name": "Replicate_{}".format(i+1), "id": "replicate_{}".format(i+1)}
                          for i in range(y_num_repli)]
+        y_rng = get_child_rng(simulation_seed, "y")
         if dist_type == "normal":
-            sample_y = np.round(np.random.normal(y_mean, y_std, y_num_repli), 2)
+            sample_y = np.round(y_rng.normal(y_mean, y_std, y_num_repli), 2)
         elif dist_type == "uniform":
-            sample_y = np.round(np.random.uniform(y_min, y_max, y_num_repli), 2)
+            sample_y = np.round(y_rng.uniform(y_min, y_max, y_num_repli), 2)
         else:
             sample_y = []
         y_temp_dict = dict({"meta_name": "Y", "hmdb_id": "/"},
                            **dict(zip(["replicate_{}".format(i + 1) for i in range(y_num_repli)], sample_y)))
         x_cons_dict_list, meta_with_y_list, meta_not_y_list = \
-            simulate_continuous_concentrations(table_rows, y_num_repli, sample_y)
+            simulate_continuous_concentrations(table_rows, y_num_repli, sample_y, seed=simulation_seed)
         table_data = [y_temp_dict] + x_cons_dict_list
         style_data_conditional = [{
             "if": {"row_index": 0},
@@ -4372,6 +4388,7 @@ def page_3_update_all_fig_dropdown(n_clicks, final_name_hmdb_id_dict):
         State("page-3-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_update_group_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -4385,9 +4402,9 @@ def page_3_update_group_process_data(n_clicks, cal_range, water_range, filter_th
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
 
-        return norm_data_dict
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -4398,6 +4415,7 @@ def page_3_update_group_process_data(n_clicks, cal_range, water_range, filter_th
         Input("page-3-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4422,6 +4440,7 @@ def page_3_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
         State("page-3-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0, 1))
 def page_3_update_groups_mix_fig(n_clicks, norm_data_dict, snr, num_repli_1, num_repli_2, table_rows):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
@@ -4433,7 +4452,7 @@ def page_3_update_groups_mix_fig(n_clicks, norm_data_dict, snr, num_repli_1, num
                                                            table_rows, protons_df, snr, "2")
         # print(final_data_dict_1)
         # print(final_data_dict_2)
-        return final_data_dict_1, final_data_dict_2
+        return to_sparse_replicate_dict(final_data_dict_1), to_sparse_replicate_dict(final_data_dict_2)
 
 
 @app.callback(
@@ -4449,6 +4468,7 @@ def page_3_update_groups_mix_fig(n_clicks, norm_data_dict, snr, num_repli_1, num
         Input("page-3-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_3_update_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         # print("not arrive here!!!!!!!")
@@ -4476,6 +4496,7 @@ def page_3_update_group_replicate_selection(n_clicks, final_data_dict_1, final_d
         # Input("page-3-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_3_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4492,6 +4513,7 @@ def page_3_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1):
         # Input("page-3-contour-level-2", "value")
     ]
 )
+@use_result_store()
 def page_3_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4505,6 +4527,7 @@ def page_3_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2):
     State("page-3-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
 
     final_df = page_3_construct_2d_df_without_peak_shift(final_replicate_dict)
@@ -4519,7 +4542,7 @@ def page_3_construct_2d_df_without_peak_shift(final_replicate_dict):
 
     df_list = []
     for key, value in final_replicate_dict.items():
-        df_list.append(pd.DataFrame(np.array(value)))
+        df_list.append(pd.DataFrame(to_dense(value)))
 
     final_df = pd.concat(df_list, axis=0)
     final_df.columns = x_scale
@@ -4533,6 +4556,7 @@ def page_3_construct_2d_df_without_peak_shift(final_replicate_dict):
     State("page-3-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "group_2_simulated_jres_spectra_without_peak_shift.csv")
@@ -4601,8 +4625,8 @@ def page_3_update_group_cons_ph_table(n_clicks, cons_table_data, cons_table_colu
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list_1 = page_3_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1)
-        ph_list_2 = page_3_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2)
+        ph_list_1 = page_3_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(simulation_seed, "ph", "1"))
+        ph_list_2 = page_3_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(simulation_seed, "ph", "2"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list_1, ph_list_2))
         name_list = ["meta_name", "hmdb_id"] + ["1_replicate_" + str(i + 1) for i in range(num_repli_1)] + \
                     ["2_replicate_" + str(i + 1) for i in range(num_repli_2)]
@@ -4612,22 +4636,19 @@ def page_3_update_group_cons_ph_table(n_clicks, cons_table_data, cons_table_colu
         return {"display": "block"}, table_data, cons_table_columns, style_data_conditional, {"display": "block"}, {"display": "block"}
 
 
-def page_3_sample_ph_list(num_replicate, ph_same_flag, same_ph, ph_mean, ph_std):
+def page_3_sample_ph_list(num_replicate, ph_same_flag, same_ph, ph_mean, ph_std, rng=None):
     if ph_same_flag == "true":
         ph_list = np.round([same_ph] * num_replicate, 2)
     elif ph_same_flag == "false":
-        ph_list = np.round(page_3_get_positive_ph(ph_mean, ph_std, num_replicate), 2)
+        ph_list = np.round(page_3_get_positive_ph(ph_mean, ph_std, num_replicate, rng), 2)
     else:
         ph_list = [7.4] * num_replicate
     return ph_list
 
 
-def page_3_get_positive_ph(mean, std, num_replicates):
-    x = np.random.normal(mean,std, num_replicates)
-    if np.all(x > 0):
-        return x
-    else:
-        return page_3_get_positive_ph(mean, std, num_replicates)
+def page_3_get_positive_ph(mean, std, num_replicates, rng=None):
+    # truncated normal, no more redrawing the whole list until every pH is positive
+    return pos_normal_no_correlated(mean, std, num_replicates, rng)
 
 
 @app.callback(
@@ -4642,6 +4663,7 @@ def page_3_get_positive_ph(mean, std, num_replicates):
         State("page-3-group-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_group_peak_shift_update_group_process_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -4655,8 +4677,8 @@ def page_3_group_peak_shift_update_group_process_data(n_clicks, cal_range, water
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -4684,6 +4706,7 @@ def page_3_group_peak_shift_update_all_fig_dropdown(n_clicks, final_name_hmdb_id
         Input("page-3-group-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4693,10 +4716,7 @@ def page_3_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dic
 
 
 @app.callback(
-    [
-        Output("page-3-group-peak-shift-group-1-final-dict", "data"),
-        Output("page-3-group-peak-shift-group-2-final-dict", "data"),
-    ],
+    Output("page-3-group-peak-shift-groups-job-id", "data"),
     [
         Input("page-3-group-peak-shift-confirm-param-btn", "n_clicks"),
         Input("page-3-group-peak-shift-processed-spectra-data-dict", "data"),
@@ -4705,32 +4725,83 @@ def page_3_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dic
         State("page-3-db-names-hmdb-ids-dict", "data"),
         State("page-3-group-peak-shift-snr-noise", "value"),
         State("page-3-group-cons-ph-table", "data"),
+        State("page-3-group-peak-shift-groups-job-id", "data"),
+        State("page-3-group-peak-shift-calibration-range", "value"),
+        State("page-3-group-peak-shift-water-range", "value"),
+        State("page-3-group-peak-shift-filter-thres", "value"),
+        State("page-3-group-peak-shift-smooth-thres-m", "value"),
+        State("page-3-group-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_3_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store()
+def page_3_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr,
+                                                     cons_ph_table_data, job_id,
+                                                     cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
-        return None, None
+        return None
     else:
+        # a new simulation replaces the one still running
+        job_queue.cancel(job_id, get_session_id())
         # mixture_list = list(map(lambda d: d["meta_name"], cons_ph_table_data))
         # mixture_list.remove('pH')
         mixture_dict = {item['meta_name']: item['hmdb_id'] for item in cons_ph_table_data}
         del mixture_dict["pH"]
         mixture_list = list(mixture_dict.keys())
 
-        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_3_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         group_repli_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
 
-        final_mix_data_dict_1 = get_mixture_data_for_all_replicates("1", group_repli_ph_dict, mixture_dict,
-                                                                    norm_data_dict, mixture_pka_dict, x_scale,
-                                                                    cons_ph_table_data, protons_df, snr)
-        final_mix_data_dict_2 = get_mixture_data_for_all_replicates("2", group_repli_ph_dict, mixture_dict,
-                                                                    norm_data_dict, mixture_pka_dict, x_scale,
-                                                                    cons_ph_table_data, protons_df, snr)
+        step_list = [
+            ("simulating group 1", get_mixture_data_for_all_replicates,
+             ("1", group_repli_ph_dict, mixture_dict, norm_data_dict, mixture_pka_dict, x_scale, cons_ph_table_data,
+              protons_df, snr), {"seed": simulation_seed, "progress": report_step_progress,
+                                 "cluster_cache_file": cluster_file}),
+            ("simulating group 2", get_mixture_data_for_all_replicates,
+             ("2", group_repli_ph_dict, mixture_dict, norm_data_dict, mixture_pka_dict, x_scale, cons_ph_table_data,
+              protons_df, snr), {"seed": simulation_seed, "progress": report_step_progress,
+                                 "cluster_cache_file": cluster_file}),
+        ]
+        return job_queue.submit("page 3 groups mixture with peak shift", step_list, get_session_id())
+
+
+@app.callback(
+    [
+        Output("page-3-group-peak-shift-group-1-final-dict", "data"),
+        Output("page-3-group-peak-shift-group-2-final-dict", "data"),
+        Output("page-3-group-peak-shift-groups-job-status", "children"),
+        Output("page-3-group-peak-shift-groups-job-interval", "disabled"),
+    ],
+    [
+        # a new job id starts the polling, the polling callback alone enables and disables the interval
+        Input("page-3-group-peak-shift-groups-job-interval", "n_intervals"),
+        Input("page-3-group-peak-shift-groups-job-id", "data"),
+    ],
+)
+@use_result_store(output_indices=(0, 1))
+def page_3_group_peak_shift_update_groups_repli_data_from_job(n_intervals, job_id):
+    status = job_queue.get_status(job_id, get_session_id()) if job_id is not None else None
+    if status is None or status["status"] != DONE:
+        finished = status is None or status["status"] in FINISHED_STATES
+        return dash.no_update, dash.no_update, format_job_status(status), finished
+    else:
+        final_mix_data_dict_1, final_mix_data_dict_2 = job_queue.get_result(job_id, get_session_id())
         # print(final_mix_data_dict_1["replicate_1"])
-        return final_mix_data_dict_1, final_mix_data_dict_2
+        return to_sparse_replicate_dict(final_mix_data_dict_1), to_sparse_replicate_dict(final_mix_data_dict_2), "", \
+            True
+
+
+register_cancel_callback(app, "page-3-group-peak-shift-groups")
 
 
-def page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
+def page_3_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
+    # the peak clusters of the library spectra preprocessed with these parameters, stored next to the library
+    return get_cosy_peak_cluster_cache_file(match_data_dict, [cal_range, water_range, filter_thres, smooth_thres_m,
+                                                              smooth_thres_n])
+
+
+def page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=None):
+    seed = get_seed_sequence(seed)
     mixture_pka_dict = dict()
     for meta_name in mixture_list:
         temp_pka_dict = hmdb_id_pka_dict[final_names_hmdb_id_dict[meta_name]]
@@ -4749,7 +4820,7 @@ def page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
         elif temp_pka_1 is not None and temp_pka_2 is None:
             temp_pka = temp_pka_1
         else:
-            temp_pka = np.random.normal(6.013, 2.972, 1)[0]
+            temp_pka = get_child_rng(seed, "pka", meta_name).normal(6.013, 2.972, 1)[0]
         mixture_pka_dict[meta_name] = temp_pka
     return mixture_pka_dict
 
@@ -4790,6 +4861,7 @@ def page_3_group_peak_shift_update_group_replicate_selection(n_clicks, num_repli
         Input("page-3-group-peak-shift-select-repli-1", "value"),
     ]
 )
+@use_result_store()
 def page_3_group_peak_shift_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4806,6 +4878,7 @@ def page_3_group_peak_shift_update_group_1_figure(n_clicks, final_data_dict_1, s
         Input("page-3-group-peak-shift-select-repli-2", "value"),
     ]
 )
+@use_result_store()
 def page_3_group_peak_shift_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4819,6 +4892,7 @@ def page_3_group_peak_shift_update_group_2_figure(n_clicks, final_data_dict_2, s
     State("page-3-group-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_group_peak_shift_download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "group_1_simulated_cosy_spectra_with_peak_shift.csv")
@@ -4832,7 +4906,7 @@ def page_3_construct_2d_df_with_peak_shift(final_replicate_dict):
 
     df_list = []
     for key, value in final_replicate_dict.items():
-        df_list.append(pd.DataFrame(np.array(value[1])))
+        df_list.append(pd.DataFrame(to_dense(value[1])))
 
     final_df = pd.concat(df_list, axis=0)
     final_df.columns = x_scale
@@ -4846,6 +4920,7 @@ def page_3_construct_2d_df_with_peak_shift(final_replicate_dict):
     State("page-3-group-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_group_peak_shift_download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "group_2_simulated_cosy_spectra_with_peak_shift.csv")
@@ -4864,6 +4939,7 @@ def page_3_group_peak_shift_download_group_2_simulated_spectra(n_clicks, final_r
         State("page-3-conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_update_continuous_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -4876,8 +4952,8 @@ def page_3_update_continuous_process_data(n_clicks, cal_range, water_range, filt
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -4905,6 +4981,7 @@ def page_3_update_continuous_all_fig_dropdown(n_clicks, final_name_hmdb_id_dict)
         Input("page-3-conti-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_update_continuous_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4929,6 +5006,7 @@ def page_3_update_continuous_results_all_fig(n_clicks, norm_data_dict, select_me
         State("page-3-conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def page_3_update_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr, y_num_repli, table_rows):
     if n_clicks == 0 or norm_data_dict is None:
         return None, [], None
@@ -4942,7 +5020,7 @@ def page_3_update_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr,
                                                                              protons_df, snr)
         options = [{"label": i, "value": i} for i in list(final_mix_data_dict.keys())]
         value = list(final_mix_data_dict.keys())[0]
-        return final_mix_data_dict, options, value
+        return to_sparse_replicate_dict(final_mix_data_dict), options, value
 
 
 @app.callback(
@@ -4953,6 +5031,7 @@ def page_3_update_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr,
         State("page-3-conti-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_3_update_continuous_mix_fig(select_replicate, n_clicks, final_data_dict):
     if n_clicks == 0 or select_replicate is None or final_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5029,6 +5108,7 @@ def page_3_plot_conti_results_line_plot(table_data, select_replicate):
     State("page-3-conti-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "continuous_simulated_cosy_spectra_without_peak_shift.csv")
@@ -5076,7 +5156,7 @@ def page_3_update_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list = page_3_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std)
+        ph_list = page_3_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std, get_child_rng(simulation_seed, "ph"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list))
         name_list = ["meta_name", "hmdb_id"] + ["replicate_" + str(i + 1) for i in range(y_num_repli)]
         temp_dict = dict(zip(name_list, all_ph_list))
@@ -5098,6 +5178,7 @@ def page_3_update_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table
         State("page-3-conti-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_continuous_peak_shift_update_processed_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -5111,8 +5192,8 @@ def page_3_continuous_peak_shift_update_processed_data(n_clicks, cal_range, wate
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5140,6 +5221,7 @@ def page_3_continuous_peak_shift_update_all_fig_dropdown(n_clicks, final_name_hm
         Input("page-3-conti-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_continuous_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5158,9 +5240,16 @@ def page_3_continuous_peak_shift_update_group_results_all_fig(n_clicks, norm_dat
         State("page-3-db-names-hmdb-ids-dict", "data"),
         State("page-3-conti-peak-shift-snr-noise", "value"),
         State("page-3-conti-cons-ph-table", "data"),
+        State("page-3-conti-peak-shift-calibration-range", "value"),
+        State("page-3-conti-peak-shift-water-range", "value"),
+        State("page-3-conti-peak-shift-filter-thres", "value"),
+        State("page-3-conti-peak-shift-smooth-thres-m", "value"),
+        State("page-3-conti-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_3_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(single_output=True)
+def page_3_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                         cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
@@ -5169,13 +5258,15 @@ def page_3_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dic
         del mixture_dict["Y"]
         mixture_list = list(mixture_dict.keys())
 
-        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_3_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         conti_repli_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
 
         final_mix_data_dict = conti_get_mixture_data_for_all_replicates(conti_repli_ph_dict, mixture_dict,
                                                                         norm_data_dict, mixture_pka_dict, x_scale,
-                                                                        cons_ph_table_data, protons_df, snr)
-        return final_mix_data_dict
+                                                                        cons_ph_table_data, protons_df, snr, seed=simulation_seed,
+                                                                        cluster_cache_file=cluster_file)
+        return to_sparse_replicate_dict(final_mix_data_dict)
 
 
 @app.callback(
@@ -5203,6 +5294,7 @@ def page_3_group_peak_shift_update_group_replicate_selection(n_clicks, y_num_rep
         Input("page-3-conti-peak-shift-select-replicate", "value"),
     ]
 )
+@use_result_store()
 def page_3_continuous_peak_shift_update_mix_figure(n_clicks, final_data_dict, select_repli):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5232,6 +5324,7 @@ def page_3_update_continuous_peak_shift_meta_y_line_plot(select_replicate, n_cli
     State("page-3-conti-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_conti_peak_shift_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "continuous_simulated_cosy_spectra_with_peak_shift.csv")
@@ -5268,6 +5361,7 @@ def page_3_update_upload_all_fig_dropdown(n_clicks, final_name_hmdb_id_dict):
         State("page-3-upload-discrete-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_update_upload_group_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -5279,8 +5373,8 @@ def page_3_update_upload_group_process_data(n_clicks, cal_range, water_range, fi
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5291,6 +5385,7 @@ def page_3_update_upload_group_process_data(n_clicks, cal_range, water_range, fi
         Input("page-3-upload-group-no-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_update_upload_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5313,6 +5408,7 @@ def page_3_update_upload_group_results_all_fig(n_clicks, norm_data_dict, select_
         State("page-3-upload-discrete-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0, 1))
 def page_3_update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, table_rows):
     num_repli_1 = sum(1 for i in table_rows[0].keys() if i[0] == "1")
     num_repli_2 = sum(1 for i in table_rows[0].keys() if i[0] == "2")
@@ -5324,7 +5420,7 @@ def page_3_update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, table_row
                                                                 table_rows, protons_df, snr, "1")
         final_data_dict_2 = simulate_cosy_mixture_for_all_repli(num_repli_2, mixture_dict, norm_data_dict,
                                                                 table_rows, protons_df, snr, "2")
-        return final_data_dict_1, final_data_dict_2
+        return to_sparse_replicate_dict(final_data_dict_1), to_sparse_replicate_dict(final_data_dict_2)
 
 
 @app.callback(
@@ -5340,6 +5436,7 @@ def page_3_update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, table_row
         Input("page-3-upload-group-no-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_3_update_upload_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         # print("not arrive here!!!!!!!")
@@ -5361,6 +5458,7 @@ def page_3_update_upload_group_replicate_selection(n_clicks, final_data_dict_1,
         Input("page-3-upload-group-no-peak-shift-select-repli-1", "value"),
     ]
 )
+@use_result_store()
 def page_3_update_upload_group_1_figure(n_clicks, final_data_dict_1, select_repli_1):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5376,6 +5474,7 @@ def page_3_update_upload_group_1_figure(n_clicks, final_data_dict_1, select_repl
         Input("page-3-upload-group-no-peak-shift-select-repli-2", "value"),
     ]
 )
+@use_result_store()
 def page_3_update_upload_group_2_figure(n_clicks, final_data_dict_2, select_repli_2):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5389,6 +5488,7 @@ def page_3_update_upload_group_2_figure(n_clicks, final_data_dict_2, select_repl
     State("page-3-upload-group-no-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_upload_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_1_simulated_cosy_spectra_without_peak_shift.csv")
@@ -5400,6 +5500,7 @@ def page_3_download_upload_group_1_simulated_spectra(n_clicks, final_replicate_d
     State("page-3-upload-group-no-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_upload_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_2_simulated_cosy_spectra_without_peak_shift.csv")
@@ -5468,8 +5569,8 @@ def page_3_update_upload_group_cons_ph_table(n_clicks, cons_table_data, cons_tab
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list_1 = page_3_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1)
-        ph_list_2 = page_3_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2)
+        ph_list_1 = page_3_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(simulation_seed, "ph", "1"))
+        ph_list_2 = page_3_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(simulation_seed, "ph", "2"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list_1, ph_list_2))
         name_list = ["meta_name", "hmdb_id"] + ["1_replicate_" + str(i + 1) for i in range(num_repli_1)] + \
                     ["2_replicate_" + str(i + 1) for i in range(num_repli_2)]
@@ -5491,6 +5592,7 @@ def page_3_update_upload_group_cons_ph_table(n_clicks, cons_table_data, cons_tab
         State("page-3-upload-group-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_upload_group_peak_shift_update_group_process_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -5504,8 +5606,8 @@ def page_3_upload_group_peak_shift_update_group_process_data(n_clicks, cal_range
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5533,6 +5635,7 @@ def page_3_upload_group_peak_shift_update_all_fig_dropdown(n_clicks, final_name_
         Input("page-3-upload-group-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5554,9 +5657,16 @@ def page_3_upload_group_peak_shift_update_group_results_all_fig(n_clicks, norm_d
         State("page-3-db-names-hmdb-ids-dict", "data"),
         State("page-3-upload-group-peak-shift-snr-noise", "value"),
         State("page-3-upload-group-cons-ph-table", "data"),
+        State("page-3-upload-group-peak-shift-calibration-range", "value"),
+        State("page-3-upload-group-peak-shift-water-range", "value"),
+        State("page-3-upload-group-peak-shift-filter-thres", "value"),
+        State("page-3-upload-group-peak-shift-smooth-thres-m", "value"),
+        State("page-3-upload-group-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_3_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(output_indices=(0, 1))
+def page_3_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                            cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
@@ -5564,16 +5674,19 @@ def page_3_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_
         del mixture_dict["pH"]
         mixture_list = list(mixture_dict.keys())
 
-        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_3_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         group_repli_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
 
         final_mix_data_dict_1 = get_mixture_data_for_all_replicates("1", group_repli_ph_dict, mixture_dict,
                                                                     norm_data_dict, mixture_pka_dict, x_scale,
-                                                                    cons_ph_table_data, protons_df, snr)
+                                                                    cons_ph_table_data, protons_df, snr, seed=simulation_seed,
+                                                                    cluster_cache_file=cluster_file)
         final_mix_data_dict_2 = get_mixture_data_for_all_replicates("2", group_repli_ph_dict, mixture_dict,
                                                                     norm_data_dict, mixture_pka_dict, x_scale,
-                                                                    cons_ph_table_data, protons_df, snr)
-        return final_mix_data_dict_1, final_mix_data_dict_2
+                                                                    cons_ph_table_data, protons_df, snr, seed=simulation_seed,
+                                                                    cluster_cache_file=cluster_file)
+        return to_sparse_replicate_dict(final_mix_data_dict_1), to_sparse_replicate_dict(final_mix_data_dict_2)
 
 
 
@@ -5590,6 +5703,7 @@ def page_3_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_
         Input("page-3-upload-group-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_update_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         return [], None, [], None
@@ -5609,6 +5723,7 @@ def page_3_upload_group_peak_shift_update_group_replicate_selection(n_clicks, fi
         Input("page-3-upload-group-peak-shift-select-repli-1", "value"),
     ]
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5624,6 +5739,7 @@ def page_3_upload_group_peak_shift_update_group_1_figure(n_clicks, final_data_di
         Input("page-3-upload-group-peak-shift-select-repli-2", "value"),
     ]
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5637,6 +5753,7 @@ def page_3_upload_group_peak_shift_update_group_2_figure(n_clicks, final_data_di
     State("page-3-upload-group-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_1_simulated_cosy_spectra_with_peak_shift.csv")
@@ -5648,6 +5765,7 @@ def page_3_upload_group_peak_shift_download_group_1_simulated_spectra(n_clicks,
     State("page-3-upload-group-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_2_simulated_cosy_spectra_with_peak_shift.csv")
@@ -5666,6 +5784,7 @@ def page_3_upload_group_peak_shift_download_group_2_simulated_spectra(n_clicks,
         State("page-3-upload-conti-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_update_upload_continuous_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -5678,8 +5797,8 @@ def page_3_update_upload_continuous_process_data(n_clicks, cal_range, water_rang
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5707,6 +5826,7 @@ def page_3_update_upload_continuous_all_fig_dropdown(n_clicks, final_name_hmdb_i
         Input("page-3-upload-conti-no-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_update_upload_continuous_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5730,6 +5850,7 @@ def page_3_update_upload_continuous_results_all_fig(n_clicks, norm_data_dict, se
         State("page-3-upload-conti-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def page_3_update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr, table_rows):
     y_num_repli = len(table_rows[0]) - 1
     if n_clicks == 0 or norm_data_dict is None:
@@ -5742,7 +5863,7 @@ def page_3_update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dic
                                                                              protons_df, snr)
         options = [{"label": i, "value": i} for i in list(final_mix_data_dict.keys())]
         value = list(final_mix_data_dict.keys())[0]
-        return final_mix_data_dict, options, value
+        return to_sparse_replicate_dict(final_mix_data_dict), options, value
 
 
 @app.callback(
@@ -5753,6 +5874,7 @@ def page_3_update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dic
         State("page-3-upload-conti-no-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_3_update_upload_continuous_mix_fig(select_replicate, n_clicks, final_data_dict):
     if n_clicks == 0 or select_replicate is None or final_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5783,6 +5905,7 @@ def page_3_update_upload_continuous_meta_y_line_plot(select_replicate, n_clicks,
     State("page-3-upload-conti-no-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_upload_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_continuous_simulated_cosy_spectra_without_peak_shift.csv")
@@ -5830,7 +5953,7 @@ def page_3_update_upload_continuous_cons_ph_table(n_clicks, cons_table_data, con
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list = page_3_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std)
+        ph_list = page_3_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std, get_child_rng(simulation_seed, "ph"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list))
         name_list = ["meta_name", "hmdb_id"] + ["replicate_" + str(i + 1) for i in range(y_num_repli)]
         temp_dict = dict(zip(name_list, all_ph_list))
@@ -5852,6 +5975,7 @@ def page_3_update_upload_continuous_cons_ph_table(n_clicks, cons_table_data, con
         State("page-3-upload-conti-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_3_upload_continuous_peak_shift_update_processed_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -5865,8 +5989,8 @@ def page_3_upload_continuous_peak_shift_update_processed_data(n_clicks, cal_rang
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5894,6 +6018,7 @@ def page_3_upload_continuous_peak_shift_update_all_fig_dropdown(n_clicks, final_
         Input("page-3-upload-conti-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_3_upload_continuous_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5912,9 +6037,16 @@ def page_3_upload_continuous_peak_shift_update_group_results_all_fig(n_clicks, n
         State("page-3-db-names-hmdb-ids-dict", "data"),
         State("page-3-upload-conti-peak-shift-snr-noise", "value"),
         State("page-3-upload-conti-cons-ph-table", "data"),
+        State("page-3-upload-conti-peak-shift-calibration-range", "value"),
+        State("page-3-upload-conti-peak-shift-water-range", "value"),
+        State("page-3-upload-conti-peak-shift-filter-thres", "value"),
+        State("page-3-upload-conti-peak-shift-smooth-thres-m", "value"),
+        State("page-3-upload-conti-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_3_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(single_output=True)
+def page_3_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                                cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
@@ -5923,13 +6055,15 @@ def page_3_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_d
         del mixture_dict["Y"]
         mixture_list = list(mixture_dict.keys())
 
-        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_3_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        mixture_pka_dict = page_3_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         conti_repli_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
 
         final_mix_data_dict = conti_get_mixture_data_for_all_replicates(conti_repli_ph_dict, mixture_dict,
                                                                         norm_data_dict, mixture_pka_dict, x_scale,
-                                                                        cons_ph_table_data, protons_df, snr)
-        return final_mix_data_dict
+                                                                        cons_ph_table_data, protons_df, snr, seed=simulation_seed,
+                                                                        cluster_cache_file=cluster_file)
+        return to_sparse_replicate_dict(final_mix_data_dict)
 
 
 @app.callback(
@@ -5942,6 +6076,7 @@ def page_3_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_d
         Input("page-3-upload-conti-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_3_upload_group_peak_shift_update_group_replicate_selection(n_clicks, final_data_dict):
     if n_clicks == 0 or final_data_dict is None:
         return [], None
@@ -5959,6 +6094,7 @@ def page_3_upload_group_peak_shift_update_group_replicate_selection(n_clicks, fi
         Input("page-3-upload-conti-peak-shift-select-replicate", "value"),
     ]
 )
+@use_result_store()
 def page_3_upload_continuous_peak_shift_update_mix_figure(n_clicks, final_data_dict, select_repli):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5988,6 +6124,7 @@ def page_3_update_upload_continuous_peak_shift_meta_y_line_plot(select_replicate
     State("page-3-upload-conti-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_3_download_upload_conti_peak_shift_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_3_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_continuous_simulated_cosy_spectra_with_peak_shift.csv")
@@ -23,15 +23,19 @@ from dash.dependencies import Input, Output, State, MATCH, ALL, ClientsideFuncti
 from dash import dash_table
 # import dash_uploader as du
 #
-from simulate_2D.construct_hmdb_avg_cons import get_hmdb_normal_avg_cons, get_hmdb_abnormal_avg_cons
-from simulate_2D.sample_concentrations import simulate_concentrations, simulate_continuous_concentrations
+from simulate_2D.construct_hmdb_avg_cons import load_hmdb_cons_table_with_cache
+from simulate_2D.sample_concentrations import simulate_concentrations, simulate_continuous_concentrations, \
+    pos_normal_no_correlated
 
 from simulate_2D.read_parameters import read_param
-from simulate_2D.read_2d_spectra import read_2d_data
+from simulate_1D.hmdb_names import load_hmdb_name_index
+from simulate_2D.random_streams import get_seed_sequence, get_child_rng
+from simulate_2D.read_2d_spectra import read_2d_data, read_2d_data_with_cache
 from simulate_2D.match_names import db_match_cons, input_match_db, format_input_mixture, input_cons_match_db
 from simulate_2D.match_names import input_corr_match_db, db_names_match_hmdb_names
 from simulate_2D.preprocess_2d_spectra import remove_water_calibration, filter_noise, smooth_data, normalize_data
-from simulate_2D.peak_detection_2d import get_p_jres_dict, get_peak_cluster_acid_base_list
+from simulate_2D.sparse_spectra import to_dense, to_sparse_dict, to_sparse_replicate_dict
+from simulate_2D.peak_detection_2d import get_p_jres, get_peak_cluster_acid_base_list, get_peak_cluster_cache_file
 from simulate_2D.calculate_2d_without_peak_shift import simulate_mixture_for_all_repli, simulate_continuous_mixture_for_all_repli
 from simulate_2D.calculate_2d_with_peak_shift import simulate_mixture_with_peak_shift_for_all_repli, \
     get_shift_p_jres_for_all_repli, simulate_mixture_continuous_with_peak_shift_for_all_repli
@@ -39,6 +43,9 @@ from simulate_2D.plot_2d_spectra import plot_jres_spectra, plot_stacked_spectra_
     plot_jres_spectra_with_ph
 
 from app import app
+from result_store import use_result_store, configure_result_store, get_session_id
+from job_queue import job_queue, job_components, register_cancel_callback, configure_job_queue, \
+    format_job_status, report_step_progress, DONE, FINISHED_STATES
 
 tracemalloc.start()
 
@@ -46,7 +53,15 @@ parser = argparse.ArgumentParser()
 parser.add_argument("-p", "--parameter", dest="parameter_file", required=True, help="Input Parameter Files")
 args = parser.parse_args()
 param_dict = read_param(args.parameter_file)
+configure_result_store(param_dict)
+configure_job_queue(param_dict)
 file_path_2d = param_dict['file_path_2D']
+# optional number of parallel readers used when the 2d library is (re)built
+num_workers_2d = int(param_dict['num_workers']) if 'num_workers' in param_dict else None
+# optional seed of all random draws (concentrations, pH, pKa, delta_acid_base, noise), without it every run differs
+simulation_seed = int(param_dict['seed']) if 'seed' in param_dict else None
+# optional size limit (MB) of the spectra kept in memory when the 2d library is read lazily
+lazy_cache_bytes_2d = int(param_dict.get('lazy_cache_mb', 1024)) * 1024 ** 2
 #
 base_path = pathlib.Path(__file__).resolve().parents[1]
 #
@@ -55,21 +70,23 @@ base_path = pathlib.Path(__file__).resolve().parents[1]
 protons_df = pd.read_csv(base_path.joinpath("Input/hmdb_protons.csv"), index_col=0)
 # print(np.max(data_dict["Citric Acid"]))
 
-data_dict, x_scale, y_scale = read_2d_data(file_path_2d)
 # print(data_dict.keys())
 # print(np.max(data_dict["Citric Acid"]))
 
-with open(base_path.joinpath("Input/hmdb_id_names.json")) as json_file_1:
-    hmdb_dict = json.load(json_file_1)
+# one HMDB ID <-> names index per process, shared by the 1D, JRes and COSY pages (see simulate_1D.hmdb_names)
+hmdb_dict = load_hmdb_name_index(base_path.joinpath("Input/hmdb_id_names.json"))
 
 # match_data_dict = db_match_cons(data_dict, cons_df_1, hmdb_dict)
-match_data_dict = db_names_match_hmdb_names(data_dict, hmdb_dict)
+# read 2d data and keep the names matching HMDB, the memory-mapped library is used if it is up to date,
+# otherwise each metabolite is read on first use while the library is rebuilt in the background (num_workers readers)
+match_data_dict, x_scale, y_scale = read_2d_data_with_cache(file_path_2d, read_2d_data, hmdb_dict,
+                                                            num_workers=num_workers_2d, lazy=True,
+                                                            max_bytes=lazy_cache_bytes_2d)
 # print(np.max(match_data_dict["citric acid"]))
 
-with open(base_path.joinpath("Input/hmdb_normal_concentrations.json")) as json_file_2:
-    hmdb_norm_cons_dict = json.load(json_file_2)
-with open(base_path.joinpath("Input/hmdb_abnormal_concentrations.json")) as json_file_3:
-    hmdb_abnorm_cons_dict = json.load(json_file_3)
+# mean / std / unit of every HMDB ID, biospecimen and condition, parsed once (see construct_hmdb_avg_cons.py)
+hmdb_cons_table = load_hmdb_cons_table_with_cache(base_path.joinpath("Input/hmdb_normal_concentrations.json"),
+                                                  base_path.joinpath("Input/hmdb_abnormal_concentrations.json"))
 with open(base_path.joinpath("Input/hmdb_id_pka.json")) as json_file_4:
     hmdb_id_pka_dict = json.load(json_file_4)
 
@@ -1284,6 +1301,8 @@ page_2_group_1_results_div = dbc.Card(
             [
                 html.H6("Results of Normal Group (Group 1)", style={"font-weight": "bold", "color": "steelblue"}),
                 # html.Br(),
+                # the simulation of both groups runs as a background job, its progress is polled
+                job_components("page-2-groups"),
                 dcc.Loading(children=[
                     dcc.Dropdown(id='page-2-select-repli-1', multi=False,),
                     dcc.Graph(id="page-2-group-1-spectra-fig"),
@@ -3684,11 +3703,7 @@ def page_2_update_hmdb_selections(n_clicks, mixture_list):
 def page_2_get_name_hmdb_id_dict(in_db_mixture_list):
     db_name_hmdb_id_dict = dict()
     for name in in_db_mixture_list:
-        idx_list = []
-        for idx, name_list in hmdb_dict.items():
-            if name in name_list:
-                idx_list.append({idx: hmdb_dict[idx][0]})
-        db_name_hmdb_id_dict[name] = idx_list
+        db_name_hmdb_id_dict[name] = [{idx: hmdb_dict[idx][0]} for idx in hmdb_dict.get_ids(name)]
     return db_name_hmdb_id_dict
 
 
@@ -3949,8 +3964,8 @@ def page_2_update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
         if select_hmdb_data_1 == "hmdb" and select_hmdb_data_2 == "hmdb":
             table_data = []
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_1, avg_std_1, unit_1 = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type_1)
-                avg_mean_2, avg_std_2, unit_2 = get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, bio_type_2)
+                avg_mean_1, avg_std_1, unit_1 = hmdb_cons_table.get_normal_avg_cons(hmdb_id, bio_type_1)
+                avg_mean_2, avg_std_2, unit_2 = hmdb_cons_table.get_abnormal_avg_cons(hmdb_id, bio_type_2)
                 temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id, "mean_1": avg_mean_1, "std_1": avg_std_1,
                              "mean_2": avg_mean_2, "std_2": avg_std_2}
                 table_data.append(temp_dict)
@@ -3962,7 +3977,7 @@ def page_2_update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
             temp_cons_df.columns = ["meta_name", "mean_2", "std_2"]
             temp_cons_dict = temp_cons_df.to_dict('records')
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_1, avg_std_1, unit_1 = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type_1)
+                avg_mean_1, avg_std_1, unit_1 = hmdb_cons_table.get_normal_avg_cons(hmdb_id, bio_type_1)
                 temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, temp_cons_dict))[0]
                 temp_dict["hmdb_id"] = hmdb_id
                 temp_dict["mean_1"] = avg_mean_1
@@ -3976,7 +3991,7 @@ def page_2_update_cons_mean_std_table(n_clicks, final_name_hmdb_id_dict,
             temp_cons_df.columns = ["meta_name", "mean_1", "std_1"]
             temp_cons_dict = temp_cons_df.to_dict('records')
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean_2, avg_std_2, unit_2 = get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, bio_type_2)
+                avg_mean_2, avg_std_2, unit_2 = hmdb_cons_table.get_abnormal_avg_cons(hmdb_id, bio_type_2)
                 temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, temp_cons_dict))[0]
                 temp_dict["hmdb_id"] = hmdb_id
                 temp_dict["mean_2"] = avg_mean_2
@@ -4069,8 +4084,8 @@ def page_2_update_simulated_cons_table(n_clicks, table_rows, final_name_hmdb_id_
     else:
         corr_df_1 = page_2_parse_corr_df(corr_filename_1, corr_contents_1)
         corr_df_2 = page_2_parse_corr_df(corr_filename_2, corr_contents_2)
-        simulated_cons_df_1 = simulate_concentrations(table_rows, num_repli_1, corr_flag_1, corr_df_1, "1")
-        simulated_cons_df_2 = simulate_concentrations(table_rows, num_repli_2, corr_flag_2, corr_df_2, "2")
+        simulated_cons_df_1 = simulate_concentrations(table_rows, num_repli_1, corr_flag_1, corr_df_1, "1", seed=simulation_seed)
+        simulated_cons_df_2 = simulate_concentrations(table_rows, num_repli_2, corr_flag_2, corr_df_2, "2", seed=simulation_seed)
         table_columns = [{"name": ["", "Name"], "id": "meta_name"}, {"name": ["", "HMDB ID"], "id": "hmdb_id"}] + \
                         [{"name": ["Group 1 (Normal)", "Replicate_{}".format(i+1)], "id": "1_replicate_{}".format(i+1),
                           "hideable": True} for i in range(num_repli_1)] + \
@@ -4253,6 +4268,7 @@ def page_2_update_all_fig_dropdown(n_clicks, final_name_hmdb_id_dict):
         State("page-2-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_update_group_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -4264,9 +4280,9 @@ def page_2_update_group_process_data(n_clicks, cal_range, water_range, filter_th
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
 
-        return norm_data_dict
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -4277,6 +4293,7 @@ def page_2_update_group_process_data(n_clicks, cal_range, water_range, filter_th
         Input("page-2-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4286,12 +4303,7 @@ def page_2_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
 
 
 @app.callback(
-    [
-        # Output("page-2-group-1-spectra-fig", "figure"),
-        Output("page-2-group-1-final-dict", "data"),
-        # Output("page-2-group-2-spectra-fig", "figure"),
-        Output("page-2-group-2-final-dict", "data"),
-    ],
+    Output("page-2-groups-job-id", "data"),
     [
         Input("page-2-confirm-param-btn", "n_clicks"),
         Input("page-2-processed-spectra-data-dict", "data"),
@@ -4301,21 +4313,52 @@ def page_2_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
         State("page-2-group-1-num-repli", "value"),
         State("page-2-group-2-num-repli", "value"),
         State("page-2-simulated-cons-table", "data"),
+        State("page-2-groups-job-id", "data"),
     ]
 )
-def page_2_update_groups_mix_fig(n_clicks, norm_data_dict, snr, num_repli_1, num_repli_2, table_rows):
+@use_result_store()
+def page_2_update_groups_mix_fig(n_clicks, norm_data_dict, snr, num_repli_1, num_repli_2, table_rows, job_id):
     if n_clicks == 0 or norm_data_dict is None:
-        return None, None
+        return None
     else:
+        # a new simulation replaces the one still running
+        job_queue.cancel(job_id, get_session_id())
         # mixture_list = list(map(lambda d: d["meta_name"], table_rows))
         mixture_dict = {item['meta_name']: item['hmdb_id'] for item in table_rows}
-        final_data_dict_1 = simulate_mixture_for_all_repli(num_repli_1, mixture_dict, norm_data_dict,
-                                                           table_rows, protons_df, snr, "1")
-        final_data_dict_2 = simulate_mixture_for_all_repli(num_repli_2, mixture_dict, norm_data_dict,
-                                                           table_rows, protons_df, snr, "2")
-        # print(final_data_dict_1)
-        # print(final_data_dict_2)
-        return final_data_dict_1, final_data_dict_2
+        step_list = [
+            ("simulating group 1", simulate_mixture_for_all_repli,
+             (num_repli_1, mixture_dict, norm_data_dict, table_rows, protons_df, snr, "1"), {"progress": report_step_progress}),
+            ("simulating group 2", simulate_mixture_for_all_repli,
+             (num_repli_2, mixture_dict, norm_data_dict, table_rows, protons_df, snr, "2"), {"progress": report_step_progress}),
+        ]
+        return job_queue.submit("page 2 groups mixture", step_list, get_session_id())
+
+
+@app.callback(
+    [
+        Output("page-2-group-1-final-dict", "data"),
+        Output("page-2-group-2-final-dict", "data"),
+        Output("page-2-groups-job-status", "children"),
+        Output("page-2-groups-job-interval", "disabled"),
+    ],
+    [
+        # a new job id starts the polling, the polling callback alone enables and disables the interval
+        Input("page-2-groups-job-interval", "n_intervals"),
+        Input("page-2-groups-job-id", "data"),
+    ],
+)
+@use_result_store(output_indices=(0, 1))
+def page_2_update_groups_mix_fig_from_job(n_intervals, job_id):
+    status = job_queue.get_status(job_id, get_session_id()) if job_id is not None else None
+    if status is None or status["status"] != DONE:
+        finished = status is None or status["status"] in FINISHED_STATES
+        return dash.no_update, dash.no_update, format_job_status(status), finished
+    else:
+        final_data_dict_1, final_data_dict_2 = job_queue.get_result(job_id, get_session_id())
+        return to_sparse_replicate_dict(final_data_dict_1), to_sparse_replicate_dict(final_data_dict_2), "", True
+
+
+register_cancel_callback(app, "page-2-groups")
 
 
 @app.callback(
@@ -4331,6 +4374,7 @@ def page_2_update_groups_mix_fig(n_clicks, norm_data_dict, snr, num_repli_1, num
         Input("page-2-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_update_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         # print("not arrive here!!!!!!!")
@@ -4361,11 +4405,12 @@ def page_2_update_group_replicate_selection(n_clicks, final_data_dict_1, final_d
         Input("page-2-select-repli-1", "value")
     ]
 )
+@use_result_store()
 def page_2_update_group_contour_level_1(n_clicks, final_data_dict_1, select_repli):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli is None:
         return None, None, []
     else:
-        temp_data = np.array(final_data_dict_1[select_repli])
+        temp_data = to_dense(final_data_dict_1[select_repli])
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -4384,6 +4429,7 @@ def page_2_update_group_contour_level_1(n_clicks, final_data_dict_1, select_repl
         Input("page-2-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_2_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1, temp_levels):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -4404,11 +4450,12 @@ def page_2_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1, te
         Input("page-2-select-repli-2", "value")
     ]
 )
+@use_result_store()
 def page_2_update_group_contour_level_2(n_clicks, final_data_dict_2, select_repli):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli is None:
         return None, None, []
     else:
-        temp_data = np.array(final_data_dict_2[select_repli])
+        temp_data = to_dense(final_data_dict_2[select_repli])
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -4427,6 +4474,7 @@ def page_2_update_group_contour_level_2(n_clicks, final_data_dict_2, select_repl
         Input("page-2-contour-level-2", "value")
     ]
 )
+@use_result_store()
 def page_2_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2, temp_levels):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -4441,6 +4489,7 @@ def page_2_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2, te
     State("page-2-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
 
     final_df = page_2_construct_2d_df_without_peak_shift(final_replicate_dict)
@@ -4455,7 +4504,7 @@ def page_2_construct_2d_df_without_peak_shift(final_replicate_dict):
 
     df_list = []
     for key, value in final_replicate_dict.items():
-        df_list.append(pd.DataFrame(np.array(value)))
+        df_list.append(pd.DataFrame(to_dense(value)))
 
     final_df = pd.concat(df_list, axis=0)
     final_df.columns = x_scale
@@ -4469,6 +4518,7 @@ def page_2_construct_2d_df_without_peak_shift(final_replicate_dict):
     State("page-2-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "group_2_simulated_jres_spectra_without_peak_shift.csv")
@@ -4537,8 +4587,8 @@ def page_2_update_group_cons_ph_table(n_clicks, cons_table_data, cons_table_colu
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list_1 = page_2_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1)
-        ph_list_2 = page_2_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2)
+        ph_list_1 = page_2_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(simulation_seed, "ph", "1"))
+        ph_list_2 = page_2_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(simulation_seed, "ph", "2"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list_1, ph_list_2))
         name_list = ["meta_name", "hmdb_id"] + ["1_replicate_" + str(i + 1) for i in range(num_repli_1)] + \
                     ["2_replicate_" + str(i + 1) for i in range(num_repli_2)]
@@ -4548,22 +4598,19 @@ def page_2_update_group_cons_ph_table(n_clicks, cons_table_data, cons_table_colu
         return {"display": "block"}, table_data, cons_table_columns, style_data_conditional, {"display": "block"}, {"display": "block"}
 
 
-def page_2_sample_ph_list(num_replicate, ph_same_flag, same_ph, ph_mean, ph_std):
+def page_2_sample_ph_list(num_replicate, ph_same_flag, same_ph, ph_mean, ph_std, rng=None):
     if ph_same_flag == "true":
         ph_list = np.round([same_ph] * num_replicate, 2)
     elif ph_same_flag == "false":
-        ph_list = np.round(page_2_get_positive_ph(ph_mean, ph_std, num_replicate), 2)
+        ph_list = np.round(page_2_get_positive_ph(ph_mean, ph_std, num_replicate, rng), 2)
     else:
         ph_list = [7.4] * num_replicate
     return ph_list
 
 
-def page_2_get_positive_ph(mean, std, num_replicates):
-    x = np.random.normal(mean,std, num_replicates)
-    if np.all(x > 0):
-        return x
-    else:
-        return page_2_get_positive_ph(mean, std, num_replicates)
+def page_2_get_positive_ph(mean, std, num_replicates, rng=None):
+    # truncated normal, no more redrawing the whole list until every pH is positive
+    return pos_normal_no_correlated(mean, std, num_replicates, rng)
 
 
 @app.callback(
@@ -4578,6 +4625,7 @@ def page_2_get_positive_ph(mean, std, num_replicates):
         State("page-2-group-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_group_peak_shift_update_group_process_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -4591,8 +4639,8 @@ def page_2_group_peak_shift_update_group_process_data(n_clicks, cal_range, water
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -4620,6 +4668,7 @@ def page_2_group_peak_shift_update_all_fig_dropdown(n_clicks, final_name_hmdb_id
         Input("page-2-group-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -4641,27 +4690,42 @@ def page_2_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dic
         State("page-2-db-names-hmdb-ids-dict", "data"),
         State("page-2-group-peak-shift-snr-noise", "value"),
         State("page-2-group-cons-ph-table", "data"),
+        State("page-2-group-peak-shift-calibration-range", "value"),
+        State("page-2-group-peak-shift-water-range", "value"),
+        State("page-2-group-peak-shift-filter-thres", "value"),
+        State("page-2-group-peak-shift-smooth-thres-m", "value"),
+        State("page-2-group-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_2_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(output_indices=(0, 1))
+def page_2_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                     cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
         mixture_list = list(map(lambda d: d["meta_name"], cons_ph_table_data))
         mixture_list.remove('pH')
 
-        p_jres_dict = get_p_jres_dict(mixture_list, norm_data_dict)
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, p_jres_dict)
-        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_2_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file, projection=get_p_jres)
+        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         final_data_dict_1 = simulate_mixture_with_peak_shift_for_all_repli(mixture_list, x_scale, norm_data_dict,
                                                 meta_subset_dict, mixture_pka_dict, cons_ph_table_data, "1", protons_df, snr)
         final_data_dict_2 = simulate_mixture_with_peak_shift_for_all_repli(mixture_list, x_scale, norm_data_dict,
                                                 meta_subset_dict, mixture_pka_dict, cons_ph_table_data, "2", protons_df, snr)
         # repli_ph, repli_data = final_data_dict["replicate_1"]
-        return final_data_dict_1, final_data_dict_2
+        return to_sparse_replicate_dict(final_data_dict_1), to_sparse_replicate_dict(final_data_dict_2)
 
 
-def page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
+def page_2_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
+    # the peak clusters of the library spectra preprocessed with these parameters, stored next to the library
+    return get_peak_cluster_cache_file(match_data_dict, [cal_range, water_range, filter_thres, smooth_thres_m,
+                                                         smooth_thres_n])
+
+
+def page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=None):
+    seed = get_seed_sequence(seed)
     mixture_pka_dict = dict()
     for meta_name in mixture_list:
         temp_pka_dict = hmdb_id_pka_dict[final_names_hmdb_id_dict[meta_name]]
@@ -4680,7 +4744,7 @@ def page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
         elif temp_pka_1 is not None and temp_pka_2 is None:
             temp_pka = temp_pka_1 
         else:
-            temp_pka = np.random.normal(6.013, 2.972, 1)[0]
+            temp_pka = get_child_rng(seed, "pka", meta_name).normal(6.013, 2.972, 1)[0]
         mixture_pka_dict[meta_name] = temp_pka
     return mixture_pka_dict
 
@@ -4698,6 +4762,7 @@ def page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict):
         Input("page-2-group-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         # print("not arrive here!!!!!!!")
@@ -4724,12 +4789,13 @@ def page_2_group_peak_shift_update_group_replicate_selection(n_clicks, final_dat
         Input("page-2-group-peak-shift-select-repli-1", "value")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_contour_level_1(n_clicks, final_data_dict_1, select_repli):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli is None:
         return None, None, []
     else:
         repli_ph, repli_data = final_data_dict_1[select_repli]
-        temp_data = np.array(repli_data)
+        temp_data = to_dense(repli_data)
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -4748,12 +4814,13 @@ def page_2_group_peak_shift_update_group_contour_level_1(n_clicks, final_data_di
         Input("page-2-group-peak-shift-select-repli-2", "value")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_contour_level_2(n_clicks, final_data_dict_2, select_repli):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli is None:
         return None, None, []
     else:
         repli_ph, repli_data = final_data_dict_2[select_repli]
-        temp_data = np.array(repli_data)
+        temp_data = to_dense(repli_data)
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -4772,6 +4839,7 @@ def page_2_group_peak_shift_update_group_contour_level_2(n_clicks, final_data_di
         Input("page-2-group-peak-shift-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1, temp_levels):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -4792,6 +4860,7 @@ def page_2_group_peak_shift_update_group_1_figure(n_clicks, final_data_dict_1, s
         Input("page-2-group-peak-shift-contour-level-2", "value")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2, temp_levels):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -4811,6 +4880,7 @@ def page_2_group_peak_shift_update_group_2_figure(n_clicks, final_data_dict_2, s
         Input("page-2-group-peak-shift-group-1-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_stacked_fig_1(n_clicks, log_v_space, final_data_dict_1):
     if n_clicks == 0 or final_data_dict_1 is None or log_v_space is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -4833,6 +4903,7 @@ def page_2_group_peak_shift_update_stacked_fig_1(n_clicks, log_v_space, final_da
         Input("page-2-group-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_stacked_fig_2(n_clicks, log_v_space, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_2 is None or log_v_space is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -4850,6 +4921,7 @@ def page_2_group_peak_shift_update_stacked_fig_2(n_clicks, log_v_space, final_da
     State("page-2-group-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_group_peak_shift_download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "group_1_simulated_jres_spectra_with_peak_shift.csv")
@@ -4863,7 +4935,7 @@ def page_2_construct_2d_df_with_peak_shift(final_replicate_dict):
 
     df_list = []
     for key, value in final_replicate_dict.items():
-        df_list.append(pd.DataFrame(np.array(value[1])))
+        df_list.append(pd.DataFrame(to_dense(value[1])))
 
     final_df = pd.concat(df_list, axis=0)
     final_df.columns = x_scale
@@ -4877,6 +4949,7 @@ def page_2_construct_2d_df_with_peak_shift(final_replicate_dict):
     State("page-2-group-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_group_peak_shift_download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "group_2_simulated_jres_spectra_with_peak_shift.csv")
@@ -4942,7 +5015,7 @@ def page_2_update_continuous_cons_mean_std_table(n_clicks, final_name_hmdb_id_di
         if select_hmdb_data == "hmdb":
             table_data = []
             for meta_name, hmdb_id in final_name_hmdb_id_dict.items():
-                avg_mean, avg_std, unit = get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, conti_bio_type)
+                avg_mean, avg_std, unit = hmdb_cons_table.get_normal_avg_cons(hmdb_id, conti_bio_type)
                 temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id, "mean": avg_mean, "std": avg_std, "a": 0, "std_error": 0}
                 table_data.append(temp_dict)
             return {"display": "block"}, table_data, table_columns, {"display": "block"}
@@ -5005,16 +5078,17 @@ def page_2_update_conti_simulated_cons_table(n_clicks, table_rows, y_num_repli,
         table_columns = [{"name": "Name", "id": "meta_name"}, {"name": "HMDB ID", "id": "hmdb_id"}] + \
                         [{"name": "Replicate_{}".format(i+1), "id": "replicate_{}".format(i+1)}
                          for i in range(y_num_repli)]
+        y_rng = get_child_rng(simulation_seed, "y")
         if dist_type == "normal":
-            sample_y = np.round(np.random.normal(y_mean, y_std, y_num_repli), 2)
+            sample_y = np.round(y_rng.normal(y_mean, y_std, y_num_repli), 2)
         elif dist_type == "uniform":
-            sample_y = np.round(np.random.uniform(y_min, y_max, y_num_repli), 2)
+            sample_y = np.round(y_rng.uniform(y_min, y_max, y_num_repli), 2)
         else:
             sample_y = []
         y_temp_dict = dict({"meta_name": "Y", "hmdb_id": "/"},
                            **dict(zip(["replicate_{}".format(i + 1) for i in range(y_num_repli)], sample_y)))
         x_cons_dict_list, meta_with_y_list, meta_not_y_list = \
-            simulate_continuous_concentrations(table_rows, y_num_repli, sample_y)
+            simulate_continuous_concentrations(table_rows, y_num_repli, sample_y, seed=simulation_seed)
         table_data = [y_temp_dict] + x_cons_dict_list
         style_data_conditional = [{
             "if": {"row_index": 0},
@@ -5122,6 +5196,7 @@ def page_2_plot_conti_box_plot(table_data):
         State("page-2-conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_update_continuous_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -5134,8 +5209,8 @@ def page_2_update_continuous_process_data(n_clicks, cal_range, water_range, filt
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5163,6 +5238,7 @@ def page_2_update_continuous_all_fig_dropdown(n_clicks, final_name_hmdb_id_dict)
         Input("page-2-conti-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_update_continuous_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5187,6 +5263,7 @@ def page_2_update_continuous_results_all_fig(n_clicks, norm_data_dict, select_me
         State("page-2-conti-simulated-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def page_2_update_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr, y_num_repli, table_rows):
     if n_clicks == 0 or norm_data_dict is None:
         return None, [], None
@@ -5199,7 +5276,7 @@ def page_2_update_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr,
                                                                     table_rows, protons_df, snr)
         options = [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         value = list(final_data_dict.keys())[0]
-        return final_data_dict, options, value
+        return to_sparse_replicate_dict(final_data_dict), options, value
 
 
 @app.callback(
@@ -5214,11 +5291,12 @@ def page_2_update_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr,
         Input("page-2-conti-select-replicate", "value")
     ]
 )
+@use_result_store()
 def page_2_update_continuous_contour_level(n_clicks, final_data_dict, select_repli):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return None, None, []
     else:
-        temp_data = np.array(final_data_dict[select_repli])
+        temp_data = to_dense(final_data_dict[select_repli])
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -5239,6 +5317,7 @@ def page_2_update_continuous_contour_level(n_clicks, final_data_dict, select_rep
         State("page-2-conti-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_2_update_continuous_mix_fig(select_replicate, temp_levels, n_clicks, final_data_dict):
     if n_clicks == 0 or select_replicate is None or final_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -5314,6 +5393,7 @@ def page_2_plot_conti_results_line_plot(table_data, select_replicate):
     State("page-2-conti-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "continuous_simulated_jres_spectra_without_peak_shift.csv")
@@ -5361,7 +5441,7 @@ def page_2_update_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list = page_2_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std)
+        ph_list = page_2_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std, get_child_rng(simulation_seed, "ph"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list))
         name_list = ["meta_name", "hmdb_id"] + ["replicate_" + str(i + 1) for i in range(y_num_repli)]
         temp_dict = dict(zip(name_list, all_ph_list))
@@ -5383,6 +5463,7 @@ def page_2_update_continuous_cons_ph_table(n_clicks, cons_table_data, cons_table
         State("page-2-conti-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_continuous_peak_shift_update_processed_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -5396,8 +5477,8 @@ def page_2_continuous_peak_shift_update_processed_data(n_clicks, cal_range, wate
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5425,6 +5506,7 @@ def page_2_continuous_peak_shift_update_all_fig_dropdown(n_clicks, final_name_hm
         Input("page-2-conti-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_continuous_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5443,23 +5525,31 @@ def page_2_continuous_peak_shift_update_group_results_all_fig(n_clicks, norm_dat
         State("page-2-db-names-hmdb-ids-dict", "data"),
         State("page-2-conti-peak-shift-snr-noise", "value"),
         State("page-2-conti-cons-ph-table", "data"),
+        State("page-2-conti-peak-shift-calibration-range", "value"),
+        State("page-2-conti-peak-shift-water-range", "value"),
+        State("page-2-conti-peak-shift-filter-thres", "value"),
+        State("page-2-conti-peak-shift-smooth-thres-m", "value"),
+        State("page-2-conti-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_2_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(single_output=True)
+def page_2_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                         cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
         mixture_list = list(map(lambda d: d["meta_name"], cons_ph_table_data))
         mixture_list.remove("Y")
         mixture_list.remove('pH')
-        p_jres_dict = get_p_jres_dict(mixture_list, norm_data_dict)
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, p_jres_dict)
-        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_2_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file, projection=get_p_jres)
+        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         final_data_dict = simulate_mixture_continuous_with_peak_shift_for_all_repli(mixture_list, x_scale,
                                                 norm_data_dict, meta_subset_dict, mixture_pka_dict, cons_ph_table_data,
                                                 protons_df, snr)
         # repli_ph, repli_data = final_data_dict["replicate_1"]
-        return final_data_dict
+        return to_sparse_replicate_dict(final_data_dict)
 
 
 @app.callback(
@@ -5472,6 +5562,7 @@ def page_2_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dic
         Input("page-2-conti-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_2_group_peak_shift_update_group_replicate_selection(n_clicks, final_data_dict):
     if n_clicks == 0 or final_data_dict is None:
         return [], None
@@ -5493,12 +5584,13 @@ def page_2_group_peak_shift_update_group_replicate_selection(n_clicks, final_dat
         Input("page-2-conti-peak-shift-select-replicate", "value")
     ]
 )
+@use_result_store()
 def page_2_continuous_peak_shift_update_contour_level_1(n_clicks, final_data_dict, select_repli):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return None, None, []
     else:
         repli_ph, repli_data = final_data_dict[select_repli]
-        temp_data = np.array(repli_data)
+        temp_data = to_dense(repli_data)
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -5517,6 +5609,7 @@ def page_2_continuous_peak_shift_update_contour_level_1(n_clicks, final_data_dic
         Input("page-2-conti-peak-shift-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_2_continuous_peak_shift_update_mix_figure(n_clicks, final_data_dict, select_repli, temp_levels):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -5552,6 +5645,7 @@ def page_2_update_continuous_peak_shift_meta_y_line_plot(select_replicate, n_cli
         Input("page-2-conti-peak-shift-final-replicate-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_continuous_peak_shift_update_stacked_fig(n_clicks, log_v_space, final_data_dict):
     if n_clicks == 0 or final_data_dict is None or log_v_space is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -5570,6 +5664,7 @@ def page_2_continuous_peak_shift_update_stacked_fig(n_clicks, log_v_space, final
     State("page-2-conti-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_conti_peak_shift_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "continuous_simulated_jres_spectra_with_peak_shift.csv")
@@ -5606,6 +5701,7 @@ def page_2_update_upload_all_fig_dropdown(n_clicks, final_name_hmdb_id_dict):
         State("page-2-upload-discrete-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_update_upload_group_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -5617,8 +5713,8 @@ def page_2_update_upload_group_process_data(n_clicks, cal_range, water_range, fi
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5629,6 +5725,7 @@ def page_2_update_upload_group_process_data(n_clicks, cal_range, water_range, fi
         Input("page-2-upload-group-no-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_update_upload_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5653,6 +5750,7 @@ def page_2_update_upload_group_results_all_fig(n_clicks, norm_data_dict, select_
         State("page-2-upload-discrete-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0, 1))
 def page_2_update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, table_rows):
     num_repli_1 = sum(1 for i in table_rows[0].keys() if i[0] == "1")
     num_repli_2 = sum(1 for i in table_rows[0].keys() if i[0] == "2")
@@ -5665,7 +5763,7 @@ def page_2_update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, table_row
                                                            table_rows, protons_df, snr, "1")
         final_data_dict_2 = simulate_mixture_for_all_repli(num_repli_2, mixture_dict, norm_data_dict,
                                                            table_rows, protons_df, snr, "2")
-        return final_data_dict_1, final_data_dict_2
+        return to_sparse_replicate_dict(final_data_dict_1), to_sparse_replicate_dict(final_data_dict_2)
 
 
 @app.callback(
@@ -5681,6 +5779,7 @@ def page_2_update_upload_groups_mix_fig(n_clicks, norm_data_dict, snr, table_row
         Input("page-2-upload-group-no-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_update_upload_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         # print("not arrive here!!!!!!!")
@@ -5711,11 +5810,12 @@ def page_2_update_upload_group_replicate_selection(n_clicks, final_data_dict_1,
         Input("page-2-upload-group-no-peak-shift-select-repli-1", "value")
     ]
 )
+@use_result_store()
 def page_2_update_upload_group_contour_level_1(n_clicks, final_data_dict_1, select_repli):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli is None:
         return None, None, []
     else:
-        temp_data = np.array(final_data_dict_1[select_repli])
+        temp_data = to_dense(final_data_dict_1[select_repli])
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -5734,6 +5834,7 @@ def page_2_update_upload_group_contour_level_1(n_clicks, final_data_dict_1, sele
         Input("page-2-upload-group-no-peak-shift-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_2_update_upload_group_1_figure(n_clicks, final_data_dict_1, select_repli_1, temp_levels):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -5754,11 +5855,12 @@ def page_2_update_upload_group_1_figure(n_clicks, final_data_dict_1, select_repl
         Input("page-2-upload-group-no-peak-shift-select-repli-2", "value")
     ]
 )
+@use_result_store()
 def page_2_update_upload_group_contour_level_2(n_clicks, final_data_dict_2, select_repli):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli is None:
         return None, None, []
     else:
-        temp_data = np.array(final_data_dict_2[select_repli])
+        temp_data = to_dense(final_data_dict_2[select_repli])
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -5777,6 +5879,7 @@ def page_2_update_upload_group_contour_level_2(n_clicks, final_data_dict_2, sele
         Input("page-2-upload-group-no-peak-shift-contour-level-2", "value")
     ]
 )
+@use_result_store()
 def page_2_update_upload_group_2_figure(n_clicks, final_data_dict_2, select_repli_2, temp_levels):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -5791,6 +5894,7 @@ def page_2_update_upload_group_2_figure(n_clicks, final_data_dict_2, select_repl
     State("page-2-upload-group-no-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_upload_group_1_simulated_spectra(n_clicks, final_replicate_dict):
 
     final_df = page_2_construct_2d_df_without_peak_shift(final_replicate_dict)
@@ -5803,6 +5907,7 @@ def page_2_download_upload_group_1_simulated_spectra(n_clicks, final_replicate_d
     State("page-2-upload-group-no-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_upload_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_2_simulated_jres_spectra_without_peak_shift.csv")
@@ -5873,8 +5978,8 @@ def page_2_update_upload_group_cons_ph_table(n_clicks, cons_table_data, cons_tab
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list_1 = page_2_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1)
-        ph_list_2 = page_2_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2)
+        ph_list_1 = page_2_sample_ph_list(num_repli_1, ph_same_flag_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(simulation_seed, "ph", "1"))
+        ph_list_2 = page_2_sample_ph_list(num_repli_2, ph_same_flag_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(simulation_seed, "ph", "2"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list_1, ph_list_2))
         name_list = ["meta_name", "hmdb_id"] + ["1_replicate_" + str(i + 1) for i in range(num_repli_1)] + \
                     ["2_replicate_" + str(i + 1) for i in range(num_repli_2)]
@@ -5896,6 +6001,7 @@ def page_2_update_upload_group_cons_ph_table(n_clicks, cons_table_data, cons_tab
         State("page-2-upload-group-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_upload_group_peak_shift_update_group_process_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -5909,8 +6015,8 @@ def page_2_upload_group_peak_shift_update_group_process_data(n_clicks, cal_range
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -5938,6 +6044,7 @@ def page_2_upload_group_peak_shift_update_all_fig_dropdown(n_clicks, final_name_
         Input("page-2-upload-group-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -5959,24 +6066,32 @@ def page_2_upload_group_peak_shift_update_group_results_all_fig(n_clicks, norm_d
         State("page-2-db-names-hmdb-ids-dict", "data"),
         State("page-2-upload-group-peak-shift-snr-noise", "value"),
         State("page-2-upload-group-cons-ph-table", "data"),
+        State("page-2-upload-group-peak-shift-calibration-range", "value"),
+        State("page-2-upload-group-peak-shift-water-range", "value"),
+        State("page-2-upload-group-peak-shift-filter-thres", "value"),
+        State("page-2-upload-group-peak-shift-smooth-thres-m", "value"),
+        State("page-2-upload-group-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_2_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(output_indices=(0, 1))
+def page_2_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                            cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
         mixture_list = list(map(lambda d: d["meta_name"], cons_ph_table_data))
         mixture_list.remove('pH')
 
-        p_jres_dict = get_p_jres_dict(mixture_list, norm_data_dict)
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, p_jres_dict)
-        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_2_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file, projection=get_p_jres)
+        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         final_data_dict_1 = simulate_mixture_with_peak_shift_for_all_repli(mixture_list, x_scale, norm_data_dict,
                                                 meta_subset_dict, mixture_pka_dict, cons_ph_table_data, "1", protons_df, snr)
         final_data_dict_2 = simulate_mixture_with_peak_shift_for_all_repli(mixture_list, x_scale, norm_data_dict,
                                                 meta_subset_dict, mixture_pka_dict, cons_ph_table_data, "2", protons_df, snr)
         # repli_ph, repli_data = final_data_dict["replicate_1"]
-        return final_data_dict_1, final_data_dict_2
+        return to_sparse_replicate_dict(final_data_dict_1), to_sparse_replicate_dict(final_data_dict_2)
 
 
 @app.callback(
@@ -5992,6 +6107,7 @@ def page_2_upload_group_peak_shift_update_groups_repli_data(n_clicks, norm_data_
         Input("page-2-upload-group-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_replicate_selection(n_clicks, final_data_dict_1, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_1 is None or final_data_dict_2 is None:
         return [], None, [], None
@@ -6015,12 +6131,13 @@ def page_2_upload_group_peak_shift_update_group_replicate_selection(n_clicks, fi
         Input("page-2-upload-group-peak-shift-select-repli-1", "value")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_contour_level_1(n_clicks, final_data_dict_1, select_repli):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli is None:
         return None, None, []
     else:
         repli_ph, repli_data = final_data_dict_1[select_repli]
-        temp_data = np.array(repli_data)
+        temp_data = to_dense(repli_data)
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -6039,12 +6156,13 @@ def page_2_upload_group_peak_shift_update_group_contour_level_1(n_clicks, final_
         Input("page-2-upload-group-peak-shift-select-repli-2", "value")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_contour_level_2(n_clicks, final_data_dict_2, select_repli):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli is None:
         return None, None, []
     else:
         repli_ph, repli_data = final_data_dict_2[select_repli]
-        temp_data = np.array(repli_data)
+        temp_data = to_dense(repli_data)
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -6063,6 +6181,7 @@ def page_2_upload_group_peak_shift_update_group_contour_level_2(n_clicks, final_
         Input("page-2-upload-group-peak-shift-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_1_figure(n_clicks, final_data_dict_1, select_repli_1, temp_levels):
     if n_clicks == 0 or final_data_dict_1 is None or select_repli_1 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6083,6 +6202,7 @@ def page_2_upload_group_peak_shift_update_group_1_figure(n_clicks, final_data_di
         Input("page-2-upload-group-peak-shift-contour-level-2", "value")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_2_figure(n_clicks, final_data_dict_2, select_repli_2, temp_levels):
     if n_clicks == 0 or final_data_dict_2 is None or select_repli_2 is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6102,6 +6222,7 @@ def page_2_upload_group_peak_shift_update_group_2_figure(n_clicks, final_data_di
         Input("page-2-upload-group-peak-shift-group-1-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_stacked_fig_1(n_clicks, log_v_space, final_data_dict_1):
     if n_clicks == 0 or final_data_dict_1 is None or log_v_space is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6124,6 +6245,7 @@ def page_2_upload_group_peak_shift_update_stacked_fig_1(n_clicks, log_v_space, f
         Input("page-2-upload-group-peak-shift-group-2-final-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_stacked_fig_2(n_clicks, log_v_space, final_data_dict_2):
     if n_clicks == 0 or final_data_dict_2 is None or log_v_space is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6141,6 +6263,7 @@ def page_2_upload_group_peak_shift_update_stacked_fig_2(n_clicks, log_v_space, f
     State("page-2-upload-group-peak-shift-group-1-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_download_group_1_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_1_simulated_jres_spectra_with_peak_shift.csv")
@@ -6152,6 +6275,7 @@ def page_2_upload_group_peak_shift_download_group_1_simulated_spectra(n_clicks,
     State("page-2-upload-group-peak-shift-group-2-final-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_download_group_2_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_group_2_simulated_jres_spectra_with_peak_shift.csv")
@@ -6170,6 +6294,7 @@ def page_2_upload_group_peak_shift_download_group_2_simulated_spectra(n_clicks,
         State("page-2-upload-conti-cons-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_update_upload_continuous_process_data(n_clicks, cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
         return None
@@ -6182,8 +6307,8 @@ def page_2_update_upload_continuous_process_data(n_clicks, cal_range, water_rang
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -6211,6 +6336,7 @@ def page_2_update_upload_continuous_all_fig_dropdown(n_clicks, final_name_hmdb_i
         Input("page-2-upload-conti-no-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_update_upload_continuous_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -6235,6 +6361,7 @@ def page_2_update_upload_continuous_results_all_fig(n_clicks, norm_data_dict, se
         State("page-2-upload-conti-cons-table", "data"),
     ]
 )
+@use_result_store(output_indices=(0,))
 def page_2_update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dict, snr, table_rows):
     y_num_repli = len(table_rows[0]) - 1
     if n_clicks == 0 or norm_data_dict is None:
@@ -6246,7 +6373,7 @@ def page_2_update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dic
                                                                     table_rows, protons_df, snr)
         options = [{"label": i, "value": i} for i in list(final_data_dict.keys())]
         value = list(final_data_dict.keys())[0]
-        return final_data_dict, options, value
+        return to_sparse_replicate_dict(final_data_dict), options, value
 
 
 @app.callback(
@@ -6261,11 +6388,12 @@ def page_2_update_upload_continuous_final_replicate_dict(n_clicks, norm_data_dic
         Input("page-2-upload-conti-no-peak-shift-select-replicate", "value")
     ]
 )
+@use_result_store()
 def page_2_update_upload_continuous_contour_level(n_clicks, final_data_dict, select_repli):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return None, None, []
     else:
-        temp_data = np.array(final_data_dict[select_repli])
+        temp_data = to_dense(final_data_dict[select_repli])
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -6286,6 +6414,7 @@ def page_2_update_upload_continuous_contour_level(n_clicks, final_data_dict, sel
         State("page-2-upload-conti-no-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_2_update_upload_continuous_mix_fig(select_replicate, temp_levels, n_clicks, final_data_dict):
     if n_clicks == 0 or select_replicate is None or final_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6316,6 +6445,7 @@ def page_2_update_upload_continuous_meta_y_line_plot(select_replicate, n_clicks,
     State("page-2-upload-conti-no-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_upload_continuous_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_without_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_continuous_simulated_jres_spectra_without_peak_shift.csv")
@@ -6364,7 +6494,7 @@ def page_2_update_upload_continuous_cons_ph_table(n_clicks, cons_table_data, con
     if n_clicks == 0:
         return {"display": "none"}, [{}], [], [{}], {"display": "none"}, {"display": "none"}
     else:
-        ph_list = page_2_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std)
+        ph_list = page_2_sample_ph_list(y_num_repli, ph_same_flag, same_ph, ph_mean, ph_std, get_child_rng(simulation_seed, "ph"))
         all_ph_list = np.concatenate((["pH", "/"], ph_list))
         name_list = ["meta_name", "hmdb_id"] + ["replicate_" + str(i + 1) for i in range(y_num_repli)]
         temp_dict = dict(zip(name_list, all_ph_list))
@@ -6386,6 +6516,7 @@ def page_2_update_upload_continuous_cons_ph_table(n_clicks, cons_table_data, con
         State("page-2-upload-conti-cons-ph-table", "data"),
     ]
 )
+@use_result_store(single_output=True)
 def page_2_upload_continuous_peak_shift_update_processed_data(n_clicks, cal_range, water_range, filter_thres,
                                                       smooth_thres_m, smooth_thres_n, table_rows):
     if n_clicks == 0:
@@ -6399,8 +6530,8 @@ def page_2_upload_continuous_peak_shift_update_processed_data(n_clicks, cal_rang
         removed_data_dict = remove_water_calibration(temp_raw_data_dict, x_scale, y_scale, water_range, cal_range)
         filtered_data_dict = filter_noise(removed_data_dict, filter_thres)
         smooth_data_dict = smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
-        norm_data_dict = normalize_data(smooth_data_dict)
-        return norm_data_dict
+        norm_data_dict = normalize_data(smooth_data_dict, sparse=True)
+        return to_sparse_dict(norm_data_dict)
 
 
 @app.callback(
@@ -6428,6 +6559,7 @@ def page_2_upload_continuous_peak_shift_update_all_fig_dropdown(n_clicks, final_
         Input("page-2-upload-conti-peak-shift-select-mix", "value"),
     ]
 )
+@use_result_store()
 def page_2_upload_continuous_peak_shift_update_group_results_all_fig(n_clicks, norm_data_dict, select_meta):
     if n_clicks == 0 or norm_data_dict is None:
         return {"data": [], "layout": {}, "frames": []}
@@ -6446,23 +6578,31 @@ def page_2_upload_continuous_peak_shift_update_group_results_all_fig(n_clicks, n
         State("page-2-db-names-hmdb-ids-dict", "data"),
         State("page-2-upload-conti-peak-shift-snr-noise", "value"),
         State("page-2-upload-conti-cons-ph-table", "data"),
+        State("page-2-upload-conti-peak-shift-calibration-range", "value"),
+        State("page-2-upload-conti-peak-shift-water-range", "value"),
+        State("page-2-upload-conti-peak-shift-filter-thres", "value"),
+        State("page-2-upload-conti-peak-shift-smooth-thres-m", "value"),
+        State("page-2-upload-conti-peak-shift-smooth-thres-n", "value"),
     ]
 )
-def page_2_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data):
+@use_result_store(single_output=True)
+def page_2_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_data_dict, final_names_hmdb_id_dict, snr, cons_ph_table_data,
+                                                                cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n):
     if n_clicks == 0 or norm_data_dict is None:
         return None, None
     else:
         mixture_list = list(map(lambda d: d["meta_name"], cons_ph_table_data))
         mixture_list.remove("Y")
         mixture_list.remove('pH')
-        p_jres_dict = get_p_jres_dict(mixture_list, norm_data_dict)
-        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, p_jres_dict)
-        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict)
+        cluster_file = page_2_get_peak_cluster_file(cal_range, water_range, filter_thres, smooth_thres_m, smooth_thres_n)
+        meta_subset_dict = get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=simulation_seed,
+                                                           cache_file=cluster_file, projection=get_p_jres)
+        mixture_pka_dict = page_2_get_mixture_pka_dict(mixture_list, final_names_hmdb_id_dict, seed=simulation_seed)
         final_data_dict = simulate_mixture_continuous_with_peak_shift_for_all_repli(mixture_list, x_scale,
                                                 norm_data_dict, meta_subset_dict, mixture_pka_dict, cons_ph_table_data,
                                                 protons_df, snr)
         # repli_ph, repli_data = final_data_dict["replicate_1"]
-        return final_data_dict
+        return to_sparse_replicate_dict(final_data_dict)
 
 
 @app.callback(
@@ -6475,6 +6615,7 @@ def page_2_upload_continous_peak_shift_update_groups_repli_data(n_clicks, norm_d
         Input("page-2-upload-conti-peak-shift-final-replicate-dict", "data"),
     ]
 )
+@use_result_store()
 def page_2_upload_group_peak_shift_update_group_replicate_selection(n_clicks, final_data_dict):
     if n_clicks == 0 or final_data_dict is None:
         return [], None
@@ -6496,12 +6637,13 @@ def page_2_upload_group_peak_shift_update_group_replicate_selection(n_clicks, fi
         Input("page-2-upload-conti-peak-shift-select-replicate", "value")
     ]
 )
+@use_result_store()
 def page_2_upload_continuous_peak_shift_update_contour_level_1(n_clicks, final_data_dict, select_repli):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return None, None, []
     else:
         repli_ph, repli_data = final_data_dict[select_repli]
-        temp_data = np.array(repli_data)
+        temp_data = to_dense(repli_data)
         min_level = round(np.min(temp_data[np.nonzero(temp_data)]), 2)
         max_level = round(np.max(temp_data), 2)
         temp_value = [min_level, max_level]
@@ -6520,6 +6662,7 @@ def page_2_upload_continuous_peak_shift_update_contour_level_1(n_clicks, final_d
         Input("page-2-upload-conti-peak-shift-contour-level-1", "value")
     ]
 )
+@use_result_store()
 def page_2_upload_continuous_peak_shift_update_mix_figure(n_clicks, final_data_dict, select_repli, temp_levels):
     if n_clicks == 0 or final_data_dict is None or select_repli is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6555,6 +6698,7 @@ def page_2_update_upload_continuous_peak_shift_meta_y_line_plot(select_replicate
         Input("page-2-upload-conti-peak-shift-final-replicate-dict", "data")
     ]
 )
+@use_result_store()
 def page_2_upload_continuous_peak_shift_update_stacked_fig(n_clicks, log_v_space, final_data_dict):
     if n_clicks == 0 or final_data_dict is None or log_v_space is None:
         return {"data": [], "layout": {}, "frames": []}, []
@@ -6573,6 +6717,7 @@ def page_2_upload_continuous_peak_shift_update_stacked_fig(n_clicks, log_v_space
     State("page-2-upload-conti-peak-shift-final-replicate-dict", "data"),
     prevent_initial_call=True,
 )
+@use_result_store()
 def page_2_download_upload_conti_peak_shift_simulated_spectra(n_clicks, final_replicate_dict):
     final_df = page_2_construct_2d_df_with_peak_shift(final_replicate_dict)
     return dcc.send_data_frame(final_df.to_csv, "uploaded_continuous_simulated_jres_spectra_with_peak_shift.csv")
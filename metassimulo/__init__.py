@@ -0,0 +1,5 @@
+"""
+headless simulation of 1D and JRes spectra, the pipeline of the web app without Dash (see api.py), also run as
+python -m metassimulo simulate ...
+"""
+from metassimulo.api import Simulator, simulate, write_result, read_mixture_file
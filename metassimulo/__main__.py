@@ -0,0 +1,80 @@
+import argparse
+import sys
+
+from simulate_1D.read_parameters import read_param
+from metassimulo.api import Simulator, read_mixture_file, write_result
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="metassimulo", description="MetAssimulo 2 without the web app")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    sim_parser = subparsers.add_parser("simulate", help="simulate the two groups of one or more cohorts")
+    sim_parser.add_argument("-p", "--parameter", dest="parameter_file", required=True, help="Input Parameter Files")
+    sim_parser.add_argument("-m", "--mixture", dest="mixture_file", required=True,
+                            help="metabolites of the mixture, one name per line")
+    sim_parser.add_argument("-o", "--output", dest="output_path", required=True,
+                            help="output file (csv for 1d, npz for jres), the concentrations go to <output>_cons.csv; "
+                                 "with --cohorts N, '{}' in the path is replaced by the cohort number")
+    sim_parser.add_argument("-t", "--type", dest="spectra_type", choices=["1d", "jres"], default="1d")
+    sim_parser.add_argument("--cohorts", type=int, default=1, help="number of cohorts to simulate")
+    sim_parser.add_argument("--seed", type=int, default=None,
+                            help="seed of all random draws, cohort i uses seed + i (default: the seed of the "
+                                 "parameter file, if any)")
+    sim_parser.add_argument("--peak-shift", action="store_true", help="simulate the pH dependent peak shift")
+    sim_parser.add_argument("--snr", type=float, default=1000)
+    sim_parser.add_argument("--wins", type=int, default=100, help="smoothing window of the 1d noise")
+    for group_flag in ("1", "2"):
+        group = sim_parser.add_argument_group("group {}".format(group_flag))
+        group.add_argument("--num-repli-" + group_flag, dest="num_repli_" + group_flag, type=int, default=10)
+        group.add_argument("--bio-type-" + group_flag, dest="bio_type_" + group_flag, default="Urine",
+                           help="biospecimen of the HMDB concentrations (Urine, Blood, ...)")
+        group.add_argument("--cons-" + group_flag, dest="cons_file_" + group_flag, default=None,
+                           help="concentration file (name, mean, std in uM) instead of HMDB")
+        group.add_argument("--corr-" + group_flag, dest="corr_file_" + group_flag, default=None,
+                           help="tab separated correlation matrix")
+        group.add_argument("--ph-" + group_flag, dest="same_ph_" + group_flag, type=float, default=None,
+                           help="the same pH for every replicate")
+        group.add_argument("--ph-mean-" + group_flag, dest="ph_mean_" + group_flag, type=float, default=None)
+        group.add_argument("--ph-std-" + group_flag, dest="ph_std_" + group_flag, type=float, default=None)
+        group.add_argument("--albumin-" + group_flag, dest="albumin_level_" + group_flag, type=float, default=0,
+                           help="albumin level added to the 1d spectra (blood)")
+    return parser
+
+
+def get_output_path(output_path, cohort_index, num_cohorts):
+    if num_cohorts == 1:
+        return output_path
+    if "{}" in output_path:
+        return output_path.format(cohort_index + 1)
+    stem, dot, suffix = output_path.rpartition(".")
+    if not dot:
+        return "{}_{}".format(output_path, cohort_index + 1)
+    return "{}_{}.{}".format(stem, cohort_index + 1, suffix)
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    simulator = Simulator.from_param_file(args.parameter_file, args.spectra_type)
+    mixture_names = read_mixture_file(args.mixture_file)
+
+    seed = args.seed
+    if seed is None:
+        param_dict = read_param(args.parameter_file)
+        seed = int(param_dict['seed']) if 'seed' in param_dict else None
+
+    simulate_kwargs = {name: getattr(args, name) for name in (
+        "num_repli_1", "num_repli_2", "bio_type_1", "bio_type_2", "cons_file_1", "cons_file_2", "corr_file_1",
+        "corr_file_2", "same_ph_1", "ph_mean_1", "ph_std_1", "same_ph_2", "ph_mean_2", "ph_std_2",
+        "albumin_level_1", "albumin_level_2", "snr", "wins")}
+    for cohort_index in range(args.cohorts):
+        cohort_seed = seed + cohort_index if seed is not None else None
+        result = simulator.simulate(mixture_names, peak_shift=args.peak_shift, seed=cohort_seed, **simulate_kwargs)
+        output_path, cons_path = write_result(result, get_output_path(args.output_path, cohort_index, args.cohorts))
+        print("cohort {}: {} and {}".format(cohort_index + 1, output_path, cons_path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,387 @@
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from simulate_1D.read_parameters import read_param
+from simulate_1D.hmdb_names import load_hmdb_name_index
+from simulate_1D.random_streams import get_seed_sequence, get_child_rng
+from simulate_1D.construct_hmdb_avg_cons import load_hmdb_cons_table_with_cache
+from simulate_1D.match_names import input_match_db, input_corr_match_db, input_cons_match_db
+from simulate_1D.sample_concentrations import simulate_concentrations, pos_normal_no_correlated
+from simulate_1D import read_1d_spectra, preprocess_1d_spectra, peak_detection_1d, calculate_1d_without_peak_shift, \
+    calculate_1d_with_peak_shift
+from simulate_2D import read_2d_spectra, preprocess_2d_spectra, peak_detection_2d, calculate_2d_without_peak_shift, \
+    calculate_2d_with_peak_shift
+from simulate_2D.sparse_spectra import to_dense
+
+# read the spectra libraries and the HMDB tables from the repository root, like the pages do
+base_path = pathlib.Path(__file__).resolve().parents[1]
+
+SPECTRA_TYPES = ("1d", "jres")
+DEFAULT_PH = 7.4
+
+
+def read_mixture_file(mixture_file):
+    """
+    names of the metabolites of a mixture file, one name per line (the file uploaded in STEP 1 of the pages)
+    """
+    with open(mixture_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_cons_file(cons_file, match_data_dict, hmdb_dict):
+    """
+    user concentrations of one group, csv/txt with the columns name, mean, std (uM), or an excel file
+    """
+    if str(cons_file).endswith((".xls", ".xlsx")):
+        cons_df = pd.read_excel(cons_file)
+    else:
+        cons_df = pd.read_csv(cons_file, sep=",", header=0)
+    return input_cons_match_db(cons_df, match_data_dict, hmdb_dict)
+
+
+def read_corr_file(corr_file, match_data_dict, hmdb_dict):
+    """
+    tab separated correlation matrix of one group, the header holds the metabolite names
+    """
+    if corr_file is None:
+        return None
+    corr_df = pd.read_csv(corr_file, sep="\t", header=0)
+    corr_df.set_index(corr_df.columns, inplace=True)
+    return input_corr_match_db(corr_df, match_data_dict, hmdb_dict)
+
+
+def sample_ph_list(num_replicates, same_ph=None, ph_mean=None, ph_std=None, rng=None):
+    """
+    pH of every replicate of a group: same_ph for all of them, or drawn from a positive normal(ph_mean, ph_std),
+    7.4 when neither is given
+    """
+    if same_ph is not None:
+        return np.round([float(same_ph)] * num_replicates, 2)
+    if ph_mean is not None:
+        return np.round(pos_normal_no_correlated(ph_mean, ph_std or 0.0, num_replicates, rng), 2)
+    return np.round([DEFAULT_PH] * num_replicates, 2)
+
+
+def get_mixture_pka_dict(mixture_hmdb_id_dict, hmdb_id_pka_dict, seed=None):
+    """
+    pKa of every metabolite: the mean of its strongest basic and acidic pKa in HMDB, or a draw from
+    normal(6.013, 2.972) when HMDB has neither
+    """
+    seed = get_seed_sequence(seed)
+    mixture_pka_dict = dict()
+    for meta_name, hmdb_id in mixture_hmdb_id_dict.items():
+        temp_pka_dict = hmdb_id_pka_dict.get(hmdb_id, {})
+        pka_list = []
+        for key in ("pka_strongest_basic", "pka_strongest_acidic"):
+            try:
+                pka_list.append(float(temp_pka_dict[key]))
+            except (KeyError, TypeError, ValueError):
+                pass
+        if pka_list:
+            mixture_pka_dict[meta_name] = sum(pka_list) / len(pka_list)
+        else:
+            mixture_pka_dict[meta_name] = get_child_rng(seed, "pka", meta_name).normal(6.013, 2.972, 1)[0]
+    return mixture_pka_dict
+
+
+class Simulator:
+    """
+    the simulation pipeline of the pages (select metabolites, concentrations, preprocessing, mixture spectra with
+    or without peak shift) without Dash; the spectra library and the HMDB tables are loaded once, so one Simulator
+    can simulate any number of cohorts
+
+        simulator = Simulator.from_param_file("Input/parameters.txt", "1d")
+        result = simulator.simulate(["citric acid", "creatinine"], num_repli_1=20, num_repli_2=20, seed=1)
+        write_result(result, "cohort_1.csv")
+
+    spectra_type: "1d" (read with nPYc, sop_type and pulse_program_type are needed) or "jres"
+    """
+    def __init__(self, spectra_type, file_path, sop_type=None, pulse_program_type=None, num_workers=None):
+        if spectra_type not in SPECTRA_TYPES:
+            raise ValueError("spectra_type must be one of {}, not {!r}".format(SPECTRA_TYPES, spectra_type))
+        self.spectra_type = spectra_type
+        self.protons_df = pd.read_csv(base_path.joinpath("Input/hmdb_protons.csv"), index_col=0)
+        self.hmdb_dict = load_hmdb_name_index(base_path.joinpath("Input/hmdb_id_names.json"))
+        self.hmdb_cons_table = load_hmdb_cons_table_with_cache(
+            base_path.joinpath("Input/hmdb_normal_concentrations.json"),
+            base_path.joinpath("Input/hmdb_abnormal_concentrations.json"))
+        with open(base_path.joinpath("Input/hmdb_id_pka.json")) as json_file:
+            self.hmdb_id_pka_dict = json.load(json_file)
+
+        self.albumin_norm_data_dict = None
+        if spectra_type == "1d":
+            self.match_data_dict, self.ppm_scale = read_1d_spectra.read_1d_data_with_cache(
+                file_path, sop_type, pulse_program_type, self.hmdb_dict)
+            self.y_scale = None
+        else:
+            self.match_data_dict, self.ppm_scale, self.y_scale = read_2d_spectra.read_2d_data_with_cache(
+                file_path, read_2d_spectra.read_2d_data, self.hmdb_dict, num_workers=num_workers)
+
+    @classmethod
+    def from_param_file(cls, parameter_file_name, spectra_type="1d"):
+        """
+        Simulator reading the library given in a parameter file of the web app (file_path_1D, sop_type and
+        pulseProgrm_type for 1d, file_path_2D and the optional num_workers for jres)
+        """
+        param_dict = read_param(parameter_file_name)
+        if spectra_type == "1d":
+            return cls(spectra_type, param_dict['file_path_1D'], param_dict['sop_type'],
+                       param_dict['pulseProgrm_type'])
+        num_workers = int(param_dict['num_workers']) if 'num_workers' in param_dict else None
+        return cls(spectra_type, param_dict['file_path_2D'], num_workers=num_workers)
+
+    def get_albumin_data_dict(self):
+        # the albumin spectrum added to blood samples, read on first use
+        if self.albumin_norm_data_dict is None:
+            albumin_dict, albumin_ppm_scale = read_1d_spectra.read_1d_data_with_cache(
+                base_path.joinpath("Input/Albumin/"), "GenericNMRurine", "noesygppr1d")
+            albumin_removed_data_dict = preprocess_1d_spectra.remove_water_calibration(
+                albumin_dict, albumin_ppm_scale, [4.67, 4.78], [-0.1, 0.1])
+            self.albumin_norm_data_dict = preprocess_1d_spectra.norm_spectra(albumin_removed_data_dict)
+        return self.albumin_norm_data_dict
+
+    def match_mixture(self, mixture_names, hmdb_id_dict=None):
+        """
+        {library name: HMDB ID} of the mixture; names are matched to the library like in STEP 1 of the pages, the
+        first HMDB ID of a name is used unless hmdb_id_dict gives another one
+        """
+        hmdb_id_dict = hmdb_id_dict or dict()
+        # a name matching several library names, or given twice, is kept once
+        mixture_list = list(dict.fromkeys(input_match_db(mixture_names, self.match_data_dict, self.hmdb_dict)))
+        if not mixture_list:
+            raise ValueError("none of the metabolites of the mixture is in the spectra library")
+        mixture_hmdb_id_dict = dict()
+        for meta_name in mixture_list:
+            hmdb_id_list = list(self.hmdb_dict.get_ids(meta_name))
+            mixture_hmdb_id_dict[meta_name] = hmdb_id_dict.get(meta_name, hmdb_id_list[0] if hmdb_id_list else None)
+        return mixture_hmdb_id_dict
+
+    def get_cons_mean_std_rows(self, mixture_hmdb_id_dict, bio_type_1="Urine", bio_type_2="Urine",
+                               cons_file_1=None, cons_file_2=None):
+        """
+        mean / std of every metabolite in both groups (the table of STEP 2), from HMDB (normal concentrations for
+        group 1, abnormal ones for group 2) or from the user concentration file of the group
+        """
+        cons_dict_list = []
+        for group_flag, cons_file in (("1", cons_file_1), ("2", cons_file_2)):
+            if cons_file is None:
+                cons_dict_list.append(None)
+                continue
+            cons_df = read_cons_file(cons_file, self.match_data_dict, self.hmdb_dict)
+            cons_df.columns = ["meta_name", "mean_" + group_flag, "std_" + group_flag]
+            cons_dict_list.append({row["meta_name"]: row for row in cons_df.to_dict("records")})
+
+        table_rows = []
+        for meta_name, hmdb_id in mixture_hmdb_id_dict.items():
+            temp_dict = {"meta_name": meta_name, "hmdb_id": hmdb_id}
+            for group_flag, cons_dict, get_avg_cons, bio_type in (
+                    ("1", cons_dict_list[0], self.hmdb_cons_table.get_normal_avg_cons, bio_type_1),
+                    ("2", cons_dict_list[1], self.hmdb_cons_table.get_abnormal_avg_cons, bio_type_2)):
+                if cons_dict is None:
+                    avg_mean, avg_std, unit = get_avg_cons(hmdb_id, bio_type)
+                elif meta_name in cons_dict:
+                    avg_mean = cons_dict[meta_name]["mean_" + group_flag]
+                    avg_std = cons_dict[meta_name]["std_" + group_flag]
+                else:
+                    raise ValueError("{} is missing from the concentration file of group {}".format(meta_name,
+                                                                                                 group_flag))
+                temp_dict["mean_" + group_flag] = avg_mean
+                temp_dict["std_" + group_flag] = avg_std
+            table_rows.append(temp_dict)
+        return table_rows
+
+    def preprocess(self, mixture_list, water_range=(4.5, 5.0), cal_range=(-0.3, 0.3), bins=16, baseline_thres=0.1,
+                   smooth_thres=0.05, filter_thres=0.05, smooth_thres_m=3, smooth_thres_n=3):
+        """
+        preprocessed (normalized) spectra of the mixture, with the default parameters of STEP 3 of the pages;
+        bins, baseline_thres and smooth_thres are used for 1d, filter_thres and smooth_thres_m/n for jres
+        """
+        temp_raw_data_dict = {name: self.match_data_dict[name] for name in mixture_list}
+        if self.spectra_type == "1d":
+            removed_data_dict = preprocess_1d_spectra.remove_water_calibration(
+                temp_raw_data_dict, self.ppm_scale, list(water_range), list(cal_range))
+            corrected_data_dict = preprocess_1d_spectra.baseline_correction(removed_data_dict, bins, baseline_thres)
+            smooth_data_dict = preprocess_1d_spectra.smooth_spectra(corrected_data_dict, smooth_thres)
+            return preprocess_1d_spectra.norm_spectra(smooth_data_dict)
+
+        removed_data_dict = preprocess_2d_spectra.remove_water_calibration(
+            temp_raw_data_dict, self.ppm_scale, self.y_scale, list(water_range), list(cal_range))
+        filtered_data_dict = preprocess_2d_spectra.filter_noise(removed_data_dict, filter_thres)
+        smooth_data_dict = preprocess_2d_spectra.smooth_data(filtered_data_dict, smooth_thres_m, smooth_thres_n)
+        return preprocess_2d_spectra.normalize_data(smooth_data_dict, sparse=True)
+
+    def simulate(self, mixture_names, num_repli_1=10, num_repli_2=10, bio_type_1="Urine", bio_type_2="Urine",
+                 cons_file_1=None, cons_file_2=None, corr_file_1=None, corr_file_2=None, hmdb_id_dict=None,
+                 peak_shift=False, same_ph_1=None, ph_mean_1=None, ph_std_1=None, same_ph_2=None, ph_mean_2=None,
+                 ph_std_2=None, albumin_level_1=0, albumin_level_2=0, snr=1000, wins=100, seed=None,
+                 **preprocess_kwargs):
+        """
+        simulate the two groups of a cohort, returns a dict with
+            cons_table: the simulated concentrations (and pH with peak shift) of every replicate, the rows of the
+                table of STEP 2
+            group_1, group_2: the replicate dicts of the groups, {"replicate_1": spectrum, ...} without peak shift,
+                {"replicate_1": [pH, spectrum], ...} with it (1d spectra are arrays, jres spectra CSR matrices)
+            ppm_scale, y_scale (None for 1d), peak_shift
+        corr_file_1/2: optional correlation matrix of the group (see read_corr_file)
+        albumin_level_1/2: level of the albumin spectrum added to the 1d spectra of the group (blood samples)
+        snr, wins: level and smoothing window of the noise (wins is only used for 1d)
+        seed: see random_streams.get_seed_sequence, the same seed gives the same cohort
+        preprocess_kwargs: parameters of the preprocessing, see preprocess
+        """
+        seed = get_seed_sequence(seed)
+        mixture_hmdb_id_dict = self.match_mixture(mixture_names, hmdb_id_dict)
+        mean_std_rows = self.get_cons_mean_std_rows(mixture_hmdb_id_dict, bio_type_1, bio_type_2, cons_file_1,
+                                                    cons_file_2)
+        mixture_list = list(mixture_hmdb_id_dict.keys())
+
+        corr_df_1 = read_corr_file(corr_file_1, self.match_data_dict, self.hmdb_dict)
+        corr_df_2 = read_corr_file(corr_file_2, self.match_data_dict, self.hmdb_dict)
+        simulated_cons_df_1 = simulate_concentrations(mean_std_rows, num_repli_1, corr_df_1 is not None, corr_df_1,
+                                                      "1", seed=seed)
+        simulated_cons_df_2 = simulate_concentrations(mean_std_rows, num_repli_2, corr_df_2 is not None, corr_df_2,
+                                                      "2", seed=seed)
+        simulated_cons_dict = pd.merge(simulated_cons_df_1, simulated_cons_df_2, on="meta_name").set_index(
+            "meta_name").to_dict("index")
+        cons_table_rows = [{"meta_name": meta_name, "hmdb_id": hmdb_id, **simulated_cons_dict[meta_name]}
+                           for meta_name, hmdb_id in mixture_hmdb_id_dict.items()]
+
+        norm_data_dict = self.preprocess(mixture_list, **preprocess_kwargs)
+        if not peak_shift:
+            group_dict_list = [
+                self._simulate_group(num_repli_1, mixture_hmdb_id_dict, norm_data_dict, cons_table_rows, "1",
+                                     albumin_level_1, snr, wins, seed),
+                self._simulate_group(num_repli_2, mixture_hmdb_id_dict, norm_data_dict, cons_table_rows, "2",
+                                     albumin_level_2, snr, wins, seed),
+            ]
+        else:
+            ph_list_1 = sample_ph_list(num_repli_1, same_ph_1, ph_mean_1, ph_std_1, get_child_rng(seed, "ph", "1"))
+            ph_list_2 = sample_ph_list(num_repli_2, same_ph_2, ph_mean_2, ph_std_2, get_child_rng(seed, "ph", "2"))
+            ph_row = {"meta_name": "pH", "hmdb_id": "/"}
+            ph_row.update({"1_replicate_" + str(i + 1): ph for i, ph in enumerate(ph_list_1)})
+            ph_row.update({"2_replicate_" + str(i + 1): ph for i, ph in enumerate(ph_list_2)})
+            cons_table_rows = [ph_row] + cons_table_rows
+
+            meta_subset_dict = self.get_meta_subset_dict(mixture_list, norm_data_dict, seed,
+                                                         self.get_peak_cluster_file(**preprocess_kwargs))
+            mixture_pka_dict = get_mixture_pka_dict(mixture_hmdb_id_dict, self.hmdb_id_pka_dict, seed)
+            group_dict_list = [
+                self._simulate_group_with_peak_shift(mixture_hmdb_id_dict, norm_data_dict, meta_subset_dict,
+                                                     mixture_pka_dict, cons_table_rows, "1", albumin_level_1, snr,
+                                                     wins, seed),
+                self._simulate_group_with_peak_shift(mixture_hmdb_id_dict, norm_data_dict, meta_subset_dict,
+                                                     mixture_pka_dict, cons_table_rows, "2", albumin_level_2, snr,
+                                                     wins, seed),
+            ]
+
+        return {"cons_table": cons_table_rows, "group_1": group_dict_list[0], "group_2": group_dict_list[1],
+                "ppm_scale": self.ppm_scale, "y_scale": self.y_scale, "peak_shift": peak_shift}
+
+    def get_peak_cluster_file(self, water_range=(4.5, 5.0), cal_range=(-0.3, 0.3), bins=16, baseline_thres=0.1,
+                              smooth_thres=0.05, filter_thres=0.05, smooth_thres_m=3, smooth_thres_n=3):
+        """
+        the file of the peak clusters of the library preprocessed with these parameters (see preprocess), the
+        parameters are listed in the order of the pages so that the pages and the api share the file
+        """
+        if self.spectra_type == "1d":
+            return peak_detection_1d.get_peak_cluster_cache_file(
+                self.match_data_dict, [list(cal_range), list(water_range), bins, baseline_thres, smooth_thres])
+        return peak_detection_2d.get_peak_cluster_cache_file(
+            self.match_data_dict, [list(cal_range), list(water_range), filter_thres, smooth_thres_m, smooth_thres_n])
+
+    def get_meta_subset_dict(self, mixture_list, norm_data_dict, seed=None, cluster_file=None):
+        # peak clusters and delta_acid_base of every metabolite, on the pJRes projection for jres
+        if self.spectra_type == "1d":
+            return peak_detection_1d.get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=seed,
+                                                                     cache_file=cluster_file)
+        return peak_detection_2d.get_peak_cluster_acid_base_list(mixture_list, norm_data_dict, seed=seed,
+                                                                 cache_file=cluster_file,
+                                                                 projection=peak_detection_2d.get_p_jres)
+
+    def _simulate_group(self, num_replicates, mixture_hmdb_id_dict, norm_data_dict, cons_table_rows, group_flag,
+                        albumin_level, snr, wins, seed):
+        if self.spectra_type == "jres":
+            return calculate_2d_without_peak_shift.simulate_mixture_for_all_repli(
+                num_replicates, mixture_hmdb_id_dict, norm_data_dict, cons_table_rows, self.protons_df, snr,
+                group_flag)
+        if albumin_level:
+            return calculate_1d_without_peak_shift.sum_mixture_spectra_with_albumin_for_all_repli(
+                num_replicates, mixture_hmdb_id_dict, norm_data_dict, cons_table_rows, self.protons_df,
+                self.get_albumin_data_dict(), albumin_level, snr, wins, group_flag)
+        return calculate_1d_without_peak_shift.simulate_mixture_for_all_repli(
+            num_replicates, list(mixture_hmdb_id_dict), norm_data_dict, cons_table_rows, self.protons_df, snr, wins,
+            group_flag, seed)
+
+    def _simulate_group_with_peak_shift(self, mixture_hmdb_id_dict, norm_data_dict, meta_subset_dict,
+                                        mixture_pka_dict, cons_table_rows, group_flag, albumin_level, snr, wins,
+                                        seed):
+        mixture_list = list(mixture_hmdb_id_dict)
+        if self.spectra_type == "jres":
+            return calculate_2d_with_peak_shift.simulate_mixture_with_peak_shift_for_all_repli(
+                mixture_list, self.ppm_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict, cons_table_rows,
+                group_flag, self.protons_df, snr)
+        if albumin_level:
+            return calculate_1d_with_peak_shift.simulate_mixture_with_peak_shift_with_albumin_for_all_repli(
+                mixture_hmdb_id_dict, mixture_list, self.ppm_scale, norm_data_dict, meta_subset_dict,
+                mixture_pka_dict, cons_table_rows, group_flag, self.protons_df, self.get_albumin_data_dict(),
+                albumin_level, snr, wins)
+        return calculate_1d_with_peak_shift.simulate_mixture_with_peak_shift_for_all_repli(
+            mixture_list, self.ppm_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict, cons_table_rows,
+            group_flag, self.protons_df, snr, wins, seed)
+
+
+def get_group_spectra(replicate_dict):
+    """
+    [(replicate name, pH or None, spectrum), ...] of a simulated group, replicate_mean excluded
+    """
+    spectra_list = []
+    for repli_name, value in replicate_dict.items():
+        if repli_name == "replicate_mean":
+            continue
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            spectra_list.append((repli_name, float(value[0]), value[1]))
+        else:
+            spectra_list.append((repli_name, None, value))
+    return spectra_list
+
+
+def write_result(result, output_path):
+    """
+    write a simulated cohort (see Simulator.simulate)
+    1d: output_path is a csv with one row per point of the ppm scale and one column per replicate
+        ("group_1_replicate_1", ...), like the downloads of the pages; the concentrations (and pH) are written next
+        to it, in <output_path stem>_cons.csv
+    jres: output_path is a compressed npz with ppm_scale, y_scale and one dense array per replicate, the
+        concentrations are written in the same way
+    """
+    output_path = pathlib.Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    spectra_dict = dict()
+    for group_name in ("group_1", "group_2"):
+        for repli_name, ph, spectrum in get_group_spectra(result[group_name]):
+            spectra_dict[group_name + "_" + repli_name] = spectrum
+
+    if result["y_scale"] is None:
+        output_df = pd.DataFrame({"ppm": np.asarray(result["ppm_scale"]),
+                                  **{name: np.asarray(data) for name, data in spectra_dict.items()}})
+        output_df.to_csv(output_path, index=False)
+    else:
+        np.savez_compressed(str(output_path), ppm_scale=np.asarray(result["ppm_scale"]),
+                            y_scale=np.asarray(result["y_scale"]),
+                            **{name: to_dense(data) for name, data in spectra_dict.items()})
+
+    cons_path = output_path.with_name(output_path.stem + "_cons.csv")
+    pd.DataFrame(result["cons_table"]).to_csv(cons_path, index=False)
+    return output_path, cons_path
+
+
+def simulate(parameter_file_name, mixture_file, output_path, spectra_type="1d", **simulate_kwargs):
+    """
+    simulate one cohort from the files of a run and write it to output_path, see Simulator.simulate for
+    simulate_kwargs and write_result for the output files
+    """
+    simulator = Simulator.from_param_file(parameter_file_name, spectra_type)
+    result = simulator.simulate(read_mixture_file(mixture_file), **simulate_kwargs)
+    return write_result(result, output_path)
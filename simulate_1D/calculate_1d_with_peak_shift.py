@@ -1,27 +1,23 @@
 import pandas as pd
 import numpy as np
-from scipy import signal
 
-from simulate_1D.peak_shift_1d import construct_shift_data_for_all_repli, construct_shift_data_continuous_for_all_repli
+from simulate_1D.peak_shift_1d import shift_mixture_matrix, get_group_ph_dict, get_continuous_ph_dict
+from simulate_1D.mixture_engine import get_weight_matrix, simulate_mixture_matrix
+from simulate_1D.calculate_1d_without_peak_shift import add_smoothed_noise, add_smoothed_noise_matrix, get_albumin_data
+from simulate_1D.random_streams import get_child_seed_sequence
+
+
+def get_repli_index(repli_name):
+    # "1_replicate_3" or "replicate_3" -> 2, the row of the replicate in the noise streams
+    return int(repli_name.split("_")[-1]) - 1
 
 
 def sum_mixture_with_peak_shift_with_albumin_for_each_repli(repli_name, mixture_dict, shift_data_dict,
                                                             cons_table_rows, protons_df, albumin_norm_data_dict_1,
                                                             albumin_level, snr, wins):
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[repli_name])
-        # temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(shift_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
-
-    sum_data = sum_data + albumin_norm_data_dict_1["Albumin"] * 678 * albumin_level
+    sum_data = simulate_mixture_matrix(mixture_dict, shift_data_dict, cons_table_rows, [repli_name], protons_df)[0]
+
+    sum_data = sum_data + get_albumin_data(albumin_norm_data_dict_1, albumin_level)
     return sum_data
 
 
@@ -30,13 +26,13 @@ def simulate_mixture_with_peak_shift_with_albumin_for_all_repli(mixture_dict, mi
                                                                 group_flag, protons_df, albumin_norm_data_dict_1,
                                                                 albumin_level, snr, wins):
     replicate_dict = dict()
-    group_ph_dict, ph_data_dict = construct_shift_data_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
-                                                                     meta_subset_dict, mixture_pka_dict,
-                                                                     cons_ph_table_data, group_flag)
-    for repli_name, shift_data_dict in ph_data_dict.items():
-        temp_sum_data = sum_mixture_with_peak_shift_with_albumin_for_each_repli(repli_name, mixture_dict, shift_data_dict,
-                                                            cons_ph_table_data, protons_df, albumin_norm_data_dict_1,
-                                                            albumin_level, snr, wins)
+    group_ph_dict = get_group_ph_dict(cons_ph_table_data, group_flag)
+    weight_matrix = get_weight_matrix(mixture_dict, cons_ph_table_data, list(group_ph_dict.keys()), protons_df)
+    albumin_data = get_albumin_data(albumin_norm_data_dict_1, albumin_level)
+    sum_matrix = shift_mixture_matrix(list(mixture_dict.keys()), ppm_scale, norm_data_dict, meta_subset_dict,
+                                      mixture_pka_dict, list(group_ph_dict.values()), weight_matrix) + albumin_data
+    for idx, repli_name in enumerate(group_ph_dict.keys()):
+        temp_sum_data = sum_matrix[idx]
         repli_ph = group_ph_dict[repli_name]
         replicate_dict[repli_name.lstrip(group_flag+"_")] = [repli_ph, temp_sum_data]
 
@@ -45,41 +41,26 @@ def simulate_mixture_with_peak_shift_with_albumin_for_all_repli(mixture_dict, mi
 
 
 
-def sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict, cons_table_rows, protons_df, snr, wins):
-    sum_data = 0
-    for meta_name in mixture_list:
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[repli_name])
-        temp_protons = 1
-            # int(protons_df.loc[meta_name, "number"])
-        temp_data = np.array(shift_data_dict[meta_name])
-
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
-
-    # add noise, SNR = 1000
-    noise_std = max(sum_data) / snr
-    print(noise_std, len(sum_data))
-    noise_y = np.random.normal(0, noise_std, len(sum_data))
+def sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict, cons_table_rows, protons_df, snr, wins,
+                               seed=None):
+    # every metabolite counts as one proton here
+    sum_data = simulate_mixture_matrix(dict.fromkeys(mixture_list), shift_data_dict, cons_table_rows, [repli_name])[0]
 
-    win = signal.windows.hann(wins)
-    smooth_noise_y = signal.convolve(noise_y, win, mode='same') / sum(win)
-
-    final_sum_data = sum_data + smooth_noise_y
-
-    return final_sum_data
+    return add_smoothed_noise(sum_data, snr, wins, seed, get_repli_index(repli_name))
 
 
 def simulate_mixture_with_peak_shift_for_all_repli(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict,
                                                    mixture_pka_dict, cons_ph_table_data,
-                                                   group_flag, protons_df, snr, wins):
+                                                   group_flag, protons_df, snr, wins, seed=None):
     replicate_dict = dict()
-    group_ph_dict, ph_data_dict = construct_shift_data_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
-                                                                     meta_subset_dict, mixture_pka_dict,
-                                                                     cons_ph_table_data, group_flag)
-    for repli_name, shift_data_dict in ph_data_dict.items():
-        temp_sum_data = sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict, cons_ph_table_data,
-                                                   protons_df, snr, wins)
+    group_ph_dict = get_group_ph_dict(cons_ph_table_data, group_flag)
+    weight_matrix = get_weight_matrix(dict.fromkeys(mixture_list), cons_ph_table_data, list(group_ph_dict.keys()))
+    sum_matrix = shift_mixture_matrix(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict,
+                                      list(group_ph_dict.values()), weight_matrix)
+    final_sum_matrix = add_smoothed_noise_matrix(sum_matrix, snr, wins, get_child_seed_sequence(seed, group_flag),
+                                                 [get_repli_index(name) for name in group_ph_dict.keys()])
+    for idx, repli_name in enumerate(group_ph_dict.keys()):
+        temp_sum_data = final_sum_matrix[idx]
         repli_ph = group_ph_dict[repli_name]
         replicate_dict[repli_name.lstrip(group_flag+"_")] = [repli_ph, temp_sum_data]
 
@@ -88,45 +69,29 @@ def simulate_mixture_with_peak_shift_for_all_repli(mixture_list, ppm_scale, norm
 
 
 def sum_mixture_continuous_with_peak_shift_for_each_repli(repli_name, mixture_dict, shift_data_dict, cons_table_rows,
-                                                          protons_df, albumin_norm_data_dict_1, albumin_level, snr, wins):
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[repli_name])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(shift_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
-
-    sum_data = sum_data + albumin_norm_data_dict_1["Albumin"] * 678 * albumin_level
-
-    # add noise, SNR = 1000
-    noise_std = max(sum_data) / snr
-    print(noise_std, len(sum_data))
-    noise_y = np.random.normal(0, noise_std, len(sum_data))
+                                                          protons_df, albumin_norm_data_dict_1, albumin_level, snr, wins,
+                                                          seed=None):
+    sum_data = simulate_mixture_matrix(mixture_dict, shift_data_dict, cons_table_rows, [repli_name], protons_df)[0]
 
-    win = signal.windows.hann(wins)
-    smooth_noise_y = signal.convolve(noise_y, win, mode='same') / sum(win)
+    sum_data = sum_data + get_albumin_data(albumin_norm_data_dict_1, albumin_level)
 
-    final_sum_data = sum_data + smooth_noise_y
-    return final_sum_data
+    return add_smoothed_noise(sum_data, snr, wins, seed, get_repli_index(repli_name))
 
 
 def simulate_mixture_continuous_with_peak_shift_for_all_repli_with_albumin(mixture_dict, mixture_list, ppm_scale, norm_data_dict,
                                                               meta_subset_dict, mixture_pka_dict, cons_ph_table_data,
                                                               protons_df, albumin_norm_data_dict_1, albumin_level,
-                                                              snr, wins):
+                                                              snr, wins, seed=None):
     replicate_dict = dict()
-    conti_ph_dict, ph_data_dict = construct_shift_data_continuous_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
-                                                            meta_subset_dict, mixture_pka_dict, cons_ph_table_data)
-    for repli_name, shift_data_dict in ph_data_dict.items():
-        temp_sum_data = sum_mixture_continuous_with_peak_shift_for_each_repli(repli_name, mixture_dict, shift_data_dict,
-                                                                              cons_ph_table_data, protons_df,
-                                                                              albumin_norm_data_dict_1, albumin_level,
-                                                                              snr, wins)
+    conti_ph_dict = get_continuous_ph_dict(cons_ph_table_data)
+    weight_matrix = get_weight_matrix(mixture_dict, cons_ph_table_data, list(conti_ph_dict.keys()), protons_df)
+    albumin_data = get_albumin_data(albumin_norm_data_dict_1, albumin_level)
+    sum_matrix = shift_mixture_matrix(list(mixture_dict.keys()), ppm_scale, norm_data_dict, meta_subset_dict,
+                                      mixture_pka_dict, list(conti_ph_dict.values()), weight_matrix) + albumin_data
+    final_sum_matrix = add_smoothed_noise_matrix(sum_matrix, snr, wins, seed,
+                                                 [get_repli_index(name) for name in conti_ph_dict.keys()])
+    for idx, repli_name in enumerate(conti_ph_dict.keys()):
+        temp_sum_data = final_sum_matrix[idx]
         repli_ph = conti_ph_dict[repli_name]
         replicate_dict[repli_name] = [repli_ph, temp_sum_data]
 
@@ -136,13 +101,17 @@ def simulate_mixture_continuous_with_peak_shift_for_all_repli_with_albumin(mixtu
 
 
 def simulate_mixture_continuous_with_peak_shift_for_all_repli(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict,
-                                                   mixture_pka_dict, cons_ph_table_data, protons_df, snr, wins):
+                                                   mixture_pka_dict, cons_ph_table_data, protons_df, snr, wins,
+                                                   seed=None):
     replicate_dict = dict()
-    conti_ph_dict, ph_data_dict = construct_shift_data_continuous_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
-                                                            meta_subset_dict, mixture_pka_dict, cons_ph_table_data)
-    for repli_name, shift_data_dict in ph_data_dict.items():
-        temp_sum_data = sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict, cons_ph_table_data,
-                                                   protons_df, snr, wins)
+    conti_ph_dict = get_continuous_ph_dict(cons_ph_table_data)
+    weight_matrix = get_weight_matrix(dict.fromkeys(mixture_list), cons_ph_table_data, list(conti_ph_dict.keys()))
+    sum_matrix = shift_mixture_matrix(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict,
+                                      list(conti_ph_dict.values()), weight_matrix)
+    final_sum_matrix = add_smoothed_noise_matrix(sum_matrix, snr, wins, seed,
+                                                 [get_repli_index(name) for name in conti_ph_dict.keys()])
+    for idx, repli_name in enumerate(conti_ph_dict.keys()):
+        temp_sum_data = final_sum_matrix[idx]
         repli_ph = conti_ph_dict[repli_name]
         replicate_dict[repli_name] = [repli_ph, temp_sum_data]
 
@@ -1,125 +1,126 @@
 import numpy as np
 from scipy import signal
 
+from simulate_1D.mixture_engine import simulate_mixture_matrix
+from simulate_1D.random_streams import get_seed_sequence, get_child_seed_sequence, get_child_rng
+
+
+def add_smoothed_noise_matrix(sum_matrix, snr, wins, seed=None, repli_index_list=None):
+    """
+    add smoothed Gaussian noise to every row of a (replicates x points) matrix in one pass: the noise of each replicate
+    has std = max(replicate) / snr and is smoothed with a Hann window of wins points (same as
+    signal.convolve(noise, win, mode='same') / sum(win) row by row, through one batched FFT)
+    seed: see random_streams.get_seed_sequence, row i gets the noise stream (seed, "noise", repli_index_list[i]), by
+    default repli_index_list = [0, 1, ...], so a replicate gets the same noise whether it is simulated alone or not
+    """
+    seed = get_seed_sequence(seed)
+    sum_matrix = np.atleast_2d(sum_matrix)
+    if repli_index_list is None:
+        repli_index_list = range(sum_matrix.shape[0])
+    noise_std = np.max(sum_matrix, axis=1) / snr
+    noise_matrix = np.empty(sum_matrix.shape)
+    for idx, repli_index in enumerate(repli_index_list):
+        noise_matrix[idx] = get_child_rng(seed, "noise", repli_index).standard_normal(sum_matrix.shape[1])
+    noise_matrix *= noise_std[:, np.newaxis]
+
+    win = signal.windows.hann(wins)
+    smooth_noise_matrix = signal.fftconvolve(noise_matrix, win[np.newaxis, :], mode='same', axes=1) / sum(win)
+
+    return sum_matrix + smooth_noise_matrix
+
+
+def add_smoothed_noise(sum_data, snr, wins, seed=None, repli_index=0):
+    return add_smoothed_noise_matrix(sum_data, snr, wins, seed, [repli_index])[0]
+
+
+def get_albumin_data(albumin_norm_data_dict_1, albumin_level):
+    return np.asarray(albumin_norm_data_dict_1["Albumin"]) * 678 * albumin_level
+
 
 def sum_mixture_spectra_with_albumin_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df,
                                      albumin_norm_data_dict_1, albumin_level, snr, wins, group_flag):
 
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[group_flag + "_replicate_" + str(n + 1)])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(format_norm_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+    sum_data = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows,
+                                       [group_flag + "_replicate_" + str(n + 1)], protons_df)[0]
 
-    sum_data = sum_data + albumin_norm_data_dict_1["Albumin"] * 678 * albumin_level
+    sum_data = sum_data + get_albumin_data(albumin_norm_data_dict_1, albumin_level)
 
     return sum_data
 
 
 def sum_mixture_spectra_with_albumin_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict,
-                                   cons_table_rows, protons_df, albumin_norm_data_dict_1, albumin_level, snr, wins, group_flag):
+                                   cons_table_rows, protons_df, albumin_norm_data_dict_1, albumin_level, snr, wins, group_flag,
+                                   progress=None):
+    """
+    progress: optional callable reporting the fraction of the replicates done, see simulate_mixture_matrix
+    """
+    repli_name_list = [group_flag + "_replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_matrix = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows, repli_name_list,
+                                         protons_df, progress)
+    sum_matrix += get_albumin_data(albumin_norm_data_dict_1, albumin_level)
+
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = sum_mixture_spectra_with_albumin_for_each_repli(n, mixture_dict, format_norm_data_dict,
-                                                                        cons_table_rows, protons_df,
-                                                                        albumin_norm_data_dict_1, albumin_level,
-                                                                        snr, wins, group_flag)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = sum_matrix[n]
 
-    mean_repli_data = sum(replicate_dict.values()) / num_replicates
-    replicate_dict["replicate_mean"] = mean_repli_data
+    replicate_dict["replicate_mean"] = np.mean(sum_matrix, axis=0)
 
     return replicate_dict
 
 
-def sum_mixture_for_each_repli(n, mixture_list, format_norm_data_dict, cons_table_rows, protons_df, snr, wins, group_flag):
-    sum_data = 0
-    for meta_name in mixture_list:
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[group_flag+"_replicate_"+str(n+1)])
-        temp_protons = 1
-            # int(protons_df.loc[meta_name, "number"])
-        temp_data = np.array(format_norm_data_dict[meta_name])
-
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+def sum_mixture_for_each_repli(n, mixture_list, format_norm_data_dict, cons_table_rows, protons_df, snr, wins, group_flag,
+                               seed=None):
+    # every metabolite counts as one proton here
+    sum_data = simulate_mixture_matrix(dict.fromkeys(mixture_list), format_norm_data_dict, cons_table_rows,
+                                       [group_flag + "_replicate_" + str(n + 1)])[0]
 
-    # add noise, SNR = 1000
-    noise_std = max(sum_data) / snr
-    print(noise_std, len(sum_data))
-    noise_y = np.random.normal(0, noise_std, len(sum_data))
+    return add_smoothed_noise(sum_data, snr, wins, get_child_seed_sequence(seed, group_flag), n)
 
-    win = signal.windows.hann(wins)
-    smooth_noise_y = signal.convolve(noise_y, win, mode='same') / sum(win)
-
-    final_sum_data = sum_data + smooth_noise_y
 
-    return final_sum_data
+def simulate_mixture_for_all_repli(num_replicates, mixture_list, format_norm_data_dict,
+                                   cons_table_rows, protons_df, snr, wins, group_flag, seed=None):
+    """
+    seed: see random_streams.get_seed_sequence, the two groups get independent noise streams
+    """
+    repli_name_list = [group_flag + "_replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_matrix = simulate_mixture_matrix(dict.fromkeys(mixture_list), format_norm_data_dict, cons_table_rows,
+                                         repli_name_list)
 
+    final_sum_matrix = add_smoothed_noise_matrix(sum_matrix, snr, wins, get_child_seed_sequence(seed, group_flag))
 
-def simulate_mixture_for_all_repli(num_replicates, mixture_list, format_norm_data_dict,
-                                   cons_table_rows, protons_df, snr, wins, group_flag):
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = sum_mixture_for_each_repli(n, mixture_list, format_norm_data_dict,
-                                                   cons_table_rows, protons_df, snr, wins, group_flag)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = final_sum_matrix[n]
 
-    mean_repli_data = sum(replicate_dict.values()) / num_replicates
-    replicate_dict["replicate_mean"] = mean_repli_data
+    replicate_dict["replicate_mean"] = np.mean(final_sum_matrix, axis=0)
 
     return replicate_dict
 
 
 def conti_sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df,
-                                     albumin_norm_data_dict_1, albumin_level, snr, wins):
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict["replicate_"+str(n+1)])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(format_norm_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
-
-    sum_data = sum_data + albumin_norm_data_dict_1["Albumin"] * 678 * albumin_level
-
-    # add noise, SNR = 1000
-    noise_std = max(sum_data) / snr
-    print(noise_std, len(sum_data))
-    noise_y = np.random.normal(0, noise_std, len(sum_data))
-
-    win = signal.windows.hann(wins)
-    smooth_noise_y = signal.convolve(noise_y, win, mode='same') / sum(win)
+                                     albumin_norm_data_dict_1, albumin_level, snr, wins, seed=None):
+    sum_data = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows,
+                                       ["replicate_" + str(n + 1)], protons_df)[0]
 
-    final_sum_data = sum_data + smooth_noise_y
+    sum_data = sum_data + get_albumin_data(albumin_norm_data_dict_1, albumin_level)
 
-    return final_sum_data
+    return add_smoothed_noise(sum_data, snr, wins, seed, n)
 
 
 def simulate_continuous_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict,
                                               cons_table_rows, protons_df, albumin_norm_data_dict_1, albumin_level,
-                                              snr, wins):
+                                              snr, wins, seed=None):
+    repli_name_list = ["replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_matrix = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows, repli_name_list,
+                                         protons_df)
+    sum_matrix += get_albumin_data(albumin_norm_data_dict_1, albumin_level)
+
+    final_sum_matrix = add_smoothed_noise_matrix(sum_matrix, snr, wins, seed)
+
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = conti_sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict,
-                                                         cons_table_rows, protons_df,
-                                                         albumin_norm_data_dict_1, albumin_level,
-                                                         snr, wins)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = final_sum_matrix[n]
 
-    mean_repli_data = sum(replicate_dict.values()) / num_replicates
-    replicate_dict["replicate_mean"] = mean_repli_data
+    replicate_dict["replicate_mean"] = np.mean(final_sum_matrix, axis=0)
 
     return replicate_dict
-
-
@@ -0,0 +1,62 @@
+import json
+import pathlib
+import threading
+from collections.abc import Mapping
+
+
+class HmdbNameIndex(Mapping):
+    """
+    read-only dict of HMDB ID -> names (the content of hmdb_id_names.json) that also holds the inverted index
+    name -> HMDB IDs, so finding the IDs of a name is one dict lookup instead of a scan of every HMDB entry
+    the IDs of a name are listed in the order of the HMDB file, as the scans used to return them
+    """
+    def __init__(self, id_names_dict):
+        self.id_names_dict = id_names_dict
+        self.name_ids_dict = dict()
+        for idx, name_list in id_names_dict.items():
+            for name in name_list:
+                id_list = self.name_ids_dict.setdefault(name, [])
+                if not id_list or id_list[-1] != idx:
+                    id_list.append(idx)
+
+    def __getitem__(self, idx):
+        return self.id_names_dict[idx]
+
+    def __iter__(self):
+        return iter(self.id_names_dict)
+
+    def __len__(self):
+        return len(self.id_names_dict)
+
+    def __contains__(self, idx):
+        return idx in self.id_names_dict
+
+    def get_ids(self, name):
+        return self.name_ids_dict.get(name, [])
+
+
+def get_hmdb_name_index(hmdb_dict):
+    """
+    HmdbNameIndex of hmdb_dict, returned as it is if it already has the inverted index (get_ids), whichever module
+    it was built by
+    """
+    if hasattr(hmdb_dict, "get_ids"):
+        return hmdb_dict
+    return HmdbNameIndex(hmdb_dict)
+
+
+_hmdb_name_index_dict = dict()
+_hmdb_name_index_lock = threading.Lock()
+
+
+def load_hmdb_name_index(json_path):
+    """
+    read hmdb_id_names.json and build its HmdbNameIndex, once per file and process: the 1D, JRes and COSY pages
+    and both simulate_1D and simulate_2D use this module, so they share one index
+    """
+    key = str(pathlib.Path(json_path).resolve())
+    with _hmdb_name_index_lock:
+        if key not in _hmdb_name_index_dict:
+            with open(key) as json_file:
+                _hmdb_name_index_dict[key] = HmdbNameIndex(json.load(json_file))
+        return _hmdb_name_index_dict[key]
@@ -1,83 +1,118 @@
 import pandas as pd
 import numpy as np
-from itertools import groupby
-from operator import itemgetter
-import copy
 
 # from simulate_1D.peak_detection_1d import peak_cluster_detection
-from simulate_1D.preprocess_1d_spectra import smooth_spectra
+from simulate_1D.preprocess_1d_spectra import smooth_spectra_matrix
 
 
-def calculate_peak_shift(y, ppm_scale, temp_pka, temp_ph, filtered_signal_subset, delta_acid_base_list):
-    ph_standard = 7.4
-    y = np.array(y)
-    y_shift_list = np.zeros(len(y))
+def get_shift_size_array(delta_acid_base_list, temp_pka, temp_ph, step_size, ph_standard=7.4):
+    """
+    shift (in points) of every peak cluster at temp_ph, from its delta_acid_base and the pKa of the metabolite;
+    the chemical shift change is bounded to +-0.5 ppm
+    """
+    delta_shift = (np.asarray(delta_acid_base_list, dtype=np.float64) *
+                   (10 ** (ph_standard - temp_pka) - 10 ** (temp_ph - temp_pka))) / \
+                  ((1 + 10 ** (ph_standard - temp_pka)) * (1 + 10 ** (temp_ph - temp_pka)))
+    delta_shift = np.clip(delta_shift, -0.5, 0.5)
+    return np.round(delta_shift / step_size).astype(np.intp)
+
+
+def get_cluster_points(cluster_array):
+    """
+    (point index, cluster index) of every point of the [start, stop) peak clusters of cluster_array
+    """
+    cluster_array = np.asarray(cluster_array, dtype=np.intp).reshape(-1, 2)
+    lengths = cluster_array[:, 1] - cluster_array[:, 0]
+    cluster_index = np.repeat(np.arange(len(cluster_array)), lengths)
+    # position of every point in its cluster, then its index in the spectrum
+    position = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return cluster_array[cluster_index, 0] + position, cluster_index
+
+
+def get_last_cluster_mask(flat_index):
+    """
+    mask of the last occurrence of every value of flat_index; the points are in cluster order, so a cluster shifted
+    onto an earlier one of the same metabolite overwrites it, as the slice assignment of a single spectrum does
+    """
+    flat_index = np.asarray(flat_index)
+    keep = np.zeros(len(flat_index), dtype=bool)
+    _, last_index = np.unique(flat_index[::-1], return_index=True)
+    keep[len(flat_index) - 1 - last_index] = True
+    return keep
+
+
+def get_mixture_clusters(mixture_list, norm_data_dict, meta_subset_dict, mixture_pka_dict):
+    """
+    the peak clusters of all the metabolites of mixture_list, numbered one after the other:
+    (point index, cluster index, metabolite index, intensity) of every cluster point, and (delta_acid_base, pKa) of
+    every cluster
+    """
+    cluster_list = [np.asarray(meta_subset_dict[meta_name][0], dtype=np.intp).reshape(-1, 2)
+                    for meta_name in mixture_list]
+    point_index, cluster_index = get_cluster_points(np.concatenate(cluster_list) if cluster_list
+                                                    else np.empty((0, 2), dtype=np.intp))
+    num_cluster_array = np.array([len(cluster_array) for cluster_array in cluster_list], dtype=np.intp)
+    meta_index = np.repeat(np.arange(len(mixture_list)), num_cluster_array)[cluster_index]
+
+    library_matrix = np.stack([np.asarray(norm_data_dict[meta_name], dtype=np.float64) for meta_name in mixture_list])
+    intensity = library_matrix[meta_index, point_index]
+    delta_acid_base_array = np.concatenate([np.asarray(meta_subset_dict[meta_name][1], dtype=np.float64)
+                                            for meta_name in mixture_list])
+    pka_array = np.repeat([float(mixture_pka_dict[meta_name]) for meta_name in mixture_list], num_cluster_array)
+    return point_index, cluster_index, meta_index, intensity, delta_acid_base_array, pka_array
+
+
+def shift_mixture_matrix(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict, ph_list,
+                         weight_matrix, smooth_thres=0.05):
+    """
+    (replicates x points) mixture spectra with peak shift, replicate i is at pH ph_list[i] and weight_matrix[i] holds
+    its weights (replicates x metabolites of mixture_list, see mixture_engine.get_weight_matrix)
+    the (pH x clusters) shifts are computed in one go, and the cluster points are scattered to their shifted
+    position; a cluster shifted onto an earlier cluster of the same metabolite overwrites it (see
+    get_last_cluster_mask), the metabolites themselves add up in the weighted sum
+    smooth_thres: the shifted spectrum of every metabolite is smoothed (see smooth_spectra_matrix) before the weighted
+    sum; the smoothing thresholds each spectrum at a fraction of its own maximum, so it is not linear and the
+    shifted (metabolites x points) library is built once per distinct pH (not per replicate) instead of scattering
+    the weighted clusters straight into the mixtures
+    """
+    num_points = len(ppm_scale)
+    weight_matrix = np.asarray(weight_matrix, dtype=np.float64)
     step_size = ppm_scale[0] - ppm_scale[1]
+    point_index, cluster_index, meta_index, intensity, delta_acid_base_array, pka_array = \
+        get_mixture_clusters(mixture_list, norm_data_dict, meta_subset_dict, mixture_pka_dict)
+
+    ph_array, ph_inverse = np.unique(np.asarray(ph_list, dtype=np.float64), return_inverse=True)
+    ph_inverse = ph_inverse.reshape(-1)
+    shift_matrix = get_shift_size_array(delta_acid_base_array[np.newaxis, :], pka_array[np.newaxis, :],
+                                        ph_array[:, np.newaxis], step_size)
+    # (pH x cluster points) shifted positions, the points shifted past either end of the spectrum are dropped
+    dest_index = point_index[np.newaxis, :] - shift_matrix[:, cluster_index]
+    valid = (dest_index >= 0) & (dest_index < num_points)
+
+    sum_matrix = np.empty((len(ph_inverse), num_points))
+    for idx, temp_valid in enumerate(valid):
+        flat_index = meta_index[temp_valid] * num_points + dest_index[idx, temp_valid]
+        keep = get_last_cluster_mask(flat_index)
+        shift_library_matrix = np.zeros((len(mixture_list), num_points))
+        shift_library_matrix.ravel()[flat_index[keep]] = intensity[temp_valid][keep]
+        shift_library_matrix = smooth_spectra_matrix(shift_library_matrix, smooth_thres)
+        # replicates with the same pH and the same weights share one sum
+        repli_index = np.flatnonzero(ph_inverse == idx)
+        unique_weight_matrix, inverse = np.unique(weight_matrix[repli_index], axis=0, return_inverse=True)
+        sum_matrix[repli_index] = (unique_weight_matrix @ shift_library_matrix)[inverse.reshape(-1)]
+    return sum_matrix
 
-    for idx, subset in enumerate(filtered_signal_subset):
-        delta_acid_base = delta_acid_base_list[idx]
-        delta_shift = (delta_acid_base * (10 ** (ph_standard - temp_pka) - 10 ** (temp_ph - temp_pka))) / \
-                      ((1 + 10 ** (ph_standard - temp_pka)) * (1 + 10 ** (temp_ph - temp_pka)))
-            # (delta_acid_base * (10 ** (ph_standard - temp_ph) - 10 ** (temp_ph - temp_pka))) / \
-            #           ((1 + 10 ** (ph_standard - temp_pka)) * (1 + 10 ** (temp_ph - temp_pka)))
-        if abs(delta_shift) > 0.5:
-            if delta_shift > 0:
-                delta_shift = 0.5
-            else:
-                delta_shift = -0.5
-        shift_size = round(delta_shift / step_size)
-        shift_subset = [s - shift_size for s in subset]
-        print("shift_size:", shift_size, "delta_shift:", delta_shift, "step_size:", step_size,
-              "temp_ph:", temp_ph, "temp_pka:", temp_pka, "delta_acid_base:", delta_acid_base)
-        # print(len(shift_subset), shift_subset)
-        # print(len(subset), subset)
-        # print("shift_subset: ", shift_subset, "subset: ", subset)
-        y_shift_list[shift_subset] = y[subset]
-
-    return y_shift_list
-
-
-def construct_shift_data_for_all_repli(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict,
-                                       mixture_pka_dict, cons_ph_table_data, group_flag):
-
-    ph_data_dict = dict()
+
+def get_group_ph_dict(cons_ph_table_data, group_flag):
+    # {repli_name: pH} of the replicates of the group
     all_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
-    group_ph_dict = dict(filter(lambda i: i[0].startswith(group_flag+"_replicate"), all_ph_dict.items()))
-    for repli_name, repli_ph in group_ph_dict.items():
-        shift_data_dict = dict()
-        for meta_name in mixture_list:
-            temp_pka = mixture_pka_dict[meta_name]
-            temp_y = norm_data_dict[meta_name]
-            # print("temp_y: ", temp_y)
-            filtered_signal_subset, delta_acid_base_list = meta_subset_dict[meta_name]
-            print(meta_name)
-            temp_y_shift = calculate_peak_shift(temp_y, ppm_scale, temp_pka, float(repli_ph), filtered_signal_subset,
-                                                delta_acid_base_list)
-            shift_data_dict[meta_name] = temp_y_shift
-        smooth_data_dict = smooth_spectra(shift_data_dict, 0.05)
-        ph_data_dict[repli_name] = smooth_data_dict
-
-    return group_ph_dict, ph_data_dict
-
-
-def construct_shift_data_continuous_for_all_repli(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict,
-                                                  mixture_pka_dict, cons_ph_table_data):
-
-    ph_data_dict = dict()
+    return dict(filter(lambda i: i[0].startswith(group_flag+"_replicate"), all_ph_dict.items()))
+
+
+def get_continuous_ph_dict(cons_ph_table_data):
+    # {repli_name: pH} of all the replicates
     all_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
     temp_ph_dict = all_ph_dict.copy()
     del temp_ph_dict['meta_name']
     del temp_ph_dict['hmdb_id']
-    for repli_name, repli_ph in temp_ph_dict.items():
-        shift_data_dict = dict()
-        for meta_name in mixture_list:
-            temp_pka = mixture_pka_dict[meta_name]
-            temp_y = norm_data_dict[meta_name]
-            filtered_signal_subset, delta_acid_base_list = meta_subset_dict[meta_name]
-            temp_y_shift = calculate_peak_shift(temp_y, ppm_scale, temp_pka, float(repli_ph), filtered_signal_subset,
-                                                delta_acid_base_list)
-            shift_data_dict[meta_name] = temp_y_shift
-        smooth_data_dict = smooth_spectra(shift_data_dict, 0.05)
-        ph_data_dict[repli_name] = smooth_data_dict
-
-    return temp_ph_dict, ph_data_dict
+    return temp_ph_dict
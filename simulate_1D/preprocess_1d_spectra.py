@@ -2,8 +2,16 @@ import pandas as pd
 import numpy as np
 import math
 from scipy import interpolate
-from itertools import groupby
-from operator import itemgetter
+
+
+def get_water_calibration_mask(ppm_scale, range_water, range_calibration):
+    """
+    boolean mask of the ppm values strictly inside the water or the calibration range
+    """
+    ppm_scale = np.asarray(ppm_scale)
+    in_water = (float(range_water[0]) < ppm_scale) & (ppm_scale < float(range_water[1]))
+    in_calibration = (float(range_calibration[0]) < ppm_scale) & (ppm_scale < float(range_calibration[1]))
+    return in_water | in_calibration
 
 
 def remove_water_calibration(data_dict, ppm_scale, range_water, range_calibration):
@@ -11,106 +19,110 @@ def remove_water_calibration(data_dict, ppm_scale, range_water, range_calibratio
     range_water: a sorted tuple/list, e.g. [4.5, 5.0]
     range_calibration: a sorted tuple/list, e.g. [-0.3, 0.3]
     """
-    removed_data_dict = dict()
-
-    for meta_name, data in data_dict.items():
-        temp_df = pd.DataFrame(data)
-        temp_df.index = ppm_scale
+    if not data_dict:
+        return dict()
 
-        for ppm in list(temp_df.index):
-            # range for water suppression is 4.5-5.0
-            if (range_water[0] < ppm < range_water[1]) | (range_calibration[0] < ppm < range_calibration[1]):
-                temp_df.loc[ppm, :] = 0
-        removed_data_dict[meta_name] = np.array(temp_df).ravel()
+    removed_mask = get_water_calibration_mask(ppm_scale, range_water, range_calibration)
+    meta_list = list(data_dict.keys())
+    # stack copies of the spectra (n_metabolites x n_points) and zero both ranges in one step
+    data_matrix = np.array([np.ravel(data_dict[meta_name]) for meta_name in meta_list])
+    data_matrix[:, removed_mask] = 0
 
+    removed_data_dict = dict(zip(meta_list, data_matrix))
     return removed_data_dict
 
 
 # baseline correction
-def baseline_correction(removed_data_dict, bins, thres_perc):
-    corrected_data_dict = dict()
+def baseline_correction_matrix(data_matrix, bins, thres_perc):
+    """
+    baseline correction for every spectrum (row) of data_matrix at once, returns a new matrix
+    the spectra are cut into bins of floor(n_points / bins) points, the bin medians (plus a knot at (0, 0)) are fitted
+    with one cubic spline per spectrum, and the spline values 0, 1, 2, ... are subtracted in order from the points
+    below max * thres_perc
+    """
+    data_matrix = np.asarray(data_matrix)
+    num_spectra, num_points = data_matrix.shape
+    binsize = math.floor(num_points / bins)
+    num_bins = num_points // binsize
 
-    for meta_name, data in removed_data_dict.items():
-        temp_y = data
-        binsize = math.floor(len(temp_y) / bins)
+    bin_medians = np.median(data_matrix[:, :num_bins * binsize].reshape(num_spectra, num_bins, binsize), axis=2)
+    knots_x = np.concatenate(([0], (np.arange(num_bins) + 0.5) * binsize))
+    knots_y = np.concatenate((np.zeros((num_spectra, 1)), bin_medians), axis=1)
+    baseline_matrix = interpolate.CubicSpline(knots_x, knots_y, axis=1)(np.arange(num_points))
 
-        bin_0 = 0
-        bin_1 = binsize
-        bin_median_list = [0, ]
-        x_list = [0, ]
+    threshold = np.max(data_matrix, axis=1) * thres_perc
+    in_threshold_mask = data_matrix < threshold[:, np.newaxis]
+    # the k-th point below the threshold of a spectrum is corrected by the k-th baseline value
+    in_threshold_rank = np.maximum(np.cumsum(in_threshold_mask, axis=1) - 1, 0)
+    baseline_values = np.take_along_axis(baseline_matrix, in_threshold_rank, axis=1)
 
-        while bin_1 <= len(temp_y):
-            temp_bin = temp_y[bin_0:bin_1]
-            temp_median = np.median(temp_bin)
-            temp_x = (bin_0 + bin_1) / 2
-            bin_median_list.append(temp_median)
-            x_list.append(temp_x)
+    corrected_matrix = np.where(in_threshold_mask, data_matrix - baseline_values, data_matrix)
+    return corrected_matrix
 
-            bin_0 = bin_0 + binsize
-            bin_1 = bin_1 + binsize
 
-        threshold = max(temp_y) * thres_perc
-        in_threshold_index_list = list(np.where(temp_y < threshold)[0])
+def baseline_correction(removed_data_dict, bins, thres_perc):
+    if not removed_data_dict:
+        return dict()
 
-        new_y = interpolate.CubicSpline(x_list, bin_median_list)(range(len(in_threshold_index_list)))
-        corrected_y = temp_y[in_threshold_index_list] - new_y
-        temp_y[in_threshold_index_list] = corrected_y
-        corrected_data_dict[meta_name] = temp_y
+    meta_list = list(removed_data_dict.keys())
+    data_matrix = np.array([np.ravel(removed_data_dict[meta_name]) for meta_name in meta_list])
+    corrected_matrix = baseline_correction_matrix(data_matrix, bins, thres_perc)
 
+    corrected_data_dict = dict(zip(meta_list, corrected_matrix))
     return corrected_data_dict
 
 
 # smooth_noises around baseline
+def smooth_spectra_matrix(data_matrix, thres_perc):
+    """
+    smooth every run of consecutive points below max * thres_perc of each spectrum (row) of data_matrix with a moving
+    mean; for a run of length L the half window is round(L/3), shrunk near both ends of the run so the window never
+    leaves the run; the window means are computed from cumulative sums, so the cost is linear in the number of points
+    """
+    data_matrix = np.asarray(data_matrix)
+    num_spectra, num_points = data_matrix.shape
+
+    # flatten with one separator point after each spectrum, so a run never spans two spectra
+    flat_y = np.zeros((num_spectra, num_points + 1))
+    flat_y[:, :num_points] = data_matrix
+    flat_y = flat_y.ravel()
+    threshold = np.max(data_matrix, axis=1) * thres_perc
+    flat_mask = np.zeros((num_spectra, num_points + 1), dtype=bool)
+    flat_mask[:, :num_points] = data_matrix < threshold[:, np.newaxis]
+    flat_mask = flat_mask.ravel()
+
+    run_edges = np.diff(np.concatenate(([0], flat_mask.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(run_edges == 1)
+    run_lengths = np.flatnonzero(run_edges == -1) - run_starts
+    run_windows = (2 * run_lengths + 3) // 6  # round(L / 3), L / 3 is never halfway between two integers
+
+    in_threshold_index = np.flatnonzero(flat_mask)
+    run_index = np.repeat(np.arange(len(run_starts)), run_lengths)
+    position = in_threshold_index - run_starts[run_index]
+    half_window = np.minimum(np.minimum(position, run_lengths[run_index] - 1 - position), run_windows[run_index])
+
+    cum_y = np.concatenate(([0], np.cumsum(np.where(flat_mask, flat_y, 0))))
+    smooth_y = flat_y.copy()
+    smooth_y[in_threshold_index] = (cum_y[in_threshold_index + half_window + 1] -
+                                    cum_y[in_threshold_index - half_window]) / (2 * half_window + 1)
+
+    return smooth_y.reshape(num_spectra, num_points + 1)[:, :num_points]
+
+
 def smooth_each_spectrum(y, thres_perc):
-    temp_y = y.copy()
-    threshold = max(temp_y) * thres_perc
-    in_threshold_index_list = list(np.where(temp_y < threshold)[0])
-
-    temp_smooth_df = pd.DataFrame(temp_y)
-    temp_smooth_df.loc[:, 'smooth_y'] = temp_y
-
-    in_threshold_subset = []
-    for k, g in groupby(enumerate(in_threshold_index_list), lambda ix: ix[0] - ix[1]):
-        in_threshold_subset.append(list(map(itemgetter(1), g)))
-
-    for subset in in_threshold_subset:
-        temp_y_subset = temp_y[subset]
-        temp_smooth_subset = np.zeros(len(temp_y_subset))
-        forward_window_size = round(len(temp_y_subset) / 3)
-
-        for idx, value in enumerate(temp_y_subset):
-            if idx < forward_window_size:
-                start = idx - idx
-                end = idx + idx + 1
-                temp_l = temp_y_subset[start:end]
-                temp_mean = np.mean(temp_l)
-            elif (len(temp_y_subset) - 1 - idx) < forward_window_size:
-                start = idx - (len(temp_y_subset) - 1 - idx)
-                end = idx + (len(temp_y_subset) - 1 - idx) + 1
-                temp_l = temp_y_subset[start:end]
-                temp_mean = np.mean(temp_l)
-            else:
-                start = idx - forward_window_size
-                end = idx + forward_window_size + 1
-                temp_l = temp_y_subset[start:end]
-                temp_mean = np.mean(temp_l)
-
-            temp_smooth_subset[idx] = temp_mean
-
-        temp_smooth_df.loc[subset, 'smooth_y'] = temp_smooth_subset
-
-    smooth_y = np.array(temp_smooth_df['smooth_y']).ravel()
+    smooth_y = smooth_spectra_matrix(np.ravel(y)[np.newaxis, :], thres_perc)[0]
     return smooth_y
 
 
 def smooth_spectra(corrected_data_dict, thres_perc):
-    smooth_data_dict = dict()
+    if not corrected_data_dict:
+        return dict()
 
-    for meta_name, data in corrected_data_dict.items():
-        temp_y = data
-        smooth_y = smooth_each_spectrum(temp_y, thres_perc)
-        smooth_data_dict[meta_name] = smooth_y
+    meta_list = list(corrected_data_dict.keys())
+    data_matrix = np.array([np.ravel(corrected_data_dict[meta_name]) for meta_name in meta_list])
+    smooth_matrix = smooth_spectra_matrix(data_matrix, thres_perc)
 
+    smooth_data_dict = dict(zip(meta_list, smooth_matrix))
     return smooth_data_dict
 
 
@@ -2,12 +2,21 @@ import nPYc
 import pandas as pd
 import numpy as np
 import pathlib
+import hashlib
+import json
+import os
 
+from simulate_1D.match_names import db_names_match_hmdb_names
+from simulate_1D.spectra_library import save_spectra_library, open_spectra_library
 
-def read_1d_data(file_path, sop, pulseProgram):
+# bump this whenever the content of the cache changes
+CACHE_VERSION = 2
+
+
+def read_1d_data(file_path, sop, pulseProgram, variable_size=64000):
     base_path = pathlib.Path(__file__).resolve().parents[1]
     data_path = base_path.joinpath(file_path)
-    nmrData = nPYc.NMRDataset(str(data_path), pulseProgram=pulseProgram, sop=sop, variableSize=64000)
+    nmrData = nPYc.NMRDataset(str(data_path), pulseProgram=pulseProgram, sop=sop, variableSize=variable_size)
 
     ppm_scale = np.array(nmrData.featureMetadata).ravel()
 
@@ -20,3 +29,59 @@ def read_1d_data(file_path, sop, pulseProgram):
     return data_dict, ppm_scale
 
 
+def get_folder_mtime(path):
+    """
+    latest modification time of path and, for a folder, of everything inside it (acqus, pdata/1/..., ...)
+    """
+    mtime = os.stat(path).st_mtime
+    if os.path.isdir(path):
+        for dir_path, dir_names, file_names in os.walk(path):
+            for name in dir_names + file_names:
+                try:
+                    mtime = max(mtime, os.stat(os.path.join(dir_path, name)).st_mtime)
+                except FileNotFoundError:
+                    # broken link or removed in the meantime
+                    pass
+    return mtime
+
+
+def get_hmdb_dict_hash(hmdb_dict):
+    # hash of the HMDB ID -> names content, the matched names depend on both
+    id_names_list = [[idx, list(hmdb_dict[idx])] for idx in sorted(hmdb_dict.keys())]
+    return hashlib.md5(json.dumps(id_names_list).encode("utf-8")).hexdigest()
+
+
+def get_1d_cache_key(data_path, sop, pulseProgram, variable_size, hmdb_dict=None):
+    """
+    the key changes when any Bruker folder is added, removed or modified (any file inside it, see get_folder_mtime), when the nPYc reading parameters change,
+    or when the HMDB IDs or names used for name matching change
+    """
+    folder_mtimes = sorted((entry.name, get_folder_mtime(entry.path)) for entry in os.scandir(str(data_path)))
+    hmdb_hash = get_hmdb_dict_hash(hmdb_dict) if hmdb_dict is not None else None
+    key_dict = {"version": CACHE_VERSION, "sop": sop, "pulseProgram": pulseProgram, "variableSize": variable_size,
+                "folder_mtimes": folder_mtimes, "hmdb_ids": hmdb_hash}
+    return json.dumps(key_dict, sort_keys=True)
+
+
+def read_1d_data_with_cache(file_path, sop, pulseProgram, hmdb_dict=None, variable_size=64000,
+                            cache_dir="Input/cache"):
+    """
+    read 1d data through an on-disk spectra library (see spectra_library.py) holding the raw spectra,
+    the ppm scale and the (matched) metabolite names; the returned data dict is memory-mapped
+    hmdb_dict: if given, only the names matching HMDB names are kept (see db_names_match_hmdb_names)
+    """
+    base_path = pathlib.Path(__file__).resolve().parents[1]
+    data_path = base_path.joinpath(file_path)
+    library_path = base_path.joinpath(cache_dir, data_path.name + "_1d_library")
+    cache_key = get_1d_cache_key(data_path, sop, pulseProgram, variable_size, hmdb_dict)
+
+    library = open_spectra_library(library_path)
+    if library is not None and library.metadata.get("key") == cache_key:
+        return library, np.array(library.metadata["ppm_scale"])
+
+    data_dict, ppm_scale = read_1d_data(file_path, sop, pulseProgram, variable_size)
+    if hmdb_dict is not None:
+        data_dict = db_names_match_hmdb_names(data_dict, hmdb_dict)
+
+    save_spectra_library(data_dict, library_path, {"key": cache_key, "ppm_scale": np.asarray(ppm_scale).tolist()})
+    return open_spectra_library(library_path), ppm_scale
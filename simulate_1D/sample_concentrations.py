@@ -1,64 +1,164 @@
 import pandas as pd
 import numpy as np
+from scipy import special
 import pathlib
+import hashlib
+import threading
+from collections import OrderedDict
 
-# from simulate_1D.construct_hmdb_avg_cons import get_hmdb_normal_avg_cons
-
+from simulate_1D.random_streams import get_seed_sequence, get_rng, get_child_rng
 
-# def pos_normal_no_correlated(mean, std, num_replicates):
-#     x = np.random.normal(mean,std, num_replicates)
-#     if np.all(x>0):
-#         return x
-#     else:
-#         return pos_normal_no_correlated(mean, std, num_replicates)
-
-def pos_normal_no_correlated(mean, std, num_replicates):
-    while True:
-        x = np.random.normal(mean, std, num_replicates)
-        if np.all(x > 0):
-            return x
+# from simulate_1D.construct_hmdb_avg_cons import get_hmdb_normal_avg_cons
 
 
-def pos_normal_correlated(mean_list, cov_df, num_replicates):
-    x = np.random.multivariate_normal(mean_list, cov_df, num_replicates)
-    if np.all(x>0):
-        return x
+def pos_normal_no_correlated(mean, std, num_replicates, rng=None):
+    """
+    num_replicates draws of a normal(mean, std) truncated to x >= 0, sampled element by element by inverse CDF, so
+    the cost is linear in num_replicates whatever the mean (rejecting the whole sample until all draws are positive
+    never ends when mean is close to or below 0)
+    the upper tail is inverted (x = mean - std * ndtri(u * P(Z > -mean/std))), which stays accurate when mean is many
+    std below 0
+    """
+    rng = get_rng(rng)
+    mean = np.broadcast_to(np.asarray(mean, dtype=np.float64), (num_replicates, ))
+    std = np.broadcast_to(np.asarray(std, dtype=np.float64), (num_replicates, ))
+    if np.any(std < 0):
+        raise ValueError("std of a truncated normal must not be negative")
+
+    # u in (0, 1], so u * tail_prob > 0 and ndtri never returns -inf
+    u = 1.0 - rng.random(num_replicates)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tail_prob = special.ndtr(mean / std)
+        x = mean - std * special.ndtri(u * tail_prob)
+    # std = 0: the distribution is a point mass, tail_prob = 0: the mass above 0 underflows, then the sample is the
+    # lower bound
+    x = np.where(std == 0, mean, x)
+    x = np.where(np.isfinite(x), x, 0.0)
+    return np.maximum(x, 0.0)
+
+
+def pos_normal_correlated(mean_list, cov_df, num_replicates, rng=None, max_iter=100, cov_chol=None):
+    """
+    num_replicates draws of a multivariate normal truncated to the positive orthant: only the rows with a
+    non-positive element are drawn again, at most max_iter times; the elements still non-positive after that are
+    replaced by pos_normal_no_correlated draws of their marginal, so the cost is bounded
+    cov_chol: lower Cholesky factor of cov_df (see get_nearest_corr), when given the draws are mean + z @ cov_chol.T and
+    cov_df is not factorized again
+    """
+    rng = get_rng(rng)
+    mean_array = np.asarray(mean_list, dtype=np.float64)
+    if cov_chol is None:
+        cov_array = np.asarray(cov_df, dtype=np.float64)
+        std_array = np.sqrt(np.clip(np.diag(cov_array), 0, None))
+
+        def draw(n):
+            return rng.multivariate_normal(mean_array, cov_array, n)
     else:
-        return pos_normal_correlated(mean_list, cov_df, num_replicates)
+        cov_chol = np.asarray(cov_chol, dtype=np.float64)
+        std_array = np.sqrt(np.sum(cov_chol ** 2, axis=1))
 
+        def draw(n):
+            return mean_array + rng.standard_normal((n, mean_array.size)) @ cov_chol.T
 
-def _getAplus(A):
-    eigval, eigvec = np.linalg.eig(A)
-    Q = np.matrix(eigvec)
-    xdiag = np.matrix(np.diag(np.maximum(eigval, 0)))
-    return Q*xdiag*Q.T
-
-
-def _getPs(A, W=None):
-    W05 = np.matrix(W**.5)
-    return  W05.I * _getAplus(W05 * A * W05) * W05.I
-
+    x = draw(num_replicates)
+    bad_rows = np.flatnonzero(np.any(x <= 0, axis=1))
+    for _ in range(max_iter):
+        if bad_rows.size == 0:
+            return x
+        x[bad_rows] = draw(bad_rows.size)
+        bad_rows = bad_rows[np.any(x[bad_rows] <= 0, axis=1)]
 
-def _getPu(A, W=None):
-    Aret = np.array(A.copy())
-    Aret[W > 0] = np.array(W)[W > 0]
-    return np.matrix(Aret)
+    if bad_rows.size:
+        bad_row_index, bad_col_index = np.nonzero(x[bad_rows] <= 0)
+        x[bad_rows[bad_row_index], bad_col_index] = pos_normal_no_correlated(
+            mean_array[bad_col_index], std_array[bad_col_index], bad_col_index.size, rng)
+    return x
 
 
-def nearPD(A, nit=10):
-    n = A.shape[0]
-    W = np.identity(n)
-    deltaS = 0
-    Yk = A.copy()
+def _getAplus(A):
+    # projection onto the positive semidefinite matrices, A is symmetric so eigh (real eigenvalues) is enough
+    eigval, eigvec = np.linalg.eigh(A)
+    return (eigvec * np.maximum(eigval, 0)) @ eigvec.T
+
+
+def _getPu(A):
+    # projection onto the matrices with a unit diagonal
+    Aret = A.copy()
+    np.fill_diagonal(Aret, 1)
+    return Aret
+
+
+def nearPD(A, nit=100, tol=1e-8):
+    """
+    nearest correlation matrix of A (Higham 2002, alternating projections with Dykstra's correction, W = I)
+    the iterations stop when Yk moves by less than tol (relative Frobenius norm) or after nit iterations
+    """
+    Yk = np.array(A, dtype=np.float64)
+    Yk = (Yk + Yk.T) / 2
+    deltaS = np.zeros_like(Yk)
     for k in range(nit):
         Rk = Yk - deltaS
-        Xk = _getPs(Rk, W=W)
+        Xk = _getAplus(Rk)
         deltaS = Xk - Rk
-        Yk = _getPu(Xk, W=W)
-    return np.array(Yk)
-
-
-def simulate_concentrations(table_rows, num_replicates, correlated_flag, corr_df, group_flag):
+        Yk_next = _getPu(Xk)
+        converged = np.linalg.norm(Yk_next - Yk) <= tol * np.linalg.norm(Yk_next)
+        Yk = Yk_next
+        if converged:
+            break
+    return Yk
+
+
+def get_cholesky(A, max_jitter=1e-4):
+    """
+    lower Cholesky factor of the positive semidefinite matrix A, a growing multiple of the identity is added when A
+    is singular (nearPD lands on the boundary of the PSD cone whenever the input is not PSD)
+    """
+    jitter = 0.0
+    while True:
+        try:
+            return np.linalg.cholesky(A + jitter * np.identity(A.shape[0]))
+        except np.linalg.LinAlgError:
+            if jitter >= max_jitter:
+                raise
+            jitter = 1e-12 if jitter == 0 else jitter * 10
+
+
+NEAREST_CORR_CACHE_SIZE = 32
+_nearest_corr_cache = OrderedDict()
+_nearest_corr_lock = threading.Lock()
+
+
+def get_nearest_corr(corr_array, nit=100, tol=1e-8):
+    """
+    (nearest correlation matrix, its lower Cholesky factor) of corr_array, see nearPD and get_cholesky
+    the results of the last NEAREST_CORR_CACHE_SIZE matrices are kept in an LRU cache keyed by a hash of the matrix, so
+    simulating again with the same correlation file skips the eigendecompositions; the returned arrays are read-only
+    """
+    corr_array = np.ascontiguousarray(corr_array, dtype=np.float64)
+    key = (hashlib.md5(corr_array.tobytes()).hexdigest(), corr_array.shape, nit, tol)
+    with _nearest_corr_lock:
+        if key in _nearest_corr_cache:
+            _nearest_corr_cache.move_to_end(key)
+            return _nearest_corr_cache[key]
+
+    nearest_corr_array = nearPD(corr_array, nit=nit, tol=tol)
+    corr_chol = get_cholesky(nearest_corr_array)
+    nearest_corr_array.setflags(write=False)
+    corr_chol.setflags(write=False)
+
+    with _nearest_corr_lock:
+        _nearest_corr_cache[key] = (nearest_corr_array, corr_chol)
+        while len(_nearest_corr_cache) > NEAREST_CORR_CACHE_SIZE:
+            _nearest_corr_cache.popitem(last=False)
+    return nearest_corr_array, corr_chol
+
+
+def simulate_concentrations(table_rows, num_replicates, correlated_flag, corr_df, group_flag, seed=None):
+    """
+    seed: see random_streams.get_seed_sequence, every metabolite (and the correlated block) of the group gets its own
+    random stream
+    """
+    seed = get_seed_sequence(seed)
     if corr_df is None:
         correlated_flag = False
 
@@ -77,16 +177,21 @@ def simulate_concentrations(table_rows, num_replicates, correlated_flag, corr_df
             std_list.append(avg_std)
 
         # find the nearest correlation matrix
-        nearest_corr_array = nearPD(np.array(corr_df), nit=10)
-        cov_df = np.diag(std_list) * nearest_corr_array * np.diag(std_list)
-        meta_cons_array = np.round(pos_normal_correlated(mean_list, cov_df, num_replicates), decimals=2).T
+        nearest_corr_array, corr_chol = get_nearest_corr(np.array(corr_df, dtype=np.float64))
+        std_array = np.array(std_list)
+        cov_df = std_array[:, np.newaxis] * nearest_corr_array * std_array[np.newaxis, :]
+        cov_chol = std_array[:, np.newaxis] * corr_chol
+        corr_rng = get_child_rng(seed, "concentration", group_flag, "correlated")
+        meta_cons_array = np.round(pos_normal_correlated(mean_list, cov_df, num_replicates, corr_rng,
+                                                         cov_chol=cov_chol), decimals=2).T
         cons_dict = dict(zip(corr_metabolites, meta_cons_array))
 
         for meta_name in not_corr_metabolites:
             temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, table_rows))[0]
             avg_mean = float(temp_dict["mean_" + group_flag])
             avg_std = float(temp_dict["std_" + group_flag])
-            sampled_cons = np.round(pos_normal_no_correlated(avg_mean, avg_std, num_replicates), decimals=2)
+            meta_rng = get_child_rng(seed, "concentration", group_flag, meta_name)
+            sampled_cons = np.round(pos_normal_no_correlated(avg_mean, avg_std, num_replicates, meta_rng), decimals=2)
             cons_dict[meta_name] = np.array(sampled_cons)
 
     else:
@@ -96,7 +201,8 @@ def simulate_concentrations(table_rows, num_replicates, correlated_flag, corr_df
             temp_dict = list(filter(lambda d: d['meta_name'] == meta_name, table_rows))[0]
             avg_mean = float(temp_dict["mean_"+group_flag])
             avg_std = float(temp_dict["std_"+group_flag])
-            sampled_cons = np.round(pos_normal_no_correlated(avg_mean, avg_std, num_replicates), decimals=2)
+            meta_rng = get_child_rng(seed, "concentration", group_flag, meta_name)
+            sampled_cons = np.round(pos_normal_no_correlated(avg_mean, avg_std, num_replicates, meta_rng), decimals=2)
             cons_dict[meta_name] = np.array(sampled_cons)
 
     cons_df = pd.DataFrame.from_dict(cons_dict, orient='index')
@@ -105,7 +211,8 @@ def simulate_concentrations(table_rows, num_replicates, correlated_flag, corr_df
     return cons_df
 
 
-def simulate_continuous_concentrations(table_rows, y_num_repli, sample_y):
+def simulate_continuous_concentrations(table_rows, y_num_repli, sample_y, seed=None):
+    seed = get_seed_sequence(seed)
     cons_dict_list = []
     y_sample_mean = np.mean(sample_y)
     y_sample_std = np.mean(sample_y)
@@ -113,7 +220,8 @@ def simulate_continuous_concentrations(table_rows, y_num_repli, sample_y):
     meta_with_y_list = list(filter(lambda dic: float(dic["a"]) != 0, table_rows))
     meta_not_y_list = list(filter(lambda dic: float(dic["a"]) == 0, table_rows))
     for d in meta_with_y_list:
-        random_error = np.random.normal(0, float(d["std_error"]), y_num_repli)
+        error_rng = get_child_rng(seed, "random_error", d["meta_name"])
+        random_error = error_rng.normal(0, float(d["std_error"]), y_num_repli)
         print("!!!! random error:", random_error)
         x_mean = float(d["mean"])
         x_std = float(d["std"])
@@ -128,7 +236,8 @@ def simulate_continuous_concentrations(table_rows, y_num_repli, sample_y):
         cons_dict_list.append(temp_dict)
 
     for di in meta_not_y_list:
-        sampled_cons = np.round(pos_normal_no_correlated(float(di["mean"]), float(di["std"]), y_num_repli), 2)
+        meta_rng = get_child_rng(seed, "concentration", di["meta_name"])
+        sampled_cons = np.round(pos_normal_no_correlated(float(di["mean"]), float(di["std"]), y_num_repli, meta_rng), 2)
         temp_dict = dict({"meta_name": di["meta_name"], "hmdb_id": di["hmdb_id"]},
                          **dict(zip(["replicate_{}".format(i + 1) for i in range(y_num_repli)], sampled_cons)))
         cons_dict_list.append(temp_dict)
@@ -0,0 +1,109 @@
+import numpy as np
+import pathlib
+import json
+import os
+from collections.abc import Mapping
+
+# bump this whenever the layout of the library files changes
+LIBRARY_VERSION = 1
+
+
+class SpectraLibrary(Mapping):
+    """
+    read-only dict of metabolite name -> spectrum, backed by one memory-mapped .npy file
+    spectra are stored metabolite by metabolite, so each spectrum is one contiguous block of the file and only the
+    pages of the metabolites actually used are read; worker processes share those pages through the OS cache
+    library_path: where the library was opened from, the caches derived from it (e.g. the peak clusters) are kept
+    next to it
+    """
+    def __init__(self, matrix, name_row_dict, metadata=None, library_path=None):
+        self.matrix = matrix
+        self.name_row_dict = name_row_dict
+        self.metadata = metadata if metadata is not None else dict()
+        self.library_path = pathlib.Path(library_path) if library_path is not None else None
+
+    def __getitem__(self, meta_name):
+        return self.matrix[self.name_row_dict[meta_name]]
+
+    def __iter__(self):
+        return iter(self.name_row_dict)
+
+    def __len__(self):
+        return len(self.name_row_dict)
+
+    def __contains__(self, meta_name):
+        return meta_name in self.name_row_dict
+
+
+def get_library_files(library_path):
+    library_path = pathlib.Path(library_path)
+    return library_path.with_name(library_path.name + ".npy"), library_path.with_name(library_path.name + ".json")
+
+
+def save_spectra_library(data_dict, library_path, metadata=None):
+    """
+    write data_dict as <library_path>.npy (all spectra stacked in one array) and <library_path>.json
+    (name -> row index, shape, dtype and any extra metadata)
+    """
+    data_file, index_file = get_library_files(library_path)
+    data_file.parent.mkdir(parents=True, exist_ok=True)
+
+    name_list = list(data_dict.keys())
+    if name_list:
+        first_data = np.asarray(data_dict[name_list[0]])
+        spectrum_shape, dtype = first_data.shape, first_data.dtype
+    else:
+        spectrum_shape, dtype = (0, ), np.dtype(np.float64)
+
+    temp_data_file = data_file.with_suffix(".npy.tmp")
+    matrix = np.lib.format.open_memmap(str(temp_data_file), mode="w+", dtype=dtype,
+                                       shape=(len(name_list), ) + tuple(spectrum_shape))
+    for idx, meta_name in enumerate(name_list):
+        data = np.asarray(data_dict[meta_name])
+        if data.shape != tuple(spectrum_shape):
+            del matrix
+            os.remove(str(temp_data_file))
+            raise ValueError("all spectra in a library must have the same shape, {} has {} instead of {}".format(
+                meta_name, data.shape, tuple(spectrum_shape)))
+        matrix[idx] = data
+    matrix.flush()
+    del matrix
+
+    index_dict = {
+        "version": LIBRARY_VERSION,
+        "names": {meta_name: idx for idx, meta_name in enumerate(name_list)},
+        "shape": [len(name_list)] + list(spectrum_shape),
+        "dtype": np.dtype(dtype).str,
+        "metadata": metadata if metadata is not None else dict(),
+    }
+    temp_index_file = index_file.with_suffix(".json.tmp")
+    with open(str(temp_index_file), "w") as f:
+        json.dump(index_dict, f)
+
+    # the index is replaced last, so a reader never sees an index pointing to a partially written array
+    os.replace(str(temp_data_file), str(data_file))
+    os.replace(str(temp_index_file), str(index_file))
+
+
+def open_spectra_library(library_path):
+    """
+    open a library written by save_spectra_library, returns None if it does not exist or is not readable
+    """
+    data_file, index_file = get_library_files(library_path)
+    if not (data_file.exists() and index_file.exists()):
+        return None
+
+    try:
+        with open(str(index_file)) as f:
+            index_dict = json.load(f)
+        if index_dict.get("version") != LIBRARY_VERSION:
+            return None
+        matrix = np.load(str(data_file), mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print("ignore unreadable spectra library {}: {}".format(library_path, e))
+        return None
+
+    if list(matrix.shape) != index_dict["shape"]:
+        return None
+
+    return SpectraLibrary(matrix, index_dict["names"], index_dict["metadata"], library_path)
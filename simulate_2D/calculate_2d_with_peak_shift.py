@@ -1,38 +1,21 @@
 import pandas as pd
 import numpy as np
 
-from simulate_2D.peak_shift_2d import construct_shift_data_for_all_repli, construct_shift_data_continuous_for_all_repli
-
-
-def sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict, cons_table_rows, protons_df, snr):
-    sum_data = 0
-    for meta_name in mixture_list:
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[repli_name])
-        temp_protons = 1
-            # int(protons_df.loc[meta_name, "number"])
-        temp_data = np.array(shift_data_dict[meta_name])
-
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
-
-    # max_level = np.max(np.array(sum_data))
-    # noise = np.random.normal(0, max_level / snr, sum_data.shape)
-    #
-    # sum_data = sum_data + noise
-
-    return sum_data
+from simulate_2D.peak_shift_2d import shift_mixture_sparse, get_group_ph_dict, get_continuous_ph_dict
+from simulate_2D.mixture_engine import get_weight_matrix
+from simulate_2D.sparse_spectra import to_dense
 
 
 def simulate_mixture_with_peak_shift_for_all_repli(mixture_list, x_scale, norm_data_dict, meta_subset_dict,
                                                    mixture_pka_dict, cons_ph_table_data,
                                                    group_flag, protons_df, snr):
     replicate_dict = dict()
-    group_ph_dict, ph_data_dict = construct_shift_data_for_all_repli(mixture_list, x_scale, norm_data_dict, meta_subset_dict,
-                                       mixture_pka_dict, cons_ph_table_data, group_flag)
-    for repli_name, shift_data_dict in ph_data_dict.items():
-        temp_sum_data = sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict,
-                                                   cons_ph_table_data, protons_df, snr)
+    group_ph_dict = get_group_ph_dict(cons_ph_table_data, group_flag)
+    # every metabolite counts as one proton here
+    weight_matrix = get_weight_matrix(dict.fromkeys(mixture_list), cons_ph_table_data, list(group_ph_dict.keys()))
+    sum_data_list = shift_mixture_sparse(mixture_list, x_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict,
+                                         list(group_ph_dict.values()), weight_matrix)
+    for repli_name, temp_sum_data in zip(group_ph_dict.keys(), sum_data_list):
         repli_ph = group_ph_dict[repli_name]
         replicate_dict[repli_name.lstrip(group_flag+"_")] = [repli_ph, temp_sum_data]
     # replicate_dict["replicate_mean"] = np.mean(list(map(lambda x: x[1], replicate_dict.values())), axis=0)
@@ -46,7 +29,7 @@ def get_shift_p_jres_for_all_repli(replicate_dict):
     for n in range(num_replicates):
         temp_repli = 'replicate_' + str(n + 1)
         str_ph, data = replicate_dict[temp_repli]
-        temp_data = np.array(data)
+        temp_data = to_dense(data)
         shift_p_jres_scale = np.zeros(temp_data.shape[1])
         for i in range(temp_data.shape[1]):
             temp_y = max(temp_data[:, i])
@@ -59,11 +42,11 @@ def get_shift_p_jres_for_all_repli(replicate_dict):
 def simulate_mixture_continuous_with_peak_shift_for_all_repli(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict,
                                                    mixture_pka_dict, cons_ph_table_data, protons_df, snr):
     replicate_dict = dict()
-    conti_ph_dict, ph_data_dict = construct_shift_data_continuous_for_all_repli(mixture_list, ppm_scale, norm_data_dict,
-                                                            meta_subset_dict, mixture_pka_dict, cons_ph_table_data)
-    for repli_name, shift_data_dict in ph_data_dict.items():
-        temp_sum_data = sum_mixture_for_each_repli(repli_name, mixture_list, shift_data_dict, cons_ph_table_data,
-                                                   protons_df, snr)
+    conti_ph_dict = get_continuous_ph_dict(cons_ph_table_data)
+    weight_matrix = get_weight_matrix(dict.fromkeys(mixture_list), cons_ph_table_data, list(conti_ph_dict.keys()))
+    sum_data_list = shift_mixture_sparse(mixture_list, ppm_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict,
+                                         list(conti_ph_dict.values()), weight_matrix)
+    for repli_name, temp_sum_data in zip(conti_ph_dict.keys(), sum_data_list):
         repli_ph = conti_ph_dict[repli_name]
         replicate_dict[repli_name] = [repli_ph, temp_sum_data]
 
@@ -1,20 +1,13 @@
 import numpy as np
 
+from simulate_2D.mixture_engine import simulate_mixture_matrix
+
 
 # -------------------------- group mixture for cosy --------------------------
 def sum_cosy_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag):
     # print(format_norm_data_dict)
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[group_flag + "_replicate_" + str(n + 1)])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(format_norm_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+    sum_data = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows,
+                                       [group_flag + "_replicate_" + str(n + 1)], protons_df)[0]
 
     # max_level = np.max(np.array(sum_data))
     # noise = np.random.normal(0, max_level / snr, sum_data.shape)
@@ -25,11 +18,12 @@ def sum_cosy_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons
 
 
 def simulate_cosy_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag):
+    repli_name_list = [group_flag + "_replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_data_list = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows, repli_name_list,
+                                            protons_df)
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = sum_cosy_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag)
-        # print(temp_sum_data.shape)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = sum_data_list[n]
 
     mean_repli_data = sum(replicate_dict.values()) / num_replicates
     replicate_dict["replicate_mean"] = mean_repli_data
@@ -40,17 +34,8 @@ def simulate_cosy_mixture_for_all_repli(num_replicates, mixture_dict, format_nor
 # -------------------------- continuous mixture for cosy --------------------------
 def conti_sum_cosy_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr):
 
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict["replicate_"+str(n+1)])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(format_norm_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+    sum_data = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows,
+                                       ["replicate_"+str(n+1)], protons_df)[0]
     # # add noise, SNR = 1000
     # noise_std = max(sum_data) / snr
     # print(noise_std, len(sum_data))
@@ -64,11 +49,12 @@ def conti_sum_cosy_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict
 
 def simulate_continuous_cosy_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict,
                                               cons_table_rows, protons_df, snr):
+    repli_name_list = ["replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_data_list = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows, repli_name_list,
+                                            protons_df)
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = conti_sum_cosy_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict,
-                                                              cons_table_rows, protons_df, snr)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = sum_data_list[n]
 
     return replicate_dict
 
@@ -76,21 +62,8 @@ def simulate_continuous_cosy_mixture_for_all_repli(num_replicates, mixture_dict,
 # ----------------------------------- mixture for JRes ---------------------------------
 def sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag):
     # print(format_norm_data_dict)
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict[group_flag + "_replicate_" + str(n + 1)])
-        # temp_protons = 1
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(format_norm_data_dict[meta_name])
-
-        # print(temp_data.shape, temp_cons, temp_protons)
-
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+    sum_data = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows,
+                                       [group_flag + "_replicate_" + str(n + 1)], protons_df)[0]
 
     # max_level = np.max(np.array(sum_data))
     # noise = np.random.normal(0, max_level / snr, sum_data.shape)
@@ -99,12 +72,17 @@ def sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_tabl
     return sum_data
 
 
-def simulate_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag):
+def simulate_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag,
+                                   progress=None):
+    """
+    progress: optional callable reporting the fraction of the replicates done, see simulate_mixture_matrix
+    """
+    repli_name_list = [group_flag + "_replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_data_list = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows, repli_name_list,
+                                            protons_df, progress)
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr, group_flag)
-        # print(temp_sum_data.shape)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = sum_data_list[n]
 
     mean_repli_data = sum(replicate_dict.values()) / num_replicates
     replicate_dict["replicate_mean"] = mean_repli_data
@@ -113,18 +91,8 @@ def simulate_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_dat
 
 
 def conti_sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, cons_table_rows, protons_df, snr):
-    sum_data = 0
-    for meta_name, hmdb_id in mixture_dict.items():
-        temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
-        temp_cons = float(temp_dict["replicate_"+str(n+1)])
-        try:
-            temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        except:
-            temp_protons = 1
-        temp_data = np.array(format_norm_data_dict[meta_name])
-
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+    sum_data = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows,
+                                       ["replicate_"+str(n+1)], protons_df)[0]
 
     # # add noise, SNR = 1000
     # noise_std = max(sum_data) / snr
@@ -143,11 +111,12 @@ def conti_sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict, con
 
 def simulate_continuous_mixture_for_all_repli(num_replicates, mixture_dict, format_norm_data_dict,
                                               cons_table_rows, protons_df, snr):
+    repli_name_list = ["replicate_" + str(n + 1) for n in range(num_replicates)]
+    sum_data_list = simulate_mixture_matrix(mixture_dict, format_norm_data_dict, cons_table_rows, repli_name_list,
+                                            protons_df)
     replicate_dict = dict()
     for n in range(num_replicates):
-        temp_sum_data = conti_sum_mixture_for_each_repli(n, mixture_dict, format_norm_data_dict,
-                                                         cons_table_rows, protons_df, snr)
-        replicate_dict['replicate_' + str(n + 1)] = temp_sum_data
+        replicate_dict['replicate_' + str(n + 1)] = sum_data_list[n]
 
     # mean_repli_data = sum(replicate_dict.values()) / num_replicates
     # replicate_dict["replicate_mean"] = mean_repli_data
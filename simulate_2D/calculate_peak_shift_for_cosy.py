@@ -10,72 +10,74 @@ import plotly.graph_objects as go
 from scipy.signal import convolve2d
 from scipy.stats import truncnorm
 from scipy.signal import find_peaks
-from itertools import groupby
-from operator import itemgetter
 import matplotlib.pyplot as plt
 import copy
 
+from simulate_2D.sparse_spectra import to_dense, to_sparse, sum_sparse_spectra
+from simulate_2D.peak_detection_2d import get_peak_clusters, get_peak_cluster_index, get_peak_cluster_index_dict, \
+    get_peak_cluster_cache_file, sample_delta_acid_base
+from simulate_2D.peak_shift_2d import get_shift_size_array, get_shift_slices
+from simulate_2D.random_streams import get_seed_sequence, get_rng, get_child_seed_sequence, get_child_rng
+
+# the peak clusters of a COSY spectrum are the ones of its F1 projection, with peaks higher than
+# COSY_PEAK_HEIGHT_THRES * max and more than COSY_CLUSTER_MIN_WIDTH points
+COSY_PEAK_HEIGHT_THRES = 0.05
+COSY_CLUSTER_MIN_WIDTH = 3
+
 
 def get_projection_f1(matrix):
-    p_f1 = []
-    for i in range(matrix.shape[1]):
-        p = np.max(matrix[i, :])
-        p_f1.append(p)
-    return p_f1
-
-
-def peak_cluster_detection(y, find_peak_thres):
-    # find multiplets width
-    signals = np.zeros(len(y))
-    mean = np.mean(y)
-    for idx, value in enumerate(y):
-        if value > mean:
-            signals[idx] = 1
-        else:
-            signals[idx] = 0
-
-    signal_index_list = np.where(signals == 1)[0]
-    signal_width_subset = []
-    for k, g in groupby(enumerate(signal_index_list), lambda ix: ix[0] - ix[1]):
-        signal_width_subset.append(list(map(itemgetter(1), g)))
-
-    # check signal width subsets
+    # maximum of every row (the COSY spectra are square)
+    matrix = np.asarray(matrix)
+    return np.max(matrix[:matrix.shape[1], :], axis=1)
+
+
+def get_spectrum_projection_f1(data):
+    # get_projection_f1 of a dense or sparse spectrum
+    return get_projection_f1(to_dense(data))
+
+
+def get_cosy_peak_cluster_cache_file(library, preprocess_params):
+    """
+    the file of the COSY peak clusters of library preprocessed with preprocess_params, see
+    peak_detection_2d.get_peak_cluster_cache_file
+    """
+    return get_peak_cluster_cache_file(library, preprocess_params, COSY_PEAK_HEIGHT_THRES, COSY_CLUSTER_MIN_WIDTH)
+
+
+def get_cosy_peak_cluster_index_dict(mixture_list, norm_data_dict, cache_file=None):
+    """
+    {meta_name: cluster_array} of the F1 projections of the mixture, stored in cache_file if given (see
+    get_cosy_peak_cluster_cache_file and peak_detection_2d.get_peak_cluster_index_dict)
+    """
+    return get_peak_cluster_index_dict(mixture_list, norm_data_dict, cache_file, COSY_PEAK_HEIGHT_THRES,
+                                       COSY_CLUSTER_MIN_WIDTH, projection=get_spectrum_projection_f1)
+
+
+def peak_cluster_detection(y, find_peak_thres, rng=None):
     # find peaks
-    peaks_index_list, _ = find_peaks(y, height=max(y) * find_peak_thres)
-    filtered_signal_subset = []
-    for subset in signal_width_subset:
-        if bool(set(peaks_index_list) & set(subset)) and len(subset) > 3:
-            filtered_signal_subset.append(subset)
+    peaks_index_list, _ = find_peaks(y, height=np.max(y) * find_peak_thres)
+
+    # find multiplets width, clusters of 3 points or less are left out
+    cluster_array = get_peak_clusters(y, peaks_index_list, min_width=3)
 
     # sample delta_acid_base for each peak cluster
-    delta_acid_base_list = np.random.normal(-0.118, 0.204, len(filtered_signal_subset))
+    delta_acid_base_list = sample_delta_acid_base(len(cluster_array), rng)
 
-    return peaks_index_list, filtered_signal_subset, delta_acid_base_list
+    return peaks_index_list, cluster_array, delta_acid_base_list
 
 
-def calculate_peak_shift(x_scale, temp_pka, temp_ph, filtered_signal_subset, delta_acid_base_list):
-    ph_standard = 7.4
+def calculate_peak_shift(x_scale, temp_pka, temp_ph, cluster_array, delta_acid_base_list):
+    """
+    [shift_size, source slice, destination slice] of every peak cluster, see peak_shift_2d.get_shift_slices; the
+    clusters shifted out of the spectrum are left out
+    """
     step_size = x_scale[0] - x_scale[1]
+    shift_size_array = get_shift_size_array(delta_acid_base_list, temp_pka, temp_ph, step_size)
     shift_subset_list = []
-
-    for idx, subset in enumerate(filtered_signal_subset):
-        delta_acid_base = delta_acid_base_list[idx]
-        delta_shift = (delta_acid_base * (10 ** (ph_standard - temp_pka) - 10 ** (temp_ph - temp_pka))) / \
-                      ((1 + 10 ** (ph_standard - temp_pka)) * (1 + 10 ** (temp_ph - temp_pka)))
-        if abs(delta_shift) > 0.5:
-            if delta_shift > 0:
-                delta_shift = 0.5
-            else:
-                delta_shift = -0.5
-        shift_size = round(delta_shift / step_size)
-        # shift_size = -100
-        shift_subset = [s - shift_size for s in subset]
-        print(subset, shift_subset)
-        print("shift_size:", shift_size, "delta_shift:", delta_shift, "step_size:", step_size,
-              "temp_ph:", temp_ph, "temp_pka:", temp_pka, "delta_acid_base:", delta_acid_base)
-        print()
-
-        shift_subset_list.append([shift_size, subset, shift_subset])
+    for (start, stop), shift_size in zip(cluster_array, shift_size_array):
+        shift_slices = get_shift_slices(int(start), int(stop), int(shift_size), len(x_scale))
+        if shift_slices is not None:
+            shift_subset_list.append([int(shift_size), shift_slices[0], shift_slices[1]])
 
     return shift_subset_list
 
@@ -104,38 +106,52 @@ def modified_shift_on_f1(shifted_temp_data, shift_subset_list):
     return empty_data
 
 
-def get_shifted_data_for_pure_compounds(meta, norm_data_dict, x_scale, temp_pka, temp_ph):
-    temp_data = np.array(norm_data_dict[meta])
-    temp_p_f1 = get_projection_f1(temp_data)
-
-    peaks_index_list, filtered_signal_subset, delta_acid_base_list = peak_cluster_detection(temp_p_f1, 0.05)
-    shifted_subset = calculate_peak_shift(x_scale, temp_pka, temp_ph, filtered_signal_subset, delta_acid_base_list)
-
-    temp_data_copy = copy.deepcopy(temp_data)
-    shifted_data_on_f2 = modified_shift_on_f2(temp_data_copy, shifted_subset)
+def get_shifted_data_for_pure_compounds(meta, norm_data_dict, x_scale, temp_pka, temp_ph, rng=None,
+                                        cluster_array=None):
+    """
+    cluster_array: the peak clusters of the metabolite (see get_cosy_peak_cluster_index_dict), detected here if not
+    given; only delta_acid_base is drawn for every replicate
+    """
+    temp_data = to_dense(norm_data_dict[meta])
+    if cluster_array is None:
+        # the same clusters as peak_cluster_detection(temp_p_f1, 0.05)
+        cluster_array = get_peak_cluster_index(get_projection_f1(temp_data), COSY_PEAK_HEIGHT_THRES,
+                                               COSY_CLUSTER_MIN_WIDTH)
+    delta_acid_base_list = sample_delta_acid_base(len(cluster_array), rng)
+    shifted_subset = calculate_peak_shift(x_scale, temp_pka, temp_ph, cluster_array, delta_acid_base_list)
+
+    shifted_data_on_f2 = modified_shift_on_f2(temp_data, shifted_subset)
     final_shifted_data = modified_shift_on_f1(shifted_data_on_f2, shifted_subset)
 
     return final_shifted_data
 
 
-def get_shifted_data_for_each_replicate(mixture_list, norm_data_dict, x_scale, mixture_pka_dict, temp_ph):
+def get_shifted_data_for_each_replicate(mixture_list, norm_data_dict, x_scale, mixture_pka_dict, temp_ph, seed=None,
+                                        meta_cluster_dict=None):
+    """
+    seed: see random_streams.get_seed_sequence, delta_acid_base of each metabolite is drawn from its own stream
+    meta_cluster_dict: see get_cosy_peak_cluster_index_dict, the clusters are detected here if not given
+    """
+    seed = get_seed_sequence(seed)
     shifted_data_dict = dict()
     for meta_name in mixture_list:
         temp_pka = mixture_pka_dict[meta_name]
-        shift_data = get_shifted_data_for_pure_compounds(meta_name, norm_data_dict, x_scale, temp_pka, temp_ph)
-        shifted_data_dict[meta_name] = np.array(shift_data)
+        cluster_array = meta_cluster_dict[meta_name] if meta_cluster_dict is not None else None
+        shift_data = get_shifted_data_for_pure_compounds(meta_name, norm_data_dict, x_scale, temp_pka, temp_ph,
+                                                         get_child_rng(seed, meta_name), cluster_array)
+        # only the non-zero points of the shifted spectra are kept for the mixture sums
+        shifted_data_dict[meta_name] = to_sparse(shift_data)
     return shifted_data_dict
 
 
 def sum_mixture_data_for_each_replicate(repli_name, mixture_dict, shift_data_dict, cons_table_rows, protons_df, snr):
-    sum_data = 0
+    weight_data_list = []
     for meta_name, hmdb_id in mixture_dict.items():
         temp_dict = list(filter(lambda t: t['meta_name'] == meta_name, cons_table_rows))[0]
         temp_cons = float(temp_dict[repli_name])
         temp_protons = int(protons_df.loc[hmdb_id, "number_of_protons"])
-        temp_data = np.array(shift_data_dict[meta_name])
-        temp_intensity = temp_data * temp_cons * temp_protons
-        sum_data = sum_data + temp_intensity
+        weight_data_list.append((temp_cons * temp_protons, shift_data_dict[meta_name]))
+    sum_data = sum_sparse_spectra(weight_data_list)
 
     # max_level = np.max(np.array(sum_data))
     # noise = np.random.normal(0, max_level / snr, sum_data.shape)
@@ -146,23 +162,40 @@ def sum_mixture_data_for_each_replicate(repli_name, mixture_dict, shift_data_dic
 
 # ------------------------------ shift data for group -------------------------------
 def get_shifted_data_for_all_replicates(group_flag, group_repli_ph_dict, mixture_list, norm_data_dict, x_scale,
-                                        mixture_pka_dict):
+                                        mixture_pka_dict, seed=None, progress=None, cluster_cache_file=None):
+    """
+    progress: optional callable, called with the fraction of the replicates shifted after each replicate
+    cluster_cache_file: see get_cosy_peak_cluster_cache_file, the peak clusters are detected once for all the
+    replicates, and not at all if they are stored there
+    """
+    seed = get_seed_sequence(seed)
+    meta_cluster_dict = get_cosy_peak_cluster_index_dict(mixture_list, norm_data_dict, cluster_cache_file)
 
     group_ph_dict = dict(filter(lambda i: i[0].startswith(group_flag + "_replicate"), group_repli_ph_dict.items()))
     group_shifted_data_dict = dict()
-    for repli_name, repli_ph in group_ph_dict.items():
+    for idx, (repli_name, repli_ph) in enumerate(group_ph_dict.items()):
         temp_ph = float(repli_ph)
-        shift_data_dict = get_shifted_data_for_each_replicate(mixture_list, norm_data_dict, x_scale, mixture_pka_dict, temp_ph)
+        repli_seed = get_child_seed_sequence(seed, "delta_acid_base", repli_name)
+        shift_data_dict = get_shifted_data_for_each_replicate(mixture_list, norm_data_dict, x_scale, mixture_pka_dict, temp_ph,
+                                                              repli_seed, meta_cluster_dict)
         group_shifted_data_dict[repli_name] = shift_data_dict
+        if progress is not None:
+            progress((idx + 1) / len(group_ph_dict))
     return group_ph_dict, group_shifted_data_dict
 
 
 def get_mixture_data_for_all_replicates(group_flag, group_repli_ph_dict, mixture_dict, norm_data_dict, mixture_pka_dict,
-                                        x_scale, cons_ph_table_data, protons_df, snr):
+                                        x_scale, cons_ph_table_data, protons_df, snr, seed=None, progress=None,
+                                        cluster_cache_file=None):
+    """
+    progress: optional callable, called with the fraction done after each shifted replicate (the sums are quick)
+    cluster_cache_file: see get_shifted_data_for_all_replicates
+    """
     mixture_list = list(mixture_dict.keys())
     group_ph_dict, group_shifted_data_dict = get_shifted_data_for_all_replicates(group_flag, group_repli_ph_dict,
                                                                                  mixture_list, norm_data_dict, x_scale,
-                                                                                 mixture_pka_dict)
+                                                                                 mixture_pka_dict, seed, progress,
+                                                                                 cluster_cache_file)
 
     repli_mix_data_dict = dict()
     for repli_name, shift_data_dict in group_shifted_data_dict.items():
@@ -176,7 +209,12 @@ def get_mixture_data_for_all_replicates(group_flag, group_repli_ph_dict, mixture
 
 # ------------------------------ shift data for continuous -------------------------------
 def conti_get_shifted_data_for_all_replicates(conti_repli_ph_dict, mixture_list, norm_data_dict, x_scale,
-                                              mixture_pka_dict):
+                                              mixture_pka_dict, seed=None, cluster_cache_file=None):
+    """
+    cluster_cache_file: see get_shifted_data_for_all_replicates
+    """
+    seed = get_seed_sequence(seed)
+    meta_cluster_dict = get_cosy_peak_cluster_index_dict(mixture_list, norm_data_dict, cluster_cache_file)
 
     conti_ph_dict = copy.deepcopy(conti_repli_ph_dict)
     del conti_ph_dict['meta_name']
@@ -185,18 +223,24 @@ def conti_get_shifted_data_for_all_replicates(conti_repli_ph_dict, mixture_list,
     conti_shifted_data_dict = dict()
     for repli_name, repli_ph in conti_ph_dict.items():
         temp_ph = float(repli_ph)
+        repli_seed = get_child_seed_sequence(seed, "delta_acid_base", repli_name)
         shift_data_dict = get_shifted_data_for_each_replicate(mixture_list, norm_data_dict, x_scale, mixture_pka_dict,
-                                                              temp_ph)
+                                                              temp_ph, repli_seed, meta_cluster_dict)
         conti_shifted_data_dict[repli_name] = shift_data_dict
     return conti_ph_dict, conti_shifted_data_dict
 
 
 def conti_get_mixture_data_for_all_replicates(conti_repli_ph_dict, mixture_dict, norm_data_dict, mixture_pka_dict,
-                                              x_scale, cons_ph_table_data, protons_df, snr):
+                                              x_scale, cons_ph_table_data, protons_df, snr, seed=None,
+                                              cluster_cache_file=None):
+    """
+    cluster_cache_file: see get_shifted_data_for_all_replicates
+    """
     mixture_list = list(mixture_dict.keys())
     conti_ph_dict, conti_shifted_data_dict = conti_get_shifted_data_for_all_replicates(conti_repli_ph_dict,
                                                                                        mixture_list, norm_data_dict,
-                                                                                       x_scale, mixture_pka_dict)
+                                                                                       x_scale, mixture_pka_dict, seed,
+                                                                                       cluster_cache_file)
 
     repli_mix_data_dict = dict()
     for repli_name, shift_data_dict in conti_shifted_data_dict.items():
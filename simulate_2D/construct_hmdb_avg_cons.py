@@ -1,66 +1,79 @@
 import pandas as pd
 import numpy as np
 import re
+import pathlib
+import json
+import os
+
+# bump this whenever the layout of the concentration table changes
+CONS_TABLE_VERSION = 1
+
+# compiled once, tried in this order on every concentration string
+MEAN_STD_PATTERN = re.compile(r"(?P<mean>\d+\.?\d+) ?\+\/\- ?(?P<std>\d+\.?\d+)")  # 88.0 +/- 33.0
+RANGE_PATTERN = re.compile(r"(?P<min_value>\d+\.?\d+) ?\- ?(?P<max_value>\d+\.?\d+)")  # "30.00-400.0"
+# "190.0 (30.0-400.0)"
+MEAN_RANGE_PATTERN = re.compile(r"(?P<real_mean>\d+\.?\d+) ?\((?P<min_value>\d+\.?\d+) ?\- ?(?P<max_value>\d+\.?\d+)\)")
+MEAN_BRACKET_STD_PATTERN = re.compile(r"(?P<mean>\d+\.?\d+) ?\((?P<std>\d+\.?\d+)\)")  # "122.3(27.85)"
+
+CREATININE_BRIDGE = 11.99525
 
 
 def estimate_mean_std(min_v, max_v):
-    matrix_1 = np.mat("1, 3; 1, -3")
-    matrix_2 = np.mat(max_v + "," + min_v).T
-    mean = round(float(np.linalg.solve(matrix_1, matrix_2)[0]), 2)
-    std = round(float(np.linalg.solve(matrix_1, matrix_2)[1]), 2)
+    # closed form of mean + 3 * std = max_v, mean - 3 * std = min_v
+    min_v, max_v = float(min_v), float(max_v)
+    mean = round((max_v + min_v) / 2, 2)
+    std = round((max_v - min_v) / 6, 2)
     return mean, std
 
 
-def get_hmdb_normal_avg_cons(hmdb_cons_dict, hmdb_id, bio_type):
+def parse_cons_value(value):
+    """
+    (mean, std) of an HMDB concentration string, None if it matches none of the patterns
+    """
+    pattern_1 = MEAN_STD_PATTERN.match(value)
+    if pattern_1:
+        return float(pattern_1.group("mean")), float(pattern_1.group("std"))
+
+    pattern_2 = RANGE_PATTERN.match(value)
+    if pattern_2:
+        return estimate_mean_std(pattern_2.group("min_value"), pattern_2.group("max_value"))
+
+    pattern_3 = MEAN_RANGE_PATTERN.match(value)
+    if pattern_3:
+        mean, std = estimate_mean_std(pattern_3.group("min_value"), pattern_3.group("max_value"))
+        return float(pattern_3.group("real_mean")), std
+
+    pattern_4 = MEAN_BRACKET_STD_PATTERN.match(value)
+    if pattern_4:
+        return float(pattern_4.group("mean")), float(pattern_4.group("std"))
+
+    return None
+
+
+def get_avg_cons(cons_dict_list):
     mean_list = []
     std_list = []
     unit_str = None
 
-    for cons_dict in hmdb_cons_dict[hmdb_id][bio_type]:
-        value = cons_dict['cons_value']
-        unit = cons_dict['cons_unit']
-        unit_str = unit
-
-        pattern_1 = re.match(r"(?P<mean>\d+\.?\d+) ?\+\/\- ?(?P<std>\d+\.?\d+)", value)  # 88.0 +/- 33.0
-        pattern_2 = re.match(r"(?P<min_value>\d+\.?\d+) ?\- ?(?P<max_value>\d+\.?\d+)", value)  # "30.00-400.0"
-        # "190.0 (30.0-400.0)"
-        pattern_3 = re.match(r"(?P<real_mean>\d+\.?\d+) ?\((?P<min_value>\d+\.?\d+) ?\- ?(?P<max_value>\d+\.?\d+)\)", value)
-        pattern_4 = re.match(r"(?P<mean>\d+\.?\d+) ?\((?P<std>\d+\.?\d+)\)", value)  # "122.3(27.85)"
-
-        if pattern_1:
-            mean = float(pattern_1.group("mean"))
-            std = float(pattern_1.group("std"))
-            mean_list.append(mean)
-            std_list.append(std)
-
-        elif pattern_2:
-            min_v = pattern_2.group("min_value")
-            max_v = pattern_2.group("max_value")
-            mean, std = estimate_mean_std(min_v, max_v)
-            mean_list.append(mean)
-            std_list.append(std)
-
-        elif pattern_3:
-            real_mean = float(pattern_3.group("real_mean"))
-            min_v = pattern_3.group("min_value")
-            max_v = pattern_3.group("max_value")
-            mean, std = estimate_mean_std(min_v, max_v)
-            mean_list.append(real_mean)
-            std_list.append(std)
-
-        elif pattern_4:
-            mean = float(pattern_4.group("mean"))
-            std = float(pattern_4.group("std"))
-            mean_list.append(mean)
-            std_list.append(std)
+    for cons_dict in cons_dict_list:
+        unit_str = cons_dict['cons_unit']
+        mean_std = parse_cons_value(cons_dict['cons_value'])
+        if mean_std is not None:
+            mean_list.append(mean_std[0])
+            std_list.append(mean_std[1])
+
+    return mean_list, std_list, unit_str
+
+
+def get_hmdb_normal_avg_cons(hmdb_cons_dict, hmdb_id, bio_type):
+    mean_list, std_list, unit_str = get_avg_cons(hmdb_cons_dict[hmdb_id][bio_type])
 
     avg_mean = round(float(np.mean(mean_list)), 4)
     avg_std = round(float(np.mean(std_list)), 4)
 
     if unit_str == "umol/mmol creatinine":
 
-        creatinine_bridge = 11.99525
-        avg_mean_um, avg_std_um = avg_mean * creatinine_bridge, avg_std * creatinine_bridge
+        avg_mean_um, avg_std_um = avg_mean * CREATININE_BRIDGE, avg_std * CREATININE_BRIDGE
         return round(avg_mean_um, 2), round(avg_std_um, 2), unit_str
         # hmdb_norm_csf_cons_dict[hmdb_id] = [avg_mean_um, avg_std_um, "uM"]
 
@@ -73,49 +86,9 @@ def get_hmdb_normal_avg_cons(hmdb_cons_dict, hmdb_id, bio_type):
 def get_hmdb_abnormal_avg_cons(hmdb_cons_dict, hmdb_id, bio_type):
 
     if bio_type == "Blood":
-
-        mean_list = []
-        std_list = []
-        unit_str = None
-
-        for cons_dict in hmdb_cons_dict[hmdb_id][bio_type]:
-            if cons_dict["condition"] == "Heart Transplant":
-                value = cons_dict['cons_value']
-                unit = cons_dict['cons_unit']
-                unit_str = unit
-
-                pattern_1 = re.match(r"(?P<mean>\d+\.?\d+) ?\+\/\- ?(?P<std>\d+\.?\d+)", value)  # 88.0 +/- 33.0
-                pattern_2 = re.match(r"(?P<min_value>\d+\.?\d+) ?\- ?(?P<max_value>\d+\.?\d+)", value)  # "30.00-400.0"
-                # "190.0 (30.0-400.0)"
-                pattern_3 = re.match(r"(?P<real_mean>\d+\.?\d+) ?\((?P<min_value>\d+\.?\d+) ?\- ?(?P<max_value>\d+\.?\d+)\)", value)
-                pattern_4 = re.match(r"(?P<mean>\d+\.?\d+) ?\((?P<std>\d+\.?\d+)\)", value)  # "122.3(27.85)"
-
-                if pattern_1:
-                    mean = float(pattern_1.group("mean"))
-                    std = float(pattern_1.group("std"))
-                    mean_list.append(mean)
-                    std_list.append(std)
-
-                elif pattern_2:
-                    min_v = pattern_2.group("min_value")
-                    max_v = pattern_2.group("max_value")
-                    mean, std = estimate_mean_std(min_v, max_v)
-                    mean_list.append(mean)
-                    std_list.append(std)
-
-                elif pattern_3:
-                    real_mean = float(pattern_3.group("real_mean"))
-                    min_v = pattern_3.group("min_value")
-                    max_v = pattern_3.group("max_value")
-                    mean, std = estimate_mean_std(min_v, max_v)
-                    mean_list.append(real_mean)
-                    std_list.append(std)
-
-                elif pattern_4:
-                    mean = float(pattern_4.group("mean"))
-                    std = float(pattern_4.group("std"))
-                    mean_list.append(mean)
-                    std_list.append(std)
+        cons_dict_list = [cons_dict for cons_dict in hmdb_cons_dict[hmdb_id][bio_type]
+                          if cons_dict["condition"] == "Heart Transplant"]
+        mean_list, std_list, unit_str = get_avg_cons(cons_dict_list)
 
         avg_mean = round(float(np.mean(mean_list)), 2)
         avg_std = round(float(np.mean(std_list)), 2)
@@ -123,3 +96,74 @@ def get_hmdb_abnormal_avg_cons(hmdb_cons_dict, hmdb_id, bio_type):
 
     else:
         return 0, 0, None
+
+
+class HmdbConsTable:
+    """
+    precomputed HMDB concentrations: condition ("normal" / "abnormal") -> biospecimen -> HMDB ID -> [mean, std, unit],
+    the values get_hmdb_normal_avg_cons / get_hmdb_abnormal_avg_cons return, so a page lookup is a dict access
+    """
+    def __init__(self, table_dict):
+        self.table_dict = table_dict
+
+    def get_normal_avg_cons(self, hmdb_id, bio_type):
+        return tuple(self.table_dict["normal"][bio_type][hmdb_id])
+
+    def get_abnormal_avg_cons(self, hmdb_id, bio_type):
+        if bio_type != "Blood":
+            return 0, 0, None
+        return tuple(self.table_dict["abnormal"][bio_type][hmdb_id])
+
+
+def build_hmdb_cons_table(hmdb_norm_cons_dict, hmdb_abnorm_cons_dict):
+    """
+    parse every concentration string of the normal / abnormal HMDB concentration dicts once
+    """
+    table_dict = {"normal": dict(), "abnormal": dict()}
+    for hmdb_id, bio_dict in hmdb_norm_cons_dict.items():
+        for bio_type in bio_dict:
+            table_dict["normal"].setdefault(bio_type, dict())[hmdb_id] = \
+                list(get_hmdb_normal_avg_cons(hmdb_norm_cons_dict, hmdb_id, bio_type))
+    for hmdb_id, bio_dict in hmdb_abnorm_cons_dict.items():
+        # only blood has abnormal concentrations (Heart Transplant), see get_hmdb_abnormal_avg_cons
+        if "Blood" in bio_dict:
+            table_dict["abnormal"].setdefault("Blood", dict())[hmdb_id] = \
+                list(get_hmdb_abnormal_avg_cons(hmdb_abnorm_cons_dict, hmdb_id, "Blood"))
+    return HmdbConsTable(table_dict)
+
+
+def get_cons_table_key(norm_cons_path, abnorm_cons_path):
+    file_stat_list = [(pathlib.Path(path).name, os.stat(str(path)).st_mtime, os.stat(str(path)).st_size)
+                      for path in (norm_cons_path, abnorm_cons_path)]
+    return json.dumps({"version": CONS_TABLE_VERSION, "files": file_stat_list}, sort_keys=True)
+
+
+def load_hmdb_cons_table_with_cache(norm_cons_path, abnorm_cons_path, cache_dir="Input/cache"):
+    """
+    HmdbConsTable of hmdb_normal_concentrations.json and hmdb_abnormal_concentrations.json, built once and kept in
+    <cache_dir>/hmdb_cons_table.json until one of the two files changes
+    """
+    base_path = pathlib.Path(__file__).resolve().parents[1]
+    table_path = base_path.joinpath(cache_dir, "hmdb_cons_table.json")
+    cache_key = get_cons_table_key(norm_cons_path, abnorm_cons_path)
+
+    try:
+        with open(str(table_path)) as f:
+            cache_dict = json.load(f)
+        if cache_dict.get("key") == cache_key:
+            return HmdbConsTable(cache_dict["table"])
+    except (OSError, ValueError):
+        pass
+
+    with open(str(norm_cons_path)) as json_file:
+        hmdb_norm_cons_dict = json.load(json_file)
+    with open(str(abnorm_cons_path)) as json_file:
+        hmdb_abnorm_cons_dict = json.load(json_file)
+    cons_table = build_hmdb_cons_table(hmdb_norm_cons_dict, hmdb_abnorm_cons_dict)
+
+    table_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_table_path = table_path.with_suffix(".json.tmp")
+    with open(str(temp_table_path), "w") as f:
+        json.dump({"key": cache_key, "table": cons_table.table_dict}, f)
+    os.replace(str(temp_table_path), str(table_path))
+    return cons_table
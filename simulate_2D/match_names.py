@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from simulate_1D.hmdb_names import get_hmdb_name_index
+
 
 def format_data_names(norm_data_dict):
     format_norm_data_dict = dict()
@@ -19,39 +21,60 @@ def format_data_names(norm_data_dict):
 
 
 def db_names_match_hmdb(format_norm_data_dict, hmdb_dict):
+    hmdb_index = get_hmdb_name_index(hmdb_dict)
     db_names_ids_dict = dict()
     for name in format_norm_data_dict.keys():
-        id_list = []
-        for idx, name_list in hmdb_dict.items():
-            if name in name_list:
-                id_list.append(idx)
-        db_names_ids_dict[name] = id_list
+        db_names_ids_dict[name] = list(hmdb_index.get_ids(name))
 
     return db_names_ids_dict
 
 
 def cons_names_match_hmdb(cons_df, hmdb_dict):
+    hmdb_index = get_hmdb_name_index(hmdb_dict)
     cons_names_ids_dict = dict()
     for name in cons_df.index:
-        id_list = []
-        for idx, name_list in hmdb_dict.items():
-            if name in name_list:
-                id_list.append(idx)
-        cons_names_ids_dict[name] = id_list
+        cons_names_ids_dict[name] = list(hmdb_index.get_ids(name))
     return cons_names_ids_dict
 
 
+def get_id_names_dict(names_ids_dict):
+    """
+    reverse of a name -> HMDB IDs dict: HMDB ID -> names, the names in the order of names_ids_dict
+    """
+    id_names_dict = dict()
+    for name, id_list in names_ids_dict.items():
+        for idx in id_list:
+            name_list = id_names_dict.setdefault(idx, [])
+            if not name_list or name_list[-1] != name:
+                name_list.append(name)
+    return id_names_dict
+
+
+def get_names_sharing_ids(id_list, id_names_dict, name_position_dict):
+    """
+    names of id_names_dict sharing at least one HMDB ID of id_list, in the order of name_position_dict
+    """
+    name_set = set()
+    for idx in id_list:
+        name_set.update(id_names_dict.get(idx, []))
+    return sorted(name_set, key=name_position_dict.get)
+
+
 def db_match_cons(norm_data_dict, cons_df, hmdb_dict1):
     format_norm_data_dict = format_data_names(norm_data_dict)
-    db_names_ids_dict = db_names_match_hmdb(format_norm_data_dict, hmdb_dict1)
-    cons_names_ids_dict = cons_names_match_hmdb(cons_df, hmdb_dict1)
+    hmdb_index = get_hmdb_name_index(hmdb_dict1)
+    db_names_ids_dict = db_names_match_hmdb(format_norm_data_dict, hmdb_index)
+    cons_names_ids_dict = cons_names_match_hmdb(cons_df, hmdb_index)
+    cons_id_names_dict = get_id_names_dict(cons_names_ids_dict)
+    cons_position_dict = {cons_name: i for i, cons_name in enumerate(cons_names_ids_dict)}
 
     match_data_dict = dict()
     for name, data in format_norm_data_dict.items():
-        db_id_list = db_names_ids_dict[name]
-        for cons_name, cons_id_list in cons_names_ids_dict.items():
-            if (name == cons_name) or (set(db_id_list).intersection(set(cons_id_list))):
-                match_data_dict[cons_name] = data
+        matched_cons_set = set(get_names_sharing_ids(db_names_ids_dict[name], cons_id_names_dict, cons_position_dict))
+        if name in cons_position_dict:
+            matched_cons_set.add(name)
+        for cons_name in sorted(matched_cons_set, key=cons_position_dict.get):
+            match_data_dict[cons_name] = data
 
     return match_data_dict
 
@@ -84,21 +107,19 @@ def input_match_db(mixture_list, match_data_dict, hmdb_dict):
         format_mixture_list.append(lower_meta_name)
 
     # get the db match hmdb ids dict
-    db_names_ids_dict = db_names_match_hmdb(match_data_dict, hmdb_dict)
+    hmdb_index = get_hmdb_name_index(hmdb_dict)
+    db_names_ids_dict = db_names_match_hmdb(match_data_dict, hmdb_index)
+    db_id_names_dict = get_id_names_dict(db_names_ids_dict)
+    db_position_dict = {db_name: i for i, db_name in enumerate(db_names_ids_dict)}
 
     # match input mixtures with db names
     mixture_match_db_list = []
     for meta_name in format_mixture_list:
-        if meta_name in match_data_dict.keys():
+        if meta_name in match_data_dict:
             mixture_match_db_list.append(meta_name)
         else:
-            idx_list = []
-            for idx, name_list in hmdb_dict.items():
-                if meta_name in name_list:
-                    idx_list.append(idx)
-            for db_name, db_idx_list in db_names_ids_dict.items():
-                if set(idx_list).intersection(set(db_idx_list)):
-                    mixture_match_db_list.append(db_name)
+            mixture_match_db_list.extend(get_names_sharing_ids(hmdb_index.get_ids(meta_name), db_id_names_dict,
+                                                               db_position_dict))
 
     return mixture_match_db_list
 
@@ -117,21 +138,22 @@ def input_corr_match_db(corr_df, match_data_dict, hmdb_dict):
         format_corr_names_dict[meta_name] = lower_meta_name
 
     # get the db match hmdb ids dict
-    db_names_ids_dict = db_names_match_hmdb(match_data_dict, hmdb_dict)
+    hmdb_index = get_hmdb_name_index(hmdb_dict)
+    db_names_ids_dict = db_names_match_hmdb(match_data_dict, hmdb_index)
+    db_id_names_dict = get_id_names_dict(db_names_ids_dict)
+    db_position_dict = {db_name: i for i, db_name in enumerate(db_names_ids_dict)}
 
     # match input corr_names with db names
     corr_match_db_dict = dict()
     for orig_name, format_name in format_corr_names_dict.items():
-        if format_name in match_data_dict.keys():
+        if format_name in match_data_dict:
             corr_match_db_dict[orig_name] = format_name
         else:
-            idx_list = []
-            for idx, name_list in hmdb_dict.items():
-                if format_name in name_list:
-                    idx_list.append(idx)
-            for db_name, db_idx_list in db_names_ids_dict.items():
-                if set(idx_list).intersection(set(db_idx_list)):
-                    corr_match_db_dict[orig_name] = db_name
+            matched_db_list = get_names_sharing_ids(hmdb_index.get_ids(format_name), db_id_names_dict,
+                                                    db_position_dict)
+            if matched_db_list:
+                # the last db name sharing an ID wins, as in the scan over all db names
+                corr_match_db_dict[orig_name] = matched_db_list[-1]
 
     corr_df.rename(columns=corr_match_db_dict, index=corr_match_db_dict, inplace=True)
     return corr_df
@@ -167,20 +189,21 @@ def input_cons_match_db(cons_df, match_data_dict, hmdb_dict):
         format_cons_names_dict[meta_name] = lower_meta_name
 
     # get the db match hmdb ids dict
-    db_names_ids_dict = db_names_match_hmdb(match_data_dict, hmdb_dict)
+    hmdb_index = get_hmdb_name_index(hmdb_dict)
+    db_names_ids_dict = db_names_match_hmdb(match_data_dict, hmdb_index)
+    db_id_names_dict = get_id_names_dict(db_names_ids_dict)
+    db_position_dict = {db_name: i for i, db_name in enumerate(db_names_ids_dict)}
 
     # match input corr_names with db names
     cons_match_db_dict = dict()
     for orig_name, format_name in format_cons_names_dict.items():
-        if format_name in match_data_dict.keys():
+        if format_name in match_data_dict:
             cons_match_db_dict[orig_name] = format_name
         else:
-            idx_list = []
-            for idx, name_list in hmdb_dict.items():
-                if format_name in name_list:
-                    idx_list.append(idx)
-            for db_name, db_idx_list in db_names_ids_dict.items():
-                if set(idx_list).intersection(set(db_idx_list)):
-                    cons_match_db_dict[orig_name] = db_name
+            matched_db_list = get_names_sharing_ids(hmdb_index.get_ids(format_name), db_id_names_dict,
+                                                    db_position_dict)
+            if matched_db_list:
+                # the last db name sharing an ID wins, as in the scan over all db names
+                cons_match_db_dict[orig_name] = matched_db_list[-1]
     cons_df.iloc[:, 0] = list(cons_match_db_dict.values())
     return cons_df
\ No newline at end of file
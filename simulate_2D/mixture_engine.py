@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from simulate_2D.sparse_spectra import to_sparse
+
+# with a progress callable, simulate_mixture_matrix sums the replicates by chunks of this size and reports after each
+PROGRESS_CHUNK_SIZE = 8
+
+
+def get_protons_array(hmdb_id_list, protons_df):
+    """
+    number of protons of each HMDB ID, 1 when the ID is missing from protons_df (or listed twice) or its number is
+    not readable, as the try/except around protons_df.loc used to do
+    """
+    protons = protons_df["number_of_protons"]
+    protons = protons[~protons.index.duplicated(keep=False)]
+    protons = pd.to_numeric(protons.reindex(hmdb_id_list), errors="coerce")
+    protons = protons.replace([np.inf, -np.inf], np.nan).fillna(1)
+    return np.trunc(protons.to_numpy(dtype=np.float64))
+
+
+def get_cons_matrix(mixture_list, cons_table_rows, repli_name_list):
+    """
+    (replicates x metabolites) concentrations, repli_name_list: the table columns, e.g. ["1_replicate_1", ...]
+    the first row of each metabolite is used, the rows are scanned once
+    """
+    row_dict = dict()
+    for row in cons_table_rows:
+        row_dict.setdefault(row["meta_name"], row)
+
+    cons_matrix = np.empty((len(repli_name_list), len(mixture_list)), dtype=np.float64)
+    for j, meta_name in enumerate(mixture_list):
+        temp_dict = row_dict[meta_name]
+        cons_matrix[:, j] = [float(temp_dict[repli_name]) for repli_name in repli_name_list]
+    return cons_matrix
+
+
+def get_weight_matrix(mixture_dict, cons_table_rows, repli_name_list, protons_df=None):
+    """
+    (replicates x metabolites) weights = concentration * number of protons
+    mixture_dict: metabolite name -> HMDB ID; without protons_df every metabolite counts as one proton
+    """
+    mixture_list = list(mixture_dict.keys())
+    cons_matrix = get_cons_matrix(mixture_list, cons_table_rows, repli_name_list)
+    if protons_df is None:
+        return cons_matrix
+    return cons_matrix * get_protons_array(list(mixture_dict.values()), protons_df)[np.newaxis, :]
+
+
+def get_library_matrix(mixture_list, data_dict):
+    """
+    (metabolites x points) CSR matrix of the flattened 2d spectra of mixture_list and the shape of one spectrum
+    """
+    data_list = [to_sparse(data_dict[meta_name]) for meta_name in mixture_list]
+    spectrum_shape = data_list[0].shape
+    library_matrix = sparse.vstack([data.reshape(1, -1) for data in data_list], format="csr")
+    return library_matrix, spectrum_shape
+
+
+def simulate_mixture_matrix(mixture_dict, data_dict, cons_table_rows, repli_name_list, protons_df=None,
+                            progress=None):
+    """
+    CSR mixture spectra of all replicates (see sparse_spectra.py), one sparse matrix product of the weights and the
+    library spectra, so the memory scales with the non-zero points of the mixtures, not with the grid
+    progress: optional callable, called with the fraction of the replicates done after every PROGRESS_CHUNK_SIZE
+    replicates (the product is then made chunk by chunk)
+    """
+    weight_matrix = get_weight_matrix(mixture_dict, cons_table_rows, repli_name_list, protons_df)
+    library_matrix, spectrum_shape = get_library_matrix(list(mixture_dict.keys()), data_dict)
+
+    chunk_size = len(repli_name_list) if progress is None else PROGRESS_CHUNK_SIZE
+    sum_data_list = []
+    for start in range(0, len(repli_name_list), max(chunk_size, 1)):
+        sum_matrix = (sparse.csr_matrix(weight_matrix[start:start + chunk_size]) @ library_matrix).tocsr()
+        sum_matrix.eliminate_zeros()
+        sum_data_list.extend(sum_matrix[idx].reshape(spectrum_shape).tocsr() for idx in range(sum_matrix.shape[0]))
+        if progress is not None:
+            progress(len(sum_data_list) / len(repli_name_list))
+    return sum_data_list
@@ -1,60 +1,226 @@
 import pandas as pd
 import numpy as np
 from scipy.signal import find_peaks
-from itertools import groupby
-from operator import itemgetter
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import uuid
+from collections import OrderedDict
+
+from simulate_2D.random_streams import get_seed_sequence, get_rng, get_child_rng
+from simulate_2D.sparse_spectra import to_dense
+
+# the peak clusters of the metabolites of a spectra library are stored next to it, in one small JSON file per library,
+# preprocessing and detection parameters (see get_peak_cluster_cache_file); only the PEAK_CLUSTER_CACHE_FILES most
+# recently used files of a library are kept, and the clusters of the last PEAK_CLUSTER_CACHE_SIZE metabolites looked
+# up are also kept in memory
+PEAK_CLUSTER_CACHE_SIZE = 1024
+PEAK_CLUSTER_CACHE_FILES = 32
+_peak_cluster_cache = OrderedDict()
+_peak_cluster_lock = threading.Lock()
+
+
+def get_p_jres(data):
+    # maximum of every column
+    return np.max(to_dense(data), axis=0)
 
 
 def get_p_jres_dict(mixture_list, final_data_dict):
     p_jres_dict = dict()
     for meta_name in mixture_list:
-        temp_data = np.array(final_data_dict[meta_name])
-        p_jres_scale = np.zeros(temp_data.shape[1])
-        for i in range(temp_data.shape[1]):
-            temp_y = max(temp_data[:, i])
-            p_jres_scale[i] = temp_y
-        p_jres_dict[meta_name] = p_jres_scale
+        p_jres_dict[meta_name] = get_p_jres(final_data_dict[meta_name])
     return p_jres_dict
 
 
-def peak_cluster_detection(y):
+def get_peak_clusters(y, peaks_index_list, min_width=0):
+    """
+    the runs of consecutive points above the mean of y that hold at least one of the (sorted) peaks, and are longer
+    than min_width points, as an (n_clusters, 2) int array of [start, stop) index bounds
+    """
+    y = np.asarray(y)
+    peaks_index_list = np.asarray(peaks_index_list, dtype=np.intp)
+    # +1 where a run starts, -1 one past where it ends
+    edges = np.diff(np.concatenate(([0], (y > np.mean(y)).astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    # a run holds a peak if the first peak at or after its start comes before its stop
+    next_peak = np.append(peaks_index_list, len(y))[np.searchsorted(peaks_index_list, starts)]
+    keep = (next_peak < stops) & (stops - starts > min_width)
+    return np.column_stack((starts[keep], stops[keep]))
+
+
+def peak_cluster_detection(y, rng=None):
     """
     y: the projection of JRes (pJRes)
     """
     # find peaks first
-    peaks_index_list, _ = find_peaks(y, height=max(y)*0.1)
+    peaks_index_list, _ = find_peaks(y, height=np.max(y)*0.1)
 
     # find multiplets width
-    signals = np.zeros(len(y))
-    mean = np.mean(y)
-    for idx, value in enumerate(y):
-        if value > mean:
-            signals[idx] = 1
-        else:
-            signals[idx] = 0
-
-    signal_index_list = np.where(signals == 1)[0]
-    signal_width_subset = []
-    for k, g in groupby(enumerate(signal_index_list), lambda ix: ix[0] - ix[1]):
-        signal_width_subset.append(list(map(itemgetter(1), g)))
-
-    # check signal width subsets
-    filtered_signal_subset = []
-    for subset in signal_width_subset:
-        if bool(set(peaks_index_list) & set(subset)):
-            filtered_signal_subset.append(subset)
+    cluster_array = get_peak_clusters(y, peaks_index_list)
 
     # sample delta_acid_base for each peak cluster
-    delta_acid_base_list = np.random.normal(-0.118, 0.204, len(filtered_signal_subset))
+    delta_acid_base_list = sample_delta_acid_base(len(cluster_array), rng)
+
+    return peaks_index_list, cluster_array, delta_acid_base_list
+
+
+def get_peak_cluster_index(y, height_thres=0.1, min_width=0):
+    """
+    the peak clusters of y (see get_peak_clusters, the peaks are the ones higher than height_thres * max(y)), as a
+    read-only array
+    """
+    y = np.asarray(y)
+    peaks_index_list, _ = find_peaks(y, height=np.max(y) * height_thres)
+    cluster_array = get_peak_clusters(y, peaks_index_list, min_width)
+    cluster_array.setflags(write=False)
+    return cluster_array
+
+
+def get_peak_cluster_cache_file(library, preprocess_params, height_thres=0.1, min_width=0):
+    """
+    the file holding the peak clusters of the spectra of library (see spectra_library.py) preprocessed with
+    preprocess_params (a JSON value, e.g. the list of the preprocessing inputs of a page) and detected with
+    height_thres and min_width; it is named after a hash of the library key and of all the parameters, so a rebuilt
+    library or other parameters get another file; None if library is not stored on disk
+    """
+    library_path = getattr(library, "library_path", None)
+    cache_key = getattr(library, "metadata", dict()).get("key")
+    if library_path is None or cache_key is None:
+        return None
+    digest = hashlib.md5(json.dumps([cache_key, preprocess_params, float(height_thres), int(min_width)],
+                                    sort_keys=True).encode("utf-8")).hexdigest()
+    return library_path.with_name(library_path.name + "_peak_clusters").joinpath(digest + ".json")
+
+
+def read_peak_cluster_file(cache_file):
+    # {meta_name: [[start, stop], ...]} of cache_file, empty if it is missing or unreadable
+    try:
+        with open(str(cache_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
 
-    return peaks_index_list, filtered_signal_subset, delta_acid_base_list
+def get_file_mtime(path):
+    try:
+        return os.stat(str(path)).st_mtime
+    except OSError:
+        return 0
 
 
-def get_peak_cluster_acid_base_list(mixture_list, processed_data_dict):
+def write_peak_cluster_file(cache_file, meta_cluster_dict):
+    """
+    add the clusters of meta_cluster_dict to cache_file, replaced in one go so a reader never sees it half written,
+    then remove the least recently used files of its folder beyond PEAK_CLUSTER_CACHE_FILES
+    """
+    cache_file = pathlib.Path(cache_file)
+    file_dict = read_peak_cluster_file(cache_file)
+    file_dict.update({meta_name: np.asarray(cluster_array).tolist()
+                      for meta_name, cluster_array in meta_cluster_dict.items()})
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_name("{}.{}.tmp".format(cache_file.name, uuid.uuid4().hex))
+        with open(str(temp_file), "w") as f:
+            json.dump(file_dict, f)
+        os.replace(str(temp_file), str(cache_file))
+    except OSError as e:
+        print("peak clusters not cached in {}: {}".format(cache_file, e))
+        return
+
+    cache_file_list = sorted(cache_file.parent.glob("*.json"), key=get_file_mtime, reverse=True)
+    for old_file in cache_file_list[PEAK_CLUSTER_CACHE_FILES:]:
+        try:
+            os.remove(str(old_file))
+        except OSError:
+            pass
+
+
+def sample_delta_acid_base(num_clusters, rng=None):
+    # delta_acid_base of each peak cluster
+    return get_rng(rng).normal(-0.118, 0.204, num_clusters)
+
+
+def get_peak_cluster_index_dict(mixture_list, processed_data_dict, cache_file=None, height_thres=0.1, min_width=0,
+                                projection=None):
+    """
+    {meta_name: cluster_array} of the mixture, see get_peak_cluster_index
+    cache_file: see get_peak_cluster_cache_file (made with the same height_thres and min_width); the clusters are
+    looked up by metabolite name in memory, then in the file, and only the missing ones are detected and added to
+    the file; without it, the clusters of every metabolite are detected
+    projection: optional function giving the 1d curve the clusters are detected on from a spectrum (e.g. get_p_jres),
+    only called for the metabolites that are not cached
+    """
+    if projection is None:
+        projection = np.asarray
+    if cache_file is None:
+        return {meta_name: get_peak_cluster_index(projection(processed_data_dict[meta_name]), height_thres,
+                                                  min_width)
+                for meta_name in mixture_list}
+
+    cache_file = str(cache_file)
+    meta_cluster_dict = dict()
+    with _peak_cluster_lock:
+        for meta_name in mixture_list:
+            if (cache_file, meta_name) in _peak_cluster_cache:
+                _peak_cluster_cache.move_to_end((cache_file, meta_name))
+                meta_cluster_dict[meta_name] = _peak_cluster_cache[(cache_file, meta_name)]
+
+    missing_list = [meta_name for meta_name in dict.fromkeys(mixture_list) if meta_name not in meta_cluster_dict]
+    if missing_list:
+        file_dict = read_peak_cluster_file(cache_file)
+        if file_dict:
+            # the least recently used files are removed first, see write_peak_cluster_file
+            try:
+                os.utime(cache_file)
+            except OSError:
+                pass
+        new_cluster_dict = dict()
+        for meta_name in missing_list:
+            if meta_name in file_dict:
+                cluster_array = np.array(file_dict[meta_name], dtype=np.intp).reshape(-1, 2)
+                cluster_array.setflags(write=False)
+            else:
+                cluster_array = get_peak_cluster_index(projection(processed_data_dict[meta_name]), height_thres,
+                                                       min_width)
+                new_cluster_dict[meta_name] = cluster_array
+            meta_cluster_dict[meta_name] = cluster_array
+        if new_cluster_dict:
+            write_peak_cluster_file(cache_file, new_cluster_dict)
+
+        with _peak_cluster_lock:
+            for meta_name in missing_list:
+                _peak_cluster_cache[(cache_file, meta_name)] = meta_cluster_dict[meta_name]
+            while len(_peak_cluster_cache) > PEAK_CLUSTER_CACHE_SIZE:
+                _peak_cluster_cache.popitem(last=False)
+    return {meta_name: meta_cluster_dict[meta_name] for meta_name in mixture_list}
+
+
+def sample_peak_cluster_acid_base_list(meta_cluster_dict, seed=None):
+    """
+    {meta_name: [cluster_array, delta_acid_base_list]} with a new delta_acid_base draw for every peak cluster of
+    meta_cluster_dict (see get_peak_cluster_index_dict)
+    seed: see random_streams.get_seed_sequence, delta_acid_base of each metabolite is drawn from its own stream
+    """
+    seed = get_seed_sequence(seed)
     meta_subset_dict = dict()
-    for meta_name in mixture_list:
-        temp_y = processed_data_dict[meta_name]
-        peaks_index_list, filtered_signal_subset, delta_acid_base_list = peak_cluster_detection(temp_y)
-        meta_subset_dict[meta_name] = [filtered_signal_subset, delta_acid_base_list]
+    for meta_name, cluster_array in meta_cluster_dict.items():
+        meta_rng = get_child_rng(seed, "delta_acid_base", meta_name)
+        meta_subset_dict[meta_name] = [cluster_array, sample_delta_acid_base(len(cluster_array), meta_rng)]
     return meta_subset_dict
 
+
+def get_peak_cluster_acid_base_list(mixture_list, processed_data_dict, seed=None, cache_file=None, projection=None):
+    """
+    {meta_name: [cluster_array, delta_acid_base_list]}, cluster_array holds the [start, stop) bounds of the peak
+    clusters (see get_peak_clusters) and delta_acid_base_list one value per cluster
+    the clusters come from the index stored in cache_file (see get_peak_cluster_index_dict), only delta_acid_base is
+    drawn again
+    seed: see random_streams.get_seed_sequence, delta_acid_base of each metabolite is drawn from its own stream
+    """
+    meta_cluster_dict = get_peak_cluster_index_dict(mixture_list, processed_data_dict, cache_file,
+                                                    projection=projection)
+    return sample_peak_cluster_acid_base_list(meta_cluster_dict, seed)
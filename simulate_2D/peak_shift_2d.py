@@ -1,80 +1,152 @@
 import pandas as pd
 import numpy as np
-from itertools import groupby
-from operator import itemgetter
+from scipy import sparse
 
-from simulate_2D.peak_detection_2d import peak_cluster_detection
+from simulate_2D.sparse_spectra import to_sparse
 # from simulate_2D.preprocess_1d_spectra import smooth_spectra
 
 
-def calculate_peak_shift(data, x_scale, temp_pka, temp_ph, filtered_signal_subset, delta_acid_base_list):
-    ph_standard = 7.4
-    temp_data = np.array(data)
-    shift_2d_array = np.zeros(temp_data.shape)
+def get_shift_size_array(delta_acid_base_list, temp_pka, temp_ph, step_size, ph_standard=7.4):
+    """
+    shift (in points) of every peak cluster at temp_ph, from its delta_acid_base and the pKa of the metabolite;
+    the chemical shift change is bounded to +-0.5 ppm
+    """
+    delta_shift = (np.asarray(delta_acid_base_list, dtype=np.float64) *
+                   (10 ** (ph_standard - temp_pka) - 10 ** (temp_ph - temp_pka))) / \
+                  ((1 + 10 ** (ph_standard - temp_pka)) * (1 + 10 ** (temp_ph - temp_pka)))
+    delta_shift = np.clip(delta_shift, -0.5, 0.5)
+    return np.round(delta_shift / step_size).astype(np.intp)
+
+
+def get_shift_slices(start, stop, shift_size, num_points):
+    """
+    (source slice, destination slice) moving the points [start, stop) by -shift_size, the part of the cluster shifted
+    past either end of the spectrum is dropped; None if nothing is left
+    """
+    dest_start = max(start - shift_size, 0)
+    dest_stop = min(stop - shift_size, num_points)
+    if dest_start >= dest_stop:
+        return None
+    return slice(dest_start + shift_size, dest_stop + shift_size), slice(dest_start, dest_stop)
+
+
+def get_cluster_entries(data, cluster_array):
+    """
+    (row, column, cluster index, value) of every non-zero point of the JRes spectrum in the columns of its peak
+    clusters, and the shape of the spectrum
+    """
+    matrix = to_sparse(data).tocoo()
+    cluster_array = np.asarray(cluster_array, dtype=np.intp).reshape(-1, 2)
+    column_cluster = np.full(matrix.shape[1], -1, dtype=np.intp)
+    for cluster_index, (start, stop) in enumerate(cluster_array):
+        column_cluster[start:stop] = cluster_index
+    cluster_index = column_cluster[matrix.col]
+    keep = cluster_index >= 0
+    return matrix.row[keep], matrix.col[keep], cluster_index[keep], matrix.data[keep], matrix.shape
+
+
+def get_cluster_points(cluster_array):
+    """
+    (column index, cluster index) of every column of the [start, stop) peak clusters of cluster_array
+    """
+    cluster_array = np.asarray(cluster_array, dtype=np.intp).reshape(-1, 2)
+    lengths = cluster_array[:, 1] - cluster_array[:, 0]
+    cluster_index = np.repeat(np.arange(len(cluster_array)), lengths)
+    # position of every column in its cluster, then its index in the spectrum
+    position = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return cluster_array[cluster_index, 0] + position, cluster_index
+
+
+def get_last_cluster_mask(flat_index):
+    """
+    mask of the last occurrence of every value of flat_index; the columns are in cluster order, so a cluster shifted
+    onto an earlier one of the same metabolite overwrites it, as the column assignment of a single spectrum does
+    """
+    flat_index = np.asarray(flat_index)
+    keep = np.zeros(len(flat_index), dtype=bool)
+    _, last_index = np.unique(flat_index[::-1], return_index=True)
+    keep[len(flat_index) - 1 - last_index] = True
+    return keep
+
+
+def shift_mixture_sparse(mixture_list, x_scale, norm_data_dict, meta_subset_dict, mixture_pka_dict, ph_list,
+                         weight_matrix):
+    """
+    [mixture spectrum with peak shift (CSR) of every replicate], replicate i is at pH ph_list[i] and weight_matrix[i]
+    holds its weights (replicates x metabolites of mixture_list)
+    the (pH x clusters) shifts are computed in one go, and the weighted cluster points of all the metabolites are
+    scattered to their shifted position; the columns a cluster is shifted onto belong to it alone, so it overwrites
+    an earlier cluster of the same metabolite shifted there (see get_last_cluster_mask), the metabolites themselves
+    add up; replicates with the same pH and the same weights are computed once, the others get a copy so every
+    replicate owns its matrix
+    """
+    if len(mixture_list) == 0:
+        return [sparse.csr_matrix((0, 0), dtype=np.float64) for _ in ph_list]
     step_size = x_scale[0] - x_scale[1]
+    row_list, col_list, cluster_list, value_list, meta_list, delta_list, pka_list = [], [], [], [], [], [], []
+    cluster_col_list, col_cluster_list, col_meta_list = [], [], []
+    num_clusters = 0
+    for meta_index, meta_name in enumerate(mixture_list):
+        cluster_array, delta_acid_base_list = meta_subset_dict[meta_name]
+        row, col, cluster_index, value, shape = get_cluster_entries(norm_data_dict[meta_name], cluster_array)
+        row_list.append(row)
+        col_list.append(col)
+        cluster_list.append(cluster_index + num_clusters)
+        value_list.append(value)
+        meta_list.append(np.full(len(value), meta_index, dtype=np.intp))
+        cluster_col, col_cluster = get_cluster_points(cluster_array)
+        cluster_col_list.append(cluster_col)
+        col_cluster_list.append(col_cluster + num_clusters)
+        col_meta_list.append(np.full(len(cluster_col), meta_index, dtype=np.intp))
+        delta_list.append(np.asarray(delta_acid_base_list, dtype=np.float64).reshape(-1))
+        pka_list.append(np.full(len(delta_list[-1]), float(mixture_pka_dict[meta_name])))
+        num_clusters += len(delta_list[-1])
+    row, col, cluster_index, value, meta_index, cluster_col, col_cluster, col_meta, delta_acid_base_array, \
+        pka_array = [np.concatenate(array_list) for array_list in
+                     (row_list, col_list, cluster_list, value_list, meta_list, cluster_col_list, col_cluster_list,
+                      col_meta_list, delta_list, pka_list)]
 
-    for idx, subset in enumerate(filtered_signal_subset):
-        delta_acid_base = delta_acid_base_list[idx]
-        delta_shift = (delta_acid_base * (10 ** (ph_standard - temp_pka) - 10 ** (temp_ph - temp_pka))) / \
-                      ((1 + 10 ** (ph_standard - temp_pka)) * (1 + 10 ** (temp_ph - temp_pka)))
-        if abs(delta_shift) > 0.5:
-            if delta_shift > 0:
-                delta_shift = 0.5
-            else:
-                delta_shift = -0.5
-        shift_size = round(delta_shift / step_size)
-        shift_subset = [s - shift_size for s in subset]
-        print("shift_size:", shift_size, "delta_shift:", delta_shift, "step_size:", step_size,
-              "temp_ph:", temp_ph, "temp_pka:", temp_pka, "delta_acid_base:", delta_acid_base)
-        shift_2d_array[:, shift_subset] = temp_data[:, subset]
-    return shift_2d_array
-
-
-def construct_shift_data_for_all_repli(mixture_list, x_scale, norm_data_dict, meta_subset_dict,
-                                       mixture_pka_dict, cons_ph_table_data, group_flag):
-
-    ph_data_dict = dict()
+    key_matrix = np.column_stack((np.asarray(ph_list, dtype=np.float64), np.asarray(weight_matrix, dtype=np.float64)))
+    unique_key_matrix, inverse = np.unique(key_matrix, axis=0, return_inverse=True)
+    shift_matrix = get_shift_size_array(delta_acid_base_array[np.newaxis, :], pka_array[np.newaxis, :],
+                                        unique_key_matrix[:, :1], step_size)
+
+    unique_sum_list = []
+    for temp_key, temp_shift_array in zip(unique_key_matrix, shift_matrix):
+        # the cluster owning every shifted column of every metabolite, -1 where no cluster lands
+        dest_cluster_col = cluster_col - temp_shift_array[col_cluster]
+        col_valid = (dest_cluster_col >= 0) & (dest_cluster_col < shape[1])
+        flat_col = (col_meta * shape[1] + dest_cluster_col)[col_valid]
+        keep = get_last_cluster_mask(flat_col)
+        owner = np.full(len(mixture_list) * shape[1], -1, dtype=np.intp)
+        owner[flat_col[keep]] = col_cluster[col_valid][keep]
+
+        # the points shifted past either end of the spectrum or onto a later cluster are dropped
+        dest_col = col - temp_shift_array[cluster_index]
+        valid = (dest_col >= 0) & (dest_col < shape[1])
+        valid[valid] = owner[meta_index[valid] * shape[1] + dest_col[valid]] == cluster_index[valid]
+        sum_data = sparse.coo_matrix(((temp_key[1:][meta_index] * value)[valid], (row[valid], dest_col[valid])),
+                                     shape=shape).tocsr()
+        sum_data.eliminate_zeros()
+        unique_sum_list.append(sum_data)
+    sum_data_list = []
+    used = np.zeros(len(unique_sum_list), dtype=bool)
+    for idx in inverse.reshape(-1):
+        sum_data_list.append(unique_sum_list[idx].copy() if used[idx] else unique_sum_list[idx])
+        used[idx] = True
+    return sum_data_list
+
+
+def get_group_ph_dict(cons_ph_table_data, group_flag):
+    # {repli_name: pH} of the replicates of the group
     all_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
-    print("all_ph_dict: ", all_ph_dict)
-    print()
-    group_ph_dict = dict(filter(lambda i: i[0].startswith(group_flag+"_replicate"), all_ph_dict.items()))
-    print("group_ph_dict: ", group_ph_dict)
-    print()
-    for repli_name, repli_ph in group_ph_dict.items():
-        shift_data_dict = dict()
-        for meta_name in mixture_list:
-            temp_pka = mixture_pka_dict[meta_name]
-            temp_data = np.array(norm_data_dict[meta_name])
-            filtered_signal_subset, delta_acid_base_list = meta_subset_dict[meta_name]
-            temp_data_shift = calculate_peak_shift(temp_data, x_scale, temp_pka, float(repli_ph), filtered_signal_subset,
-                                                delta_acid_base_list)
-            shift_data_dict[meta_name] = temp_data_shift
-        # smooth_data_dict = smooth_spectra(shift_data_dict, 0.05)
-        ph_data_dict[repli_name] = shift_data_dict
-    return group_ph_dict, ph_data_dict
-
-
-def construct_shift_data_continuous_for_all_repli(mixture_list, x_scale, norm_data_dict, meta_subset_dict,
-                                                  mixture_pka_dict, cons_ph_table_data):
-
-    ph_data_dict = dict()
+    return dict(filter(lambda i: i[0].startswith(group_flag+"_replicate"), all_ph_dict.items()))
+
+
+def get_continuous_ph_dict(cons_ph_table_data):
+    # {repli_name: pH} of all the replicates
     all_ph_dict = list(filter(lambda d: d["meta_name"] == 'pH', cons_ph_table_data))[0]
     temp_ph_dict = all_ph_dict.copy()
     del temp_ph_dict['meta_name']
     del temp_ph_dict['hmdb_id']
-    for repli_name, repli_ph in temp_ph_dict.items():
-        shift_data_dict = dict()
-        for meta_name in mixture_list:
-            temp_pka = mixture_pka_dict[meta_name]
-            temp_y = norm_data_dict[meta_name]
-            filtered_signal_subset, delta_acid_base_list = meta_subset_dict[meta_name]
-            temp_y_shift = calculate_peak_shift(temp_y, x_scale, temp_pka, float(repli_ph), filtered_signal_subset,
-                                                delta_acid_base_list)
-            shift_data_dict[meta_name] = temp_y_shift
-        # smooth_data_dict = smooth_spectra(shift_data_dict, 0.05)
-        ph_data_dict[repli_name] = shift_data_dict
-
-    return temp_ph_dict, ph_data_dict
-
-
-
+    return temp_ph_dict
@@ -1,12 +1,14 @@
 import plotly.graph_objects as go
 import numpy as np
 
+from simulate_2D.sparse_spectra import to_dense
+
 
 def plot_jres_spectra(final_data_dict, repli_name, x_scale, y_scale, temp_levels):
     fig = go.Figure()
     config = dict({'scrollZoom': True})
 
-    temp_data = np.array(final_data_dict[repli_name])
+    temp_data = to_dense(final_data_dict[repli_name])
     # # min_level = np.min(temp_data[np.nonzero(temp_data)])
     # max_level = np.max(temp_data)
     # len_data = len(temp_data[np.nonzero(temp_data)])
@@ -86,7 +88,7 @@ def plot_2d_spectra(select_meta_name, processed_data_dict, x_scale, y_scale):
     fig = go.Figure()
     config = dict({'scrollZoom': True})
 
-    temp_data = np.array(processed_data_dict[select_meta_name])
+    temp_data = to_dense(processed_data_dict[select_meta_name])
     max_level = np.max(temp_data)
     print(max_level)
 
@@ -128,10 +130,10 @@ def plot_jres_spectra_peak_shift_page(final_data_dict, repli_name, x_scale, y_sc
     config = dict({'scrollZoom': True})
 
     if repli_name == "replicate_mean":
-        temp_data = np.array(final_data_dict[repli_name])
+        temp_data = to_dense(final_data_dict[repli_name])
     else:
         str_ph, data = final_data_dict[repli_name]
-        temp_data = np.array(data)
+        temp_data = to_dense(data)
         print(str_ph)
 
     print(repli_name)
@@ -219,7 +221,7 @@ def plot_jres_spectra_with_ph(final_data_dict, repli_name, x_scale, y_scale, tem
     config = dict({'scrollZoom': True})
 
     repli_ph, repli_data = final_data_dict[repli_name]
-    temp_data = np.array(repli_data)
+    temp_data = to_dense(repli_data)
     start_level = temp_levels[0]
     end_level = temp_levels[-1]
     levels = np.linspace(start_level, end_level, 10)
@@ -266,7 +268,7 @@ def plot_2d_cosy_spectra(select_meta_name, processed_data_dict, x_scale, y_scale
     fig = go.Figure()
     config = dict({'scrollZoom': True})
 
-    temp_data = np.array(processed_data_dict[select_meta_name])
+    temp_data = to_dense(processed_data_dict[select_meta_name])
     temp_data = temp_data / np.max(temp_data)
     df = temp_data / np.max(temp_data) + 0.0001
     n = int(np.round(np.log10(max(df.max(axis=1)))))
@@ -301,7 +303,7 @@ def plot_cosy_repli_spectra(final_data_dict, repli_name, x_scale, y_scale):
     fig = go.Figure()
     config = dict({'scrollZoom': True})
 
-    temp_data = np.array(final_data_dict[repli_name])
+    temp_data = to_dense(final_data_dict[repli_name])
     temp_data = temp_data / np.max(temp_data)
     df = temp_data / np.max(temp_data) + 0.0001
     n = int(np.round(np.log10(max(df.max(axis=1)))))
@@ -337,7 +339,7 @@ def plot_cosy_repli_spectra_with_ph(final_data_dict, repli_name, x_scale, y_scal
     config = dict({'scrollZoom': True})
 
     temp_ph, temp_data = final_data_dict[repli_name]
-    temp_data = np.array(temp_data)
+    temp_data = to_dense(temp_data)
     temp_data = temp_data / np.max(temp_data)
     df = temp_data / np.max(temp_data) + 0.0001
     n = int(np.round(np.log10(max(df.max(axis=1)))))
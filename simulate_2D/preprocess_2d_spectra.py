@@ -1,25 +1,38 @@
 import pandas as pd
 import numpy as np
-from scipy.signal import convolve2d
+from scipy.signal import convolve2d, fftconvolve
+from scipy.ndimage import uniform_filter1d
 
+from simulate_2D.sparse_spectra import to_sparse
 
-def remove_water_calibration(data_dict, x_scale, y_scale, range_water, range_calibration):
+# windows with more points than this are smoothed with the FFT in smooth_data (method="auto")
+FFT_MIN_WINDOW_SIZE = 1024
+
+
+def get_water_calibration_mask(x_scale, range_water, range_calibration):
+    """
+    boolean mask of the F2 columns whose ppm is strictly inside the water or the calibration range
+    """
+    x_scale = np.asarray(x_scale)
+    in_water = (float(range_water[0]) < x_scale) & (x_scale < float(range_water[1]))
+    in_calibration = (float(range_calibration[0]) < x_scale) & (x_scale < float(range_calibration[1]))
+    return in_water | in_calibration
+
+
+def remove_water_calibration(data_dict, x_scale, y_scale, range_water, range_calibration, inplace=False):
     """
     range_water: a sorted tuple/list, e.g. [4.5, 5.0]
     range_calibration: a sorted tuple/list, e.g. [-0.3, 0.3]
+    inplace: zero the columns of the given arrays directly; by default each spectrum is copied once, because the
+    library spectra are shared (memory-mapped or cached) and must stay untouched
     """
-    removed_data_dict = dict()
+    removed_mask = get_water_calibration_mask(x_scale, range_water, range_calibration)
 
+    removed_data_dict = dict()
     for meta_name, data in data_dict.items():
-        temp_df = pd.DataFrame(data)
-        temp_df.columns = x_scale
-        temp_df.index = y_scale
-
-        for ppm in list(temp_df.columns):
-            # range for water suppression is 4.5-5.0
-            if (float(range_water[0]) < ppm < float(range_water[1])) | (float(range_calibration[0]) < ppm < float(range_calibration[1])):
-                temp_df.loc[:, ppm] = 0
-        removed_data_dict[meta_name] = np.array(temp_df)
+        temp_data = data if inplace else np.array(data)
+        temp_data[:, removed_mask] = 0
+        removed_data_dict[meta_name] = temp_data
 
     return removed_data_dict
 
@@ -36,27 +49,66 @@ def filter_noise(removed_data_dict, threshold):
     return filtered_data_dict
 
 
-def smooth_data(filtered_data_dict, m, n):
+def box_filter_2d(data, m, n, method="auto"):
+    """
+    sum of each m*n window, identical to convolve2d(data, np.ones((m, n)), mode='same', boundary='symm')
+    method: "direct" (convolve2d), "separable" (two 1d running-mean passes, cost independent of the window size),
+    "fft" (fftconvolve on the symmetrically padded data) or "auto"; auto uses the separable passes, and the FFT for
+    windows larger than FFT_MIN_WINDOW_SIZE points, where it accumulates less rounding error than the running means
+    the separable and FFT sums differ from the direct ones by rounding only (~1e-13 of the maximum), and the windows
+    without any non-zero point are set back to exactly 0, so the result keeps the sparsity of the direct sums
+    """
+    m, n = int(m), int(n)
+    data = np.asarray(data, dtype=np.float64)
+    if method == "auto":
+        method = "fft" if m * n > FFT_MIN_WINDOW_SIZE else "separable"
+
+    if method == "direct":
+        return convolve2d(data, np.ones((m, n)), mode='same', boundary='symm')
+    elif method == "separable":
+        box_sum = _separable_box_sum(data, m, n)
+    elif method == "fft":
+        padded_data = np.pad(data, ((m // 2, (m - 1) // 2), (n // 2, (n - 1) // 2)), mode='symmetric')
+        box_sum = fftconvolve(padded_data, np.ones((m, n)), mode='valid')
+    else:
+        raise ValueError("unknown smoothing method: {}".format(method))
+
+    # number of non-zero points in each window; it is an integer up to rounding, so < 0.5 means none
+    support_count = _separable_box_sum((data != 0).astype(np.float64), m, n)
+    box_sum[support_count < 0.5] = 0
+    return box_sum
+
+
+def _separable_box_sum(data, m, n):
+    # ndimage 'reflect' is the same boundary as convolve2d 'symm', and both put the window centre at m // 2
+    temp_data = uniform_filter1d(data, m, axis=0, mode='reflect')
+    return uniform_filter1d(temp_data, n, axis=1, mode='reflect') * (m * n)
+
+
+def smooth_data(filtered_data_dict, m, n, method="auto"):
     """
     m, n: the size of window = m*n, e.g. 3x3
+    method: see box_filter_2d
     """
-    win = np.ones((int(m), int(n)))
-
     smooth_data_dict = dict()
     for meta_name, data in filtered_data_dict.items():
-        temp_data = convolve2d(data, win, mode='same', boundary='symm')
+        temp_data = box_filter_2d(data, m, n, method)
         smooth_data_dict[meta_name] = temp_data
 
     return smooth_data_dict
 
 
-def normalize_data(smooth_data_dict):
+def normalize_data(smooth_data_dict, sparse=False):
+    """
+    sparse: return CSR matrices (see sparse_spectra.py) instead of dense arrays; after filter_noise most points are
+    zero, so the sparse spectra take memory in proportion to the signal
+    """
     norm_data_dict = dict()
     for meta_name, data in smooth_data_dict.items():
         temp_data = np.array(data)
         temp_sum = np.sum(temp_data)
         norm_data = temp_data / temp_sum
-        norm_data_dict[meta_name] = norm_data
+        norm_data_dict[meta_name] = to_sparse(norm_data) if sparse else norm_data
 
         # print(meta_name, " normalize: max is ", np.max(norm_data))
         # print(norm_data.shape)
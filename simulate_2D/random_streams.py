@@ -0,0 +1,46 @@
+import numpy as np
+import zlib
+
+
+def get_seed_sequence(seed=None):
+    """
+    seed: None (fresh entropy from the OS), an int, a SeedSequence or a Generator
+    a Generator is turned into a SeedSequence by drawing its entropy from the generator itself
+    (numpy < 1.25 has no Generator.spawn)
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(0, 2 ** 32, size=4).tolist())
+    return np.random.SeedSequence(seed)
+
+
+def get_rng(seed=None):
+    """
+    numpy Generator for the seed (see get_seed_sequence), a Generator is returned as it is
+    """
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(get_seed_sequence(seed))
+
+
+def _key_to_int(key):
+    if isinstance(key, (int, np.integer)):
+        return int(key)
+    # crc32 is stable between processes, unlike hash() of a str
+    return zlib.crc32(str(key).encode("utf-8"))
+
+
+def get_child_seed_sequence(seed, *keys):
+    """
+    child SeedSequence of seed identified by keys (stage name, group, replicate or metabolite name, ...)
+    the same seed and keys always give the same stream, different keys give independent streams, whatever order the
+    streams are asked for in and whichever process asks for them
+    """
+    root = get_seed_sequence(seed)
+    spawn_key = tuple(root.spawn_key) + tuple(_key_to_int(key) for key in keys)
+    return np.random.SeedSequence(root.entropy, spawn_key=spawn_key, pool_size=root.pool_size)
+
+
+def get_child_rng(seed, *keys):
+    return np.random.default_rng(get_child_seed_sequence(seed, *keys))
@@ -6,57 +6,344 @@ import os
 import glob
 import pathlib
 import re
+import hashlib
+import json
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
+from simulate_2D.match_names import db_names_match_hmdb_names
+from simulate_2D.spectra_library import save_spectra_library, open_spectra_library
 
-def read_2d_data(file_path):
-    base_path = pathlib.Path(__file__).resolve().parents[1]
-    data_path = base_path.joinpath(file_path)
+# bump this whenever the content of the cache changes
+CACHE_VERSION = 1
+# a library build lock file older than this (seconds) is left by a build that did not finish
+LIBRARY_BUILD_TIMEOUT = 3600
 
-    new_path = Path(data_path)
-    dir_list = glob.glob(os.path.join(new_path, '*'))
 
-    data_dict = dict()
-    for sub_dir in dir_list:
-        meta_name = str(sub_dir).split("/")[-1]
+def get_2d_scales(data_type):
+    if data_type == "jres":
+        x_scale = np.linspace(13.129, -3.560, 16384)
+        y_scale = np.linspace(0.0652, -0.0652, 257)
+    else:
+        x_scale = np.linspace(9.78874, -0.212446, 2048)
+        y_scale = np.linspace(9.78874, -0.212446, 2048)
+    return x_scale, y_scale
+
+
+def get_pdata_dir(sub_dir, data_type):
+    """
+    the processed data folder of one metabolite folder, raises FileNotFoundError if there is none
+    data_type: "jres" or "cosy"
+    """
+    if data_type == "jres":
         all_subdirs = [os.path.join(sub_dir, d) for d in os.listdir(sub_dir) if os.path.isdir(os.path.join(sub_dir, d))]
-        try:
-            dest_dir = [d for d in all_subdirs if d.endswith("1")][0] + "/pdata/1"
+        exp_dirs = [d for d in all_subdirs if d.endswith("1")]
+        if not exp_dirs:
+            raise FileNotFoundError("no experiment folder ending with 1 in {}".format(sub_dir))
+        return exp_dirs[0] + "/pdata/1"
+    return sub_dir + "/12/pdata/1"
 
-        # dest_dir = re.sub(r'/\d+/$', '/1/', sub_dir) + "/pdata/1"
-            # print(sub_dir)
-            # # print(all_subdirs)
-            # print(dest_dir)
-            dic, data = ng.bruker.read_pdata(dest_dir, shape=(257, 16384))
-            data[-1, :] = data[0, :]
-            data_dict[meta_name] = data
-        except:
-            continue
 
-    x_scale = np.linspace(13.129, -3.560, 16384)
-    y_scale = np.linspace(0.0652, -0.0652, 257)
+def is_pdata_dir_readable(sub_dir, data_type):
+    # cheap check without reading the spectrum: the processed 2d data file is there
+    try:
+        return os.path.isfile(os.path.join(get_pdata_dir(sub_dir, data_type), "2rr"))
+    except OSError:
+        return False
 
-    return data_dict, x_scale, y_scale
+
+def read_pdata_dir(meta_name, sub_dir, data_type):
+    """
+    read the processed data of one metabolite folder, returns (meta_name, data, seconds, error)
+    data_type: "jres" or "cosy"
+    """
+    start_time = time.time()
+    try:
+        dest_dir = get_pdata_dir(sub_dir, data_type)
+        if data_type == "jres":
+            dic, data = ng.bruker.read_pdata(dest_dir, shape=(257, 16384))
+            data[-1, :] = data[0, :]
+        else:
+            dic, data = ng.bruker.read_pdata(dest_dir)
+        return meta_name, data, time.time() - start_time, None
+    except Exception as e:
+        return meta_name, None, time.time() - start_time, "{}: {}".format(type(e).__name__, e)
 
 
-def read_2d_cosy(file_path):
+def read_all_pdata_dirs(file_path, data_type, num_workers=None, use_processes=False):
+    """
+    read all metabolite folders under file_path in parallel
+    num_workers: size of the pool, None lets concurrent.futures choose
+    use_processes: use a process pool instead of a thread pool
+    returns data_dict and a report list of (meta_name, seconds, error) for every folder, error is None on success
+    """
     base_path = pathlib.Path(__file__).resolve().parents[1]
     data_path = base_path.joinpath(file_path)
 
     new_path = Path(data_path)
     dir_list = glob.glob(os.path.join(new_path, '*'))
 
+    pool_executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with pool_executor(max_workers=num_workers) as executor:
+        future_list = [executor.submit(read_pdata_dir, str(sub_dir).split("/")[-1], sub_dir, data_type)
+                       for sub_dir in dir_list]
+        result_list = [future.result() for future in future_list]
+
     data_dict = dict()
-    for sub_dir in dir_list:
-        meta_name = str(sub_dir).split("/")[-1]
-        try:
-            dest_dir = sub_dir + "/12/pdata/1"
-            dic, data = ng.bruker.read_pdata(dest_dir)
+    report_list = []
+    for meta_name, data, seconds, error in result_list:
+        if error is None:
             data_dict[meta_name] = data
-        except:
-            continue
+        report_list.append((meta_name, seconds, error))
+
+    return data_dict, report_list
+
+
+def print_read_report(file_path, report_list, total_seconds):
+    failed_list = [r for r in report_list if r[2] is not None]
+    print("read {} of {} folders in {} in {:.1f}s".format(len(report_list) - len(failed_list), len(report_list),
+                                                           file_path, total_seconds))
+    for meta_name, seconds, error in sorted(report_list, key=lambda r: r[1], reverse=True)[:5]:
+        print("    slowest: {} {:.2f}s".format(meta_name, seconds))
+    for meta_name, seconds, error in failed_list:
+        print("    failed: {} ({})".format(meta_name, error))
+
+
+class LazySpectraLibrary(Mapping):
+    """
+    dict of metabolite name -> 2d spectrum that reads each metabolite folder on first access
+    read spectra are kept in an LRU cache holding at most max_bytes, the least recently used spectra are evicted first
+    library: an older memory-mapped library (see spectra_library.py) of the same folders, the spectra of the folders
+    not modified since it was built are taken from it instead of being read
+    a folder that fails to read is removed from the dict (and KeyError raised)
+    metadata and library_path: the key and the path of the library it stands for until that library is built (see
+    read_2d_data_with_cache), as in SpectraLibrary
+    """
+    def __init__(self, name_dir_dict, data_type, max_bytes=1024 ** 3, library=None):
+        self.name_dir_dict = dict(name_dir_dict)
+        self.metadata = dict()
+        self.library_path = None
+        self.data_type = data_type
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+        self.library = None
+        self.library_names = set()
+        if library is not None:
+            self.use_library(library)
+
+    def use_library(self, library):
+        """
+        take the spectra of the unmodified folders from library from now on, see get_library_folder_mtimes
+        """
+        folder_mtimes = library.metadata.get("folder_mtimes", dict())
+        library_names = set()
+        for meta_name, sub_dir in list(self.name_dir_dict.items()):
+            if meta_name in library and folder_mtimes.get(meta_name) == [os.path.basename(sub_dir),
+                                                                          get_folder_mtime(sub_dir)]:
+                library_names.add(meta_name)
+        with self.lock:
+            self.library = library
+            self.library_names = library_names
+            # the spectra now in the library are no longer needed in memory
+            for meta_name in library_names & set(self.cache):
+                self.cache_bytes -= self.cache.pop(meta_name).nbytes
+
+    def __getitem__(self, meta_name):
+        with self.lock:
+            if meta_name in self.library_names:
+                return self.library[meta_name]
+            if meta_name in self.cache:
+                self.cache.move_to_end(meta_name)
+                return self.cache[meta_name]
+            sub_dir = self.name_dir_dict[meta_name]
+
+        _, data, seconds, error = read_pdata_dir(meta_name, sub_dir, self.data_type)
+        if error is not None:
+            with self.lock:
+                self.name_dir_dict.pop(meta_name, None)
+            raise KeyError("cannot read {} from {}: {}".format(meta_name, sub_dir, error))
+
+        with self.lock:
+            if meta_name not in self.cache:
+                self.cache[meta_name] = data
+                self.cache_bytes += data.nbytes
+            while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+                evicted_name, evicted_data = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted_data.nbytes
+            return self.cache.get(meta_name, data)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.name_dir_dict))
+
+    def __len__(self):
+        return len(self.name_dir_dict)
+
+    def __contains__(self, meta_name):
+        return meta_name in self.name_dir_dict
 
-    x_scale = np.linspace(9.78874, -0.212446, 2048)
-    y_scale = np.linspace(9.78874, -0.212446, 2048)
 
+def get_name_dir_dict(file_path, data_type, hmdb_dict=None):
+    """
+    metabolite name -> folder of the folders under file_path that hold processed 2d data (see is_pdata_dir_readable)
+    hmdb_dict: if given, only the names matching HMDB names are kept (see db_names_match_hmdb_names)
+    """
+    base_path = pathlib.Path(__file__).resolve().parents[1]
+    data_path = base_path.joinpath(file_path)
+    dir_list = [d for d in glob.glob(os.path.join(Path(data_path), '*'))
+                if os.path.isdir(d) and is_pdata_dir_readable(d, data_type)]
+
+    name_dir_dict = {str(sub_dir).split("/")[-1]: sub_dir for sub_dir in dir_list}
+    if hmdb_dict is not None:
+        name_dir_dict = db_names_match_hmdb_names(name_dir_dict, hmdb_dict)
+    return name_dir_dict
+
+
+def get_library_folder_mtimes(name_dir_dict):
+    # metabolite name -> [folder name, get_folder_mtime], stored with a library to reuse it when it is out of date
+    return {meta_name: [os.path.basename(sub_dir), get_folder_mtime(sub_dir)]
+            for meta_name, sub_dir in name_dir_dict.items()}
+
+
+def read_2d_data_lazy(file_path, data_type, hmdb_dict=None, max_bytes=1024 ** 3, library=None):
+    """
+    list the metabolite folders under file_path without reading them, see LazySpectraLibrary
+    hmdb_dict: if given, only the names matching HMDB names are kept (see db_names_match_hmdb_names)
+    """
+    name_dir_dict = get_name_dir_dict(file_path, data_type, hmdb_dict)
+    x_scale, y_scale = get_2d_scales(data_type)
+    return LazySpectraLibrary(name_dir_dict, data_type, max_bytes, library), x_scale, y_scale
+
+
+def read_2d_data(file_path, num_workers=None, use_processes=False):
+    start_time = time.time()
+    data_dict, report_list = read_all_pdata_dirs(file_path, "jres", num_workers, use_processes)
+    print_read_report(file_path, report_list, time.time() - start_time)
+    x_scale, y_scale = get_2d_scales("jres")
+    return data_dict, x_scale, y_scale
+
+
+def read_2d_cosy(file_path, num_workers=None, use_processes=False):
+    start_time = time.time()
+    data_dict, report_list = read_all_pdata_dirs(file_path, "cosy", num_workers, use_processes)
+    print_read_report(file_path, report_list, time.time() - start_time)
+    x_scale, y_scale = get_2d_scales("cosy")
     return data_dict, x_scale, y_scale
 
+
+def get_folder_mtime(path):
+    """
+    latest modification time of path and, for a folder, of everything inside it (acqus, pdata/1/..., ...)
+    """
+    mtime = os.stat(path).st_mtime
+    if os.path.isdir(path):
+        for dir_path, dir_names, file_names in os.walk(path):
+            for name in dir_names + file_names:
+                try:
+                    mtime = max(mtime, os.stat(os.path.join(dir_path, name)).st_mtime)
+                except FileNotFoundError:
+                    # broken link or removed in the meantime
+                    pass
+    return mtime
+
+
+def get_hmdb_dict_hash(hmdb_dict):
+    # hash of the HMDB ID -> names content, the matched names depend on both
+    id_names_list = [[idx, list(hmdb_dict[idx])] for idx in sorted(hmdb_dict.keys())]
+    return hashlib.md5(json.dumps(id_names_list).encode("utf-8")).hexdigest()
+
+
+def get_2d_cache_key(data_path, read_func, hmdb_dict=None):
+    """
+    the key changes when any Bruker folder is added, removed or modified (any file inside it, see get_folder_mtime), when the reading function changes,
+    or when the HMDB IDs or names used for name matching change
+    """
+    folder_mtimes = sorted((entry.name, get_folder_mtime(entry.path)) for entry in os.scandir(str(data_path)))
+    hmdb_hash = get_hmdb_dict_hash(hmdb_dict) if hmdb_dict is not None else None
+    key_dict = {"version": CACHE_VERSION, "read_func": read_func.__name__, "folder_mtimes": folder_mtimes,
+                "hmdb_ids": hmdb_hash}
+    return json.dumps(key_dict, sort_keys=True)
+
+
+def build_2d_library(file_path, read_func, hmdb_dict, library_path, cache_key, num_workers=None):
+    """
+    read every folder with read_func (num_workers parallel readers) and save them as the spectra library of
+    library_path; returns the opened library, and its scales
+    """
+    data_type = "cosy" if read_func is read_2d_cosy else "jres"
+    name_dir_dict = get_name_dir_dict(file_path, data_type, hmdb_dict)
+    data_dict, x_scale, y_scale = read_func(file_path, num_workers)
+    if hmdb_dict is not None:
+        data_dict = db_names_match_hmdb_names(data_dict, hmdb_dict)
+
+    save_spectra_library(data_dict, library_path, {"key": cache_key, "x_scale": np.asarray(x_scale).tolist(),
+                                                   "y_scale": np.asarray(y_scale).tolist(),
+                                                   "folder_mtimes": get_library_folder_mtimes(name_dir_dict)})
+    return open_spectra_library(library_path), x_scale, y_scale
+
+
+def build_2d_library_in_background(lazy_library, *build_args):
+    """
+    build_2d_library in a daemon thread, then let lazy_library use it; a lock file next to the library makes sure
+    only one process of the server builds it
+    """
+    library_path = pathlib.Path(build_args[3])
+    lock_file = library_path.with_name(library_path.name + ".lock")
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    if lock_file.exists() and time.time() - lock_file.stat().st_mtime > LIBRARY_BUILD_TIMEOUT:
+        # left by a build that did not finish
+        lock_file.unlink()
+    try:
+        os.close(os.open(str(lock_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return None
+
+    def build():
+        try:
+            library, _, _ = build_2d_library(*build_args)
+            if library is not None:
+                lazy_library.use_library(library)
+        except Exception as e:
+            print("cannot build the spectra library {}: {}".format(library_path, e))
+        finally:
+            lock_file.unlink()
+
+    thread = threading.Thread(target=build, daemon=True)
+    thread.start()
+    return thread
+
+
+def read_2d_data_with_cache(file_path, read_func=read_2d_data, hmdb_dict=None, cache_dir="Input/cache",
+                            num_workers=None, lazy=False, max_bytes=1024 ** 3):
+    """
+    read 2d data (read_2d_data for JRes, read_2d_cosy for COSY) through an on-disk spectra library
+    (see spectra_library.py); the returned data dict is memory-mapped, so each worker process only touches
+    the spectra of the selected metabolites
+    hmdb_dict: if given, only the names matching HMDB names are kept (see db_names_match_hmdb_names)
+    num_workers: number of parallel readers used when the library has to be (re)built
+    lazy: if the library is missing or out of date, return a LazySpectraLibrary (bounded by max_bytes) right away,
+    which takes the unmodified spectra from the old library, and (re)build the library in the background
+    """
+    base_path = pathlib.Path(__file__).resolve().parents[1]
+    data_path = base_path.joinpath(file_path)
+    library_path = base_path.joinpath(cache_dir, data_path.name + "_" + read_func.__name__ + "_library")
+    cache_key = get_2d_cache_key(data_path, read_func, hmdb_dict)
+
+    library = open_spectra_library(library_path)
+    if library is not None and library.metadata.get("key") == cache_key:
+        return library, np.array(library.metadata["x_scale"]), np.array(library.metadata["y_scale"])
+    if lazy:
+        data_type = "cosy" if read_func is read_2d_cosy else "jres"
+        lazy_library, x_scale, y_scale = read_2d_data_lazy(file_path, data_type, hmdb_dict, max_bytes, library)
+        lazy_library.metadata["key"] = cache_key
+        lazy_library.library_path = library_path
+        build_2d_library_in_background(lazy_library, file_path, read_func, hmdb_dict, library_path, cache_key,
+                                       num_workers)
+        return lazy_library, x_scale, y_scale
+
+    return build_2d_library(file_path, read_func, hmdb_dict, library_path, cache_key, num_workers)
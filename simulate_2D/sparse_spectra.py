@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import sparse
+
+
+def is_encoded_sparse(data):
+    return isinstance(data, dict) and data.get("format") == "csr"
+
+
+def to_sparse(data):
+    """
+    CSR matrix of a 2d spectrum given as a dense array/nested list, a scipy sparse matrix or an encoded dict
+    (see encode_sparse)
+    """
+    if sparse.issparse(data):
+        return sparse.csr_matrix(data, dtype=np.float64)
+    if is_encoded_sparse(data):
+        return sparse.csr_matrix((np.asarray(data["data"], dtype=np.float64), np.asarray(data["indices"]),
+                                  np.asarray(data["indptr"])), shape=tuple(data["shape"]))
+    return sparse.csr_matrix(np.asarray(data, dtype=np.float64))
+
+
+def to_dense(data):
+    """
+    dense array of a 2d spectrum in any of the forms accepted by to_sparse
+    """
+    if sparse.issparse(data) or is_encoded_sparse(data):
+        return to_sparse(data).toarray()
+    return np.array(data)
+
+
+def encode_sparse(data):
+    """
+    JSON-serializable form of a 2d spectrum, only the non-zero points are kept, so the size of the encoded spectrum
+    (e.g. in a dcc.Store) scales with the signal, not with the grid
+    """
+    matrix = to_sparse(data)
+    if not np.all(matrix.data):
+        # eliminate_zeros works in place, the caller's matrix is left untouched
+        matrix = matrix.copy()
+        matrix.eliminate_zeros()
+    return {
+        "format": "csr",
+        "shape": list(matrix.shape),
+        "data": matrix.data.tolist(),
+        "indices": matrix.indices.tolist(),
+        "indptr": matrix.indptr.tolist(),
+    }
+
+
+def encode_sparse_dict(data_dict):
+    return {name: encode_sparse(data) for name, data in data_dict.items()}
+
+
+def sum_sparse_spectra(weight_data_list):
+    """
+    weighted sum of 2d spectra, weight_data_list: [(weight, spectrum), ...] with spectra in any of the forms accepted
+    by to_sparse; the result is a CSR matrix
+    """
+    sum_data = None
+    for weight, data in weight_data_list:
+        temp_intensity = to_sparse(data) * weight
+        sum_data = temp_intensity if sum_data is None else sum_data + temp_intensity
+    if sum_data is None:
+        return sparse.csr_matrix((0, 0), dtype=np.float64)
+    return sum_data
+
+
+def to_sparse_dict(data_dict):
+    return {name: to_sparse(data) for name, data in data_dict.items()}
+
+
+def _convert_replicate_dict(replicate_dict, convert_func):
+    converted_dict = dict()
+    for repli_name, value in replicate_dict.items():
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            converted_dict[repli_name] = [value[0], convert_func(value[1])]
+        else:
+            converted_dict[repli_name] = convert_func(value)
+    return converted_dict
+
+
+def encode_replicate_dict(replicate_dict):
+    """
+    encode the simulated replicates, the values are either spectra or [pH, spectrum] pairs (with peak shift)
+    """
+    return _convert_replicate_dict(replicate_dict, encode_sparse)
+
+
+def to_sparse_replicate_dict(replicate_dict):
+    """
+    CSR matrices of the simulated replicates (see encode_replicate_dict), for results kept on the server
+    """
+    return _convert_replicate_dict(replicate_dict, to_sparse)